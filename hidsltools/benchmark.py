@@ -0,0 +1,517 @@
+"""End-to-end benchmarks on synthetic reference roots."""
+
+from __future__ import annotations
+from argparse import ArgumentParser, Namespace
+from contextlib import contextmanager
+from json import dump, load
+from logging import DEBUG, INFO, basicConfig
+from os import geteuid
+from pathlib import Path
+from random import Random
+from shutil import copytree, which
+from subprocess import PIPE
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Iterator
+
+from hidsltools.bsdtar import extract
+from hidsltools.device import Device
+from hidsltools.errorhandler import ErrorHandler
+from hidsltools.functions import exe
+from hidsltools.image import make_image
+from hidsltools.logging import FORMAT, LOGGER
+from hidsltools.manifest import read_manifest, verify
+from hidsltools.mkfs import get_size, mkfs, tune_ext4
+from hidsltools.mount import MountContext
+from hidsltools.reset import reset
+from hidsltools.sgdisk import mkparts
+from hidsltools.sidecar import read_sidecar
+from hidsltools.types import Compression, Filesystem, MkfsProfile, Timing
+from hidsltools.unpack import unpack
+
+
+__all__ = ["main", "mkroot", "run"]
+
+
+HOMES = {"digsig": "/home/digsig", "homeinfo": "/home/homeinfo", "root": "/root"}
+LOSETUP = "/usr/bin/losetup"
+MIB = 1024 * 1024
+UNITS = {
+    "application.service": "multi-user.target",
+    "unconfigured-warning.service": "graphical.target",
+}
+
+
+def write_file(file: Path, size: int, rng: Random) -> None:
+    """Writes a file with about 50 % compressible content."""
+
+    file.parent.mkdir(parents=True, exist_ok=True)
+    chunk = rng.randbytes(min(size, MIB) // 2)
+    chunk += bytes(len(chunk))
+
+    with file.open("wb") as handle:
+        for _ in range(size // len(chunk) if chunk else 0):
+            handle.write(chunk)
+
+        handle.write(chunk[: size % len(chunk)] if chunk else bytes(size))
+
+
+def mkroot(
+    root: Path,
+    *,
+    small: int = 10000,
+    large: int = 4,
+    large_size: int = 64 * MIB,
+    sparse: int = 2,
+    symlinks: int = 1000,
+    seed: int = 0,
+) -> int:
+    """Creates a synthetic reference root and returns its size in bytes."""
+
+    rng = Random(seed)
+    size = 0
+    (etc := root / "etc").mkdir(parents=True)
+    (etc / "passwd").write_text(
+        "".join(
+            f"{user}:x:{uid}:{uid}::{home}:/bin/bash\n"
+            for uid, (user, home) in enumerate(sorted(HOMES.items()), start=1000)
+        ),
+        encoding="utf-8",
+    )
+    (etc / "group").write_text(
+        "".join(
+            f"{user}:x:{gid}:\n" for gid, user in enumerate(sorted(HOMES), start=1000)
+        ),
+        encoding="utf-8",
+    )
+    (etc / "pacman.conf").write_text("[options]\n[core]\n", encoding="utf-8")
+    (etc / "openvpn" / "client").mkdir(parents=True)
+    (etc / "openvpn" / "client" / "client.conf").write_text("", encoding="utf-8")
+
+    for unit, target in UNITS.items():
+        unit_file = root / "usr/lib/systemd/system" / unit
+        unit_file.parent.mkdir(parents=True, exist_ok=True)
+        unit_file.write_text(f"[Install]\nWantedBy={target}\n", encoding="utf-8")
+        link = etc / f"systemd/system/{target}.wants" / unit
+        link.parent.mkdir(parents=True, exist_ok=True)
+        link.symlink_to(Path("/usr/lib/systemd/system") / unit)
+
+    for name in ("var/cache/pacman/pkg", "var/lib/pacman/local", "var/log/journal"):
+        (root / name).mkdir(parents=True)
+
+    (root / "var/cache/pacman/pkg/bench-1-1-any.pkg.tar.zst").write_bytes(bytes(MIB))
+    homes = sorted(HOMES.values())
+
+    for index in range(small):
+        if index % 10 == 0:
+            file = root / homes[index % len(homes)][1:] / f"{index}.dat"
+        else:
+            file = root / "usr/share/bench" / f"{index // 100:04d}" / f"{index}.txt"
+
+        write_file(file, length := rng.randrange(64, 16384), rng)
+        size += length
+
+    for index in range(large):
+        write_file(root / "var/lib/bench" / f"{index}.bin", large_size, rng)
+        size += large_size
+
+    for index in range(sparse):
+        (file := root / "var/lib/bench" / f"{index}.img").parent.mkdir(
+            parents=True, exist_ok=True
+        )
+
+        with file.open("wb") as handle:
+            # Data at both ends, like a preallocated disk image.
+            handle.write(rng.randbytes(MIB))
+            handle.seek(max(large_size, 2 * MIB) - MIB)
+            handle.write(rng.randbytes(MIB))
+
+        size += max(large_size, 2 * MIB)
+
+    for index in range(symlinks):
+        link = root / "usr/lib/bench" / f"{index}.link"
+        link.parent.mkdir(parents=True, exist_ok=True)
+        target = rng.randrange(small) if small else index
+        link.symlink_to(f"../../share/bench/{target // 100:04d}/{target}.txt")
+
+    return size
+
+
+@contextmanager
+def timed(timings: list[Timing], phase: str, size: int = 0) -> Iterator[None]:
+    """Records the duration of the phase."""
+
+    LOGGER.info("Running phase %s.", phase)
+    start = perf_counter()
+    yield
+    timings.append(timing := Timing(phase, perf_counter() - start, size))
+    LOGGER.info(
+        "Phase %s took %.3f s (%.1f MiB/s).",
+        phase,
+        timing.seconds,
+        timing.throughput / MIB,
+    )
+
+
+@contextmanager
+def loop_device(file: Path, size: int) -> Iterator[Device]:
+    """Sets up a loop device backed by a sparse file."""
+
+    with file.open("wb") as handle:
+        handle.truncate(size)
+
+    command = [LOSETUP, "--find", "--show", "--partscan", str(file)]
+    device = Device(exe(command, stdout=PIPE).stdout.decode().strip())
+
+    try:
+        yield device
+    finally:
+        exe([LOSETUP, "--detach", str(device)])
+
+
+def bench_image(root: Path, image: Path, args: Namespace) -> list[Timing]:
+    """Benchmarks the image creation."""
+
+    timings = []
+
+    with timed(timings, "image", args.size):
+        make_image(
+            {args.compression: image},
+            Namespace(
+                root=root,
+                compression_level=args.compression_level,
+                sort=args.sort,
+                reproducible=False,
+                manifest=True,
+                prefetch=0,
+                sparse=True,
+                verbose=args.verbose,
+            ),
+        )
+
+    return timings
+
+
+def bench_restore_root(image: Path, target: Path, args: Namespace) -> list[Timing]:
+    """Benchmarks the extraction of the image into a directory
+    and its verification against the image manifest.
+
+    The configure and initramfs phases of restore_image() run tools
+    of the restored system, which a synthetic root does not contain.
+    """
+
+    timings = []
+    target.mkdir()
+
+    with timed(timings, "restore.root", args.size):
+        extract(image, target, verbose=args.verbose)
+
+    with timed(timings, "restore.root.verify", args.size):
+        divergences = verify(target, read_manifest(image), workers=args.jobs)
+
+    for divergence in divergences:
+        LOGGER.warning("Restored tree diverges: %s", divergence)
+
+    (native := target.with_name(f"{target.name}.native")).mkdir()
+
+    with timed(timings, "restore.root.native", args.size):
+        unpack(image, native, compression=args.compression, workers=args.jobs)
+
+    return timings
+
+
+def suffix(profile: MkfsProfile) -> str:
+    """Returns the timing phase suffix of the mkfs profile."""
+
+    return "" if profile is MkfsProfile.DEFAULT else f".{profile}"
+
+
+def bench_restore_loop(image: Path, backing: Path, args: Namespace) -> list[Timing]:
+    """Benchmarks a full restore onto a loop device with each mkfs profile."""
+
+    timings = []
+    metadata = read_sidecar(image)
+
+    with loop_device(backing, args.loop_size * MIB) as device:
+        with timed(timings, "restore.loop.partition"):
+            partitions = list(mkparts(device, verbose=args.verbose))
+
+        for profile in args.mkfs_profiles or MkfsProfile:
+            with timed(timings, f"restore.loop.mkfs{suffix(profile)}"):
+                for partition in partitions:
+                    options = {}
+
+                    if partition.filesystem is Filesystem.EXT4:
+                        options["options"] = tune_ext4(
+                            get_size(partition.device),
+                            profile=profile,
+                            metadata=metadata,
+                            info=device.info,
+                        )
+
+                    mkfs(
+                        partition.device,
+                        partition.filesystem,
+                        label=partition.label,
+                        verbose=args.verbose,
+                        **options,
+                    )
+
+            phase = f"restore.loop.extract{suffix(profile)}"
+
+            with TemporaryDirectory() as tmpd:
+                mounts = MountContext(partitions, root=tmpd, verbose=args.verbose)
+
+                with mounts as target:
+                    with timed(timings, phase, args.size):
+                        extract(image, target, verbose=args.verbose)
+
+    return timings
+
+
+def bench_reset(root: Path, copy: Path, args: Namespace) -> list[Timing]:
+    """Benchmarks the reset on a copy of the root."""
+
+    timings = []
+
+    with timed(timings, "reset.copy", args.size):
+        copytree(root, copy, symlinks=True)
+
+    with timed(timings, "reset"):
+        reset(
+            Namespace(
+                root=copy,
+                force=True,
+                ignore=False,
+                dry_run=False,
+                verbose=args.verbose,
+            )
+        )
+
+    return timings
+
+
+def loop_supported() -> bool:
+    """Checks whether loop devices can be set up."""
+
+    return geteuid() == 0 and which(LOSETUP) is not None
+
+
+def run(workdir: Path, args: Namespace) -> list[Timing]:
+    """Runs all benchmarks within the working directory."""
+
+    timings = []
+    root = workdir / "root"
+    image = workdir / f"image.bsdtar.{args.compression.suffix}"
+
+    with timed(timings, "mkroot"):
+        args.size = mkroot(
+            root,
+            small=args.small,
+            large=args.large,
+            large_size=args.large_size * MIB,
+            sparse=args.sparse,
+            symlinks=args.symlinks,
+            seed=args.seed,
+        )
+
+    timings += bench_image(root, image, args)
+
+    if (metadata := read_sidecar(image)) is not None:
+        args.size = metadata.size
+
+    timings += bench_restore_root(image, workdir / "target", args)
+
+    if args.loop and loop_supported():
+        timings += bench_restore_loop(image, workdir / "loop.img", args)
+    elif args.loop:
+        LOGGER.warning("Loop devices require root privileges and losetup.")
+
+    timings += bench_reset(root, workdir / "reset", args)
+    return timings
+
+
+def compare(timings: list[Timing], baseline: list[Timing], tolerance: float) -> int:
+    """Compares the timings to a baseline and returns the amount of regressions."""
+
+    previous = {timing.phase: timing for timing in baseline}
+    regressions = 0
+
+    for timing in timings:
+        if (reference := previous.get(timing.phase)) is None:
+            LOGGER.info("%s: %.3f s (new)", timing.phase, timing.seconds)
+            continue
+
+        delta = (timing.seconds - reference.seconds) / (reference.seconds or 1)
+
+        if delta > tolerance:
+            regressions += 1
+            log = LOGGER.warning
+        else:
+            log = LOGGER.info
+
+        log("%s: %.3f s (%+.1f %%)", timing.phase, timing.seconds, delta * 100)
+
+    return regressions
+
+
+def read_timings(file: Path) -> list[Timing]:
+    """Reads timings from a JSON file."""
+
+    with file.open("r", encoding="utf-8") as handle:
+        return [Timing.from_json(timing) for timing in load(handle)["timings"]]
+
+
+def write_timings(file: Path, timings: list[Timing], args: Namespace) -> None:
+    """Writes the timings and the benchmark parameters to a JSON file."""
+
+    with file.open("w", encoding="utf-8") as handle:
+        dump(
+            {
+                "parameters": {
+                    "small": args.small,
+                    "large": args.large,
+                    "large_size": args.large_size,
+                    "sparse": args.sparse,
+                    "symlinks": args.symlinks,
+                    "seed": args.seed,
+                    "compression": args.compression.full_name,
+                    "compression_level": args.compression_level,
+                    "sort": args.sort,
+                    "size": args.size,
+                },
+                "timings": [timing.to_json() for timing in timings],
+            },
+            handle,
+            indent=2,
+        )
+
+
+def get_args() -> Namespace:
+    """Returns the CLI arguments."""
+
+    parser = ArgumentParser(
+        description=(
+            "Benchmarks image creation, extraction, verification and reset. "
+            "The configure and initramfs phases of a restore need a real "
+            "reference system and are not measured."
+        )
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=Path,
+        metavar="file",
+        default=Path("benchmark.json"),
+        help="write the timings to this JSON file",
+    )
+    parser.add_argument(
+        "-b", "--baseline", type=Path, metavar="file", help="compare to these timings"
+    )
+    parser.add_argument(
+        "-t",
+        "--tolerance",
+        type=float,
+        metavar="fraction",
+        default=0.1,
+        help="allowed slowdown compared to the baseline",
+    )
+    parser.add_argument(
+        "-w", "--workdir", type=Path, metavar="dir", help="working directory"
+    )
+    parser.add_argument(
+        "--small", type=int, metavar="n", default=10000, help="amount of small files"
+    )
+    parser.add_argument(
+        "--large", type=int, metavar="n", default=4, help="amount of large files"
+    )
+    parser.add_argument(
+        "--large-size",
+        type=int,
+        metavar="MiB",
+        default=64,
+        help="size of the large files",
+    )
+    parser.add_argument(
+        "--sparse",
+        type=int,
+        metavar="n",
+        default=2,
+        help="amount of sparse files of the large size",
+    )
+    parser.add_argument(
+        "--symlinks", type=int, metavar="n", default=1000, help="amount of symlinks"
+    )
+    parser.add_argument(
+        "--seed", type=int, default=0, help="seed of the synthetic file contents"
+    )
+    parser.add_argument(
+        "-x",
+        "--compression",
+        type=Compression.from_name,
+        metavar="compression",
+        default=Compression.LZOP,
+        help="compression algorithm",
+    )
+    parser.add_argument(
+        "-l",
+        "--compression-level",
+        type=int,
+        metavar="level",
+        default=9,
+        help="compression level",
+    )
+    parser.add_argument(
+        "-s", "--sort", action="store_true", help="sort the archive members"
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        metavar="n",
+        help="amount of parallel writers of the in-process extraction",
+    )
+    parser.add_argument(
+        "-L", "--loop", action="store_true", help="also restore onto a loop device"
+    )
+    parser.add_argument(
+        "--loop-size",
+        type=int,
+        metavar="MiB",
+        default=2048,
+        help="size of the loop device",
+    )
+    parser.add_argument(
+        "-P",
+        "--mkfs-profile",
+        type=MkfsProfile,
+        action="append",
+        metavar="profile",
+        dest="mkfs_profiles",
+        help="benchmark the loop restore with this mkfs profile (default: all)",
+    )
+    parser.add_argument(
+        "-v", "--verbose", action="store_true", help="show output of subprocesses"
+    )
+    parser.add_argument(
+        "-d", "--debug", action="store_true", help="enable verbose logging"
+    )
+    return parser.parse_args()
+
+
+def main() -> int:
+    """Runs the benchmarks."""
+
+    args = get_args()
+    basicConfig(format=FORMAT, level=DEBUG if args.debug else INFO)
+
+    with ErrorHandler(LOGGER):
+        with TemporaryDirectory(dir=args.workdir) as tmpd:
+            timings = run(Path(tmpd), args)
+
+        write_timings(args.output, timings, args)
+
+        if args.baseline is None:
+            return 0
+
+        return 1 if compare(timings, read_timings(args.baseline), args.tolerance) else 0
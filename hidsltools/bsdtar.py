@@ -1,34 +1,117 @@
 """Bsdtar invocation."""
 
+from functools import cache
+from os import fsencode
 from pathlib import Path
+from shutil import which
+from subprocess import PIPE
+from tempfile import NamedTemporaryFile
+from typing import Callable, Iterable
 
 from hidsltools.functions import exe
-from hidsltools.types import Compression
+from hidsltools.logging import LOGGER
+from hidsltools.types import Compression, Member
 
 
-__all__ = ["bsdtar", "create", "extract"]
+__all__ = ["bsdtar", "create", "extract", "supports"]
 
 
 BSDTAR = "/usr/bin/bsdtar"
+LIBRARIES = {
+    Compression.XZ: "liblzma",
+    Compression.LZMA: "liblzma",
+    Compression.BZIP2: "bz2lib",
+    Compression.ZSTD: "libzstd",
+    Compression.LZ4: "liblz4",
+    Compression.GZIP: "zlib",
+    Compression.LZOP: "liblzo2",
+}
+LISTINGS = (b"a ", b"x ")  # Prefixes of verbose listing lines.
+PROGRESS_STEP = 10  # Percent
+
+
+@cache
+def libraries() -> frozenset[str]:
+    """Returns the names of the libraries bsdtar is linked against."""
+
+    output = exe([BSDTAR, "--version"], stdout=PIPE).stdout.decode()
+    return frozenset(word.split("/")[0] for word in output.split() if "/" in word)
+
+
+def supports(compression: Compression) -> bool:
+    """Checks whether bsdtar can decompress the given compression.
+
+    libarchive falls back to the respective external program if it
+    was not linked against the compression library.
+    """
+
+    if LIBRARIES.get(compression) in libraries():
+        return True
+
+    return which(compression.full_name) is not None
+
+
+def progress_logger(total: int) -> Callable[[bytes], None]:
+    """Returns a callback logging the progress of verbose bsdtar output.
+
+    Only listing lines are counted, not warnings.
+    """
+
+    count = 0
+    logged = 0
+
+    def log_progress(line: bytes) -> None:
+        nonlocal count, logged
+
+        if not line.startswith(LISTINGS):
+            return
+
+        count += 1
+
+        if (percent := min(100 * count // total, 100)) >= logged + PROGRESS_STEP:
+            logged = percent - percent % PROGRESS_STEP
+            LOGGER.info("Extracted %i of %i files (%i%%).", count, total, percent)
+
+    return log_progress
 
 
 def bsdtar(
-    tarball: Path,
+    tarball: Path | int,
     *files: Path,
     chdir: Path | None = None,
+    files_from: Path | None = None,
+    numeric_owner: bool = False,
+    sparse: bool = True,
     compression: Compression = Compression.LZOP,
     compression_level: int = 9,
+    on_member: Callable[[bytes], None] | None = None,
     verbose: bool = False,
 ) -> None:
-    """Creates a tarball from the given files."""
+    """Creates a tarball from the given files.
 
-    command = [BSDTAR, "-c", "-p", "-f", str(tarball)]
+    If the tarball is an fd, the archive is written to it.
+    If files_from is given, the NUL-separated member names are read from
+    that file and archived without recursing into directories.
+    If sparse is True, holes are recorded instead of archiving zeros.
+    If on_member is given, it is called with each member's listing line.
+    """
+
+    stdout = tarball if isinstance(tarball, int) else None
+    command = [BSDTAR, "-c", "-p", "-f", "-" if stdout is not None else str(tarball)]
     options = []
 
     if chdir:
         command += ["-C", str(chdir)]
 
-    if verbose:
+    if files_from is not None:
+        command += ["--null", "-n", "-T", str(files_from)]
+
+    if numeric_owner:
+        command.append("--numeric-owner")
+
+    command.append("--read-sparse" if sparse else "--no-read-sparse")
+
+    if verbose or on_member is not None:
         command.append("-v")
 
     if compression is not None:
@@ -40,41 +123,85 @@ def bsdtar(
     if options:
         command += ["--options", ",".join(options)]
 
-    exe([*command, *files], verbose=verbose)
+    exe([*command, *files], stdout=stdout, verbose=verbose, on_stderr=on_member)
 
 
 def create(
-    tarball: Path,
+    tarball: Path | int,
     root: Path,
     *,
+    members: Iterable[Member] | None = None,
+    numeric_owner: bool = False,
+    sparse: bool = True,
     compression: Compression = Compression.LZOP,
     compression_level: int = 9,
+    on_member: Callable[[bytes], None] | None = None,
     verbose: bool = False,
 ) -> None:
-    """Creates a tarball from a root file system mount point."""
-
-    files = [inode.relative_to(root) for inode in root.iterdir()]
-    return bsdtar(
-        tarball,
-        *files,
-        chdir=root,
-        compression=compression,
-        compression_level=compression_level,
-        verbose=verbose,
-    )
+    """Creates a tarball from a root file system mount point.
+
+    If members are given, exactly those are archived in the given order.
+    """
+
+    if members is None:
+        files = [inode.relative_to(root) for inode in root.iterdir()]
+        return bsdtar(
+            tarball,
+            *files,
+            chdir=root,
+            numeric_owner=numeric_owner,
+            sparse=sparse,
+            compression=compression,
+            compression_level=compression_level,
+            on_member=on_member,
+            verbose=verbose,
+        )
+
+    with NamedTemporaryFile("wb", suffix=".lst") as file_list:
+        for member in members:
+            file_list.write(fsencode(member.path))
+            file_list.write(b"\0")
+
+        file_list.flush()
+        return bsdtar(
+            tarball,
+            chdir=root,
+            files_from=Path(file_list.name),
+            numeric_owner=numeric_owner,
+            sparse=sparse,
+            compression=compression,
+            compression_level=compression_level,
+            on_member=on_member,
+            verbose=verbose,
+        )
 
 
 def extract(
-    tarball: Path, target: Path | None = None, *, verbose: bool = False
+    tarball: Path | int,
+    target: Path | None = None,
+    *,
+    total: int | None = None,
+    sparse: bool = True,
+    verbose: bool = False,
 ) -> None:
-    """Extracts an image using bsdtar."""
+    """Extracts an image using bsdtar.
+
+    If the total amount of files is known, the progress is logged.
+    If sparse is True, holes and blocks of zeros are not written.
+    If tarball is an fd, the archive is read from it.
+    """
+
+    stdin = tarball if isinstance(tarball, int) else None
+    command = [BSDTAR, "-x", "-p", "-f", "-" if stdin is not None else str(tarball)]
 
-    command = [BSDTAR, "-x", "-p", "-f", str(tarball)]
+    if sparse:
+        command.append("-S")
 
-    if verbose:
+    if verbose or total:
         command.append("-v")
 
     if target is not None:
         command += ["-C", str(target)]
 
-    exe(command, verbose=verbose)
+    on_stderr = progress_logger(total) if total else None
+    exe(command, stdin=stdin, verbose=verbose, on_stderr=on_stderr)
@@ -0,0 +1,130 @@
+"""Checkpoint journals of resumable restores."""
+
+from __future__ import annotations
+from json import dump, load
+from os import fsync
+from pathlib import Path
+from typing import Callable, Iterable
+
+from hidsltools.defaults import JOURNALS
+from hidsltools.logging import LOGGER
+from hidsltools.superblock import read_superblock
+from hidsltools.types import Checkpoint, Partition, Phase
+
+
+__all__ = ["Journal", "journal_file", "read_journal", "uuids"]
+
+
+def journal_file(target: Path | str) -> Path:
+    """Returns the default journal file of the restore target.
+
+    The file is named after the resolved target path,
+    so that concurrent restores do not share a journal.
+    """
+
+    name = str(Path(target).resolve()).strip("/").replace("/", "-")
+    return JOURNALS / f"restore-{name or 'root'}.json"
+
+
+def read_journal(file: Path) -> Checkpoint | None:
+    """Reads the checkpoint journal if it exists and is intact."""
+
+    try:
+        with file.open("r", encoding="utf-8") as journal:
+            return Checkpoint.from_json(load(journal))
+    except FileNotFoundError:
+        return None
+    except (KeyError, TypeError, ValueError) as error:
+        LOGGER.warning("Ignoring corrupt checkpoint journal %s.", file)
+        LOGGER.debug(str(error))
+        return None
+
+
+def write_journal(file: Path, checkpoint: Checkpoint) -> None:
+    """Atomically replaces the checkpoint journal."""
+
+    file.parent.mkdir(parents=True, exist_ok=True)
+    tmp = file.with_name(file.name + ".tmp")
+
+    with tmp.open("w", encoding="utf-8") as journal:
+        dump(checkpoint.to_json(), journal, indent=2)
+        journal.flush()
+        fsync(journal.fileno())
+
+    tmp.replace(file)
+
+
+def uuids(partitions: Iterable[Partition]) -> dict[str, str | None]:
+    """Returns the file system UUIDs of the partitions."""
+
+    result = {}
+
+    for partition in partitions:
+        try:
+            uuid = read_superblock(partition.device, partition.filesystem).uuid
+        except (OSError, ValueError):
+            uuid = None
+
+        result[str(partition.device)] = uuid
+
+    return result
+
+
+class Journal:
+    """Records the completed phases of a restore."""
+
+    def __init__(self, file: Path | None, checkpoint: Checkpoint):
+        """Sets the journal file and the current checkpoint.
+
+        If the file is None, nothing is recorded.
+        """
+        self.file = file
+        self.checkpoint = checkpoint
+
+    def __contains__(self, phase: Phase) -> bool:
+        return phase in self.checkpoint.phases
+
+    def update(self, **changes) -> None:
+        """Updates and writes the checkpoint."""
+        self.checkpoint = self.checkpoint._replace(**changes)
+
+        if self.file is None:
+            return
+
+        try:
+            write_journal(self.file, self.checkpoint)
+        except OSError as error:
+            LOGGER.warning("Cannot write checkpoint journal: %s", error)
+            self.file = None
+
+    def start(self, phase: Phase) -> None:
+        """Records that the phase has started."""
+        LOGGER.debug("Starting restore phase: %s", phase.value)
+        self.update(started=phase)
+
+    def complete(self, phase: Phase, **changes) -> None:
+        """Records the phase as completed."""
+        self.update(phases=(*self.checkpoint.phases, phase), started=None, **changes)
+
+    def rewind(self, phase: Phase) -> None:
+        """Forgets that the phase and all later ones were completed."""
+        self.update(phases=tuple(p for p in self.checkpoint.phases if p < phase))
+
+    def run(self, phase: Phase, function: Callable, *args, **kwargs) -> None:
+        """Runs the phase unless it has been completed before."""
+        if phase in self:
+            LOGGER.info("Skipping completed phase: %s", phase.value)
+            return
+
+        self.start(phase)
+        function(*args, **kwargs)
+        self.complete(phase)
+
+    def interrupted(self, phase: Phase) -> bool:
+        """Checks whether the phase started but did not complete."""
+        return self.checkpoint.started is phase and phase not in self
+
+    def remove(self) -> None:
+        """Removes the journal file after a successful restore."""
+        if self.file is not None:
+            self.file.unlink(missing_ok=True)
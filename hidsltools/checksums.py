@@ -8,7 +8,7 @@ from hidsltools.logging import LOGGER
 from hidsltools.types import Hash
 
 
-__all__ = ["validate_files"]
+__all__ = ["hash_file", "validate_files"]
 
 
 CHECKSUMS_FILE = Path("/opt/hidsl/.checksums.sha256")
@@ -43,14 +43,13 @@ def iter_hashes(hashes: Path = CHECKSUMS_FILE) -> Iterator[tuple[Path, str]]:
                 yield hashes.parent / filename, checksum
 
 
-def validate(
+def hash_file(
     filename: Path,
-    checksum: str,
     *,
     hash_func: Callable[[], Hash] = sha256,
     chunk_size: int = CHUNK_SIZE,
-) -> bool:
-    """Validate files with a hash function."""
+) -> str:
+    """Returns the hex digest of the file."""
 
     file_hash = hash_func()
 
@@ -58,7 +57,21 @@ def validate(
         while (chunk := file.read(chunk_size)) != b"":
             file_hash.update(chunk)
 
-    if (hex_hash := file_hash.hexdigest()) != checksum:
+    return file_hash.hexdigest()
+
+
+def validate(
+    filename: Path,
+    checksum: str,
+    *,
+    hash_func: Callable[[], Hash] = sha256,
+    chunk_size: int = CHUNK_SIZE,
+) -> bool:
+    """Validate files with a hash function."""
+
+    hex_hash = hash_file(filename, hash_func=hash_func, chunk_size=chunk_size)
+
+    if hex_hash != checksum:
         raise ValueError(f"Checksum mismatch: {filename} ({hex_hash} != {checksum})")
 
     return True
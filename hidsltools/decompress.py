@@ -0,0 +1,57 @@
+"""Detection and decompression of compressed images."""
+
+from __future__ import annotations
+from pathlib import Path
+
+from hidsltools.types import Compression
+
+
+__all__ = ["HEAD_SIZE", "decompressor", "detect"]
+
+
+HEAD_SIZE = 512  # One tar header block.
+MAGIC = {
+    Compression.BZIP2: b"BZh",
+    Compression.GZIP: b"\x1f\x8b",
+    Compression.LRZIP: b"LRZI",
+    Compression.LZ4: b"\x04\x22\x4d\x18",
+    Compression.LZMA: b"\x5d\x00\x00",
+    Compression.LZOP: b"\x89LZO\x00\r\n\x1a\n",
+    Compression.XZ: b"\xfd7zXZ\x00",
+    Compression.ZSTD: b"\x28\xb5\x2f\xfd",
+}
+USTAR = slice(257, 262)
+
+
+def detect(head: bytes) -> Compression | None:
+    """Returns the compression of a stream by its first bytes.
+
+    Returns None for an uncompressed tar archive
+    and raises a ValueError if the format is unknown.
+    """
+
+    for compression, magic in MAGIC.items():
+        if head.startswith(magic):
+            return compression
+
+    if head[USTAR] == b"ustar":
+        return None
+
+    raise ValueError("Unknown image format.")
+
+
+def decompressor(compression: Compression, file: Path | None = None) -> list[str]:
+    """Returns the command to decompress the file or stdin to stdout.
+
+    lrzip's -c means --check, so it is told to write to stdout via -o -.
+    """
+
+    if compression is Compression.LRZIP:
+        command = [compression.full_name, "-d", "-q", "-o", "-"]
+    else:
+        command = [compression.full_name, "-d", "-c"]
+
+    if file is not None:
+        command.append(str(file))
+
+    return command
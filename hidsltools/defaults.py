@@ -2,14 +2,14 @@
 
 from pathlib import Path
 
-from hidsltools.device import Device
 
-
-__all__ = ["BOOT", "DEVICE", "IMAGE", "ROOT", "SSH_KEYS"]
+__all__ = ["BOOT", "DEVICE", "IMAGE", "INITRAMFS_CACHE", "JOURNALS", "ROOT", "SSH_KEYS"]
 
 
 BOOT = Path("/boot")
-DEVICE = Device("/dev/sda")
+DEVICE = "/dev/sda"  # Converted into a Device by the argument parser.
 IMAGE = Path("/opt/hidsl/ddb.bsdtar.lzop")
+INITRAMFS_CACHE = Path("/var/cache/hidsltools/initramfs")
+JOURNALS = Path("/var/lib/hidsltools")  # One restore journal per target.
 ROOT = Path("/")
 SSH_KEYS = Path("/opt/hidsl/authorized_keys.json")
@@ -1,37 +1,153 @@
 """Common stuff."""
 
+from ctypes import c_char_p, c_int, c_uint32, get_errno
+from fcntl import ioctl
+from functools import cache, cached_property
+from os import O_CLOEXEC, O_NONBLOCK, O_RDONLY, close, open as os_open, read, strerror
 from pathlib import Path
-from typing import Iterator
+from re import compile
+from select import select
+from time import monotonic
+from typing import Iterable, Iterator
 
-from hidsltools.types import DeviceType
+from hidsltools.libc import libc
+from hidsltools.logging import LOGGER
+from hidsltools.types import BlockDeviceInfo, DeviceType
 
 
-__all__ = ["Device"]
+__all__ = ["Device", "inventory"]
 
 
+BLKRRPART = 0x125F
 EMMC = DeviceType("mmcblk([0-9])", "p")
+LOOP = DeviceType("loop([0-9]+)", "p")
 NVME = DeviceType("nvme([0-9])n([0-9])", "p")
 SDX = DeviceType("sd([a-z])")
-DEVICE_TYPES = {EMMC, NVME, SDX}
+DEVICE_TYPES = {EMMC, LOOP, NVME, SDX}
+DEVICE_TYPE_NAMES = {f"t{index}": typ for index, typ in enumerate(DEVICE_TYPES)}
+DEVICE_TYPE_MATCHER = compile(
+    "|".join(f"(?P<{name}>{typ.regex})" for name, typ in DEVICE_TYPE_NAMES.items())
+)
+IN_ATTRIB = 0x00000004
+IN_CREATE = 0x00000100
+SECTOR_SIZE = 512
+SYS_BLOCK = Path("/sys/block")
+
+
+def read_int(path: Path, default: int = 0) -> int:
+    """Reads an integer from a sysfs attribute."""
+
+    try:
+        return int(path.read_text(encoding="ascii"))
+    except (OSError, ValueError):
+        return default
+
+
+def read_info(sysfs: Path) -> BlockDeviceInfo:
+    """Reads information about a block device from sysfs."""
+
+    queue = sysfs / "queue"
+    partitions = [child for child in sysfs.iterdir() if (child / "partition").exists()]
+    partitions.sort(key=lambda partition: read_int(partition / "partition"))
+    return BlockDeviceInfo(
+        name=sysfs.name,
+        size=read_int(sysfs / "size") * SECTOR_SIZE,
+        rotational=bool(read_int(queue / "rotational")),
+        logical_block_size=read_int(queue / "logical_block_size", SECTOR_SIZE),
+        physical_block_size=read_int(queue / "physical_block_size", SECTOR_SIZE),
+        minimum_io_size=read_int(queue / "minimum_io_size", SECTOR_SIZE),
+        optimal_io_size=read_int(queue / "optimal_io_size"),
+        discard=read_int(queue / "discard_max_bytes") > 0,
+        partitions=tuple(partition.name for partition in partitions),
+    )
+
+
+@cache
+def inventory(sysfs: Path = SYS_BLOCK) -> dict[str, BlockDeviceInfo]:
+    """Returns information about all block devices by name.
+
+    The inventory is built once. Call inventory.cache_clear()
+    to rebuild it, e.g. after re-partitioning a device.
+    """
+
+    return {path.name: read_info(path) for path in sysfs.iterdir()}
+
+
+def wait_for_nodes(nodes: Iterable[Path], *, timeout: float = 10) -> None:
+    """Waits for the given device nodes to appear using inotify."""
+
+    nodes = set(nodes)
+    inotify_init1 = libc().inotify_init1
+    inotify_add_watch = libc().inotify_add_watch
+    inotify_add_watch.argtypes = [c_int, c_char_p, c_uint32]
+
+    if (fd := inotify_init1(O_NONBLOCK | O_CLOEXEC)) < 0:
+        raise OSError(errno := get_errno(), strerror(errno))
+
+    try:
+        for directory in {node.parent for node in nodes}:
+            if inotify_add_watch(fd, bytes(directory), IN_CREATE | IN_ATTRIB) < 0:
+                raise OSError(errno := get_errno(), strerror(errno), str(directory))
+
+        deadline = monotonic() + timeout
+
+        while missing := {node for node in nodes if not node.is_block_device()}:
+            if (remaining := deadline - monotonic()) <= 0:
+                raise TimeoutError(f"Device nodes did not appear: {sorted(missing)}")
+
+            if select([fd], [], [], remaining)[0]:
+                read(fd, 4096)
+    finally:
+        close(fd)
 
 
 class Device(type(Path())):
     """A block device."""
 
-    @property
-    def devtype(self):
+    @cached_property
+    def devtype(self) -> DeviceType:
         """Returns the device type."""
-        for device_type in DEVICE_TYPES:
-            if device_type.check(self):
-                return device_type
+        if (match := DEVICE_TYPE_MATCHER.fullmatch(self.name)) is not None:
+            if self.is_block_device():
+                return DEVICE_TYPE_NAMES[match.lastgroup]
 
         raise ValueError("Unknown block device type:", self)
 
+    @property
+    def info(self) -> BlockDeviceInfo:
+        """Returns the device's sysfs information."""
+        return inventory()[self.resolve().name]
+
     @property
     def partitions(self) -> Iterator[Path]:
         """Yields available partitions."""
-        return self.parent.glob(f"{self.stem}{self.devtype.infix}[0-9]")
+        try:
+            partitions = self.info.partitions
+        except (KeyError, OSError):
+            return self.parent.glob(f"{self.stem}{self.devtype.infix}[0-9]")
+
+        return (self.parent / partition for partition in partitions)
 
     def partition(self, index: int) -> Path:
         """Returns the respective partition."""
         return self.parent.joinpath(f"{self.stem}{self.devtype.infix}{index}")
+
+    def reread_partitions(self) -> None:
+        """Asks the kernel to re-read the partition table."""
+        fd = os_open(self, O_RDONLY)
+
+        try:
+            ioctl(fd, BLKRRPART)
+        except OSError as error:
+            LOGGER.debug("Could not re-read partition table: %s", error)
+        finally:
+            close(fd)
+
+        inventory.cache_clear()
+
+    def wait_for_partitions(
+        self, indices: Iterable[int], *, timeout: float = 10
+    ) -> None:
+        """Re-reads the partition table and waits for the partition nodes."""
+        self.reread_partitions()
+        wait_for_nodes(map(self.partition, indices), timeout=timeout)
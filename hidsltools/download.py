@@ -0,0 +1,173 @@
+"""Streaming of images from HTTP(S) servers."""
+
+from __future__ import annotations
+from contextlib import contextmanager
+from fcntl import F_SETPIPE_SZ, fcntl
+from hashlib import sha256
+from http.client import HTTPException, IncompleteRead
+from json import load
+from os import close, pipe, read
+from threading import Thread
+from time import sleep
+from typing import Iterator
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlparse
+from urllib.request import Request, urlopen
+
+from hidsltools.logging import LOGGER
+from hidsltools.sidecar import SUFFIX
+from hidsltools.types import ImageMetadata
+
+
+__all__ = ["fetch_sidecar", "is_url", "stream"]
+
+
+CHUNK_SIZE = 64 * 1024
+READ_AHEAD = 1024 * 1024  # Pipe buffer between download and extraction.
+RETRIES = 5
+RETRY_DELAY = 2  # Seconds, doubled after each failed attempt.
+SCHEMES = {"http", "https"}
+TIMEOUT = 30  # Seconds
+
+
+def is_url(source: str) -> bool:
+    """Checks whether the image source is an HTTP(S) URL."""
+
+    return urlparse(source).scheme in SCHEMES
+
+
+def fetch_sidecar(url: str) -> ImageMetadata | None:
+    """Fetches the sidecar file of the image if it exists.
+
+    Exits if the server cannot be reached.
+    """
+
+    try:
+        with urlopen(url + SUFFIX, timeout=TIMEOUT) as response:
+            return ImageMetadata.from_json(load(response))
+    except HTTPError as error:
+        if error.code == 404:
+            LOGGER.debug("No sidecar file for image %s.", url)
+            return None
+
+        LOGGER.critical("Could not fetch sidecar file of %s: %s", url, error)
+        raise SystemExit(1) from None
+    except (HTTPException, URLError, OSError) as error:
+        LOGGER.critical("Could not fetch sidecar file of %s: %s", url, error)
+        raise SystemExit(1) from None
+
+
+def download(url: str, file, *, retries: int = RETRIES) -> str:
+    """Downloads the URL into the file and returns its SHA-256 hex digest.
+
+    If the connection drops, the download is resumed
+    with a range request at the current offset.
+    """
+
+    checksum = sha256()
+    offset = failures = 0
+
+    while True:
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+
+        try:
+            with urlopen(Request(url, headers=headers), timeout=TIMEOUT) as response:
+                if offset and response.status != 206:
+                    raise ValueError(f"Server cannot resume download of {url}.")
+
+                if (length := response.headers.get("Content-Length")) is not None:
+                    length = offset + int(length)
+
+                while chunk := response.read(CHUNK_SIZE):
+                    file.write(chunk)
+                    checksum.update(chunk)
+                    offset += len(chunk)
+                    failures = 0
+
+                # HTTPResponse.read() does not detect closed connections.
+                if length is not None and offset < length:
+                    raise IncompleteRead(b"", length - offset)
+
+            return checksum.hexdigest()
+        except (BrokenPipeError, HTTPError, ValueError):
+            raise  # Resuming cannot help.
+        except (HTTPException, URLError, OSError) as error:
+            if (failures := failures + 1) > retries:
+                raise
+
+            delay = RETRY_DELAY * 2 ** (failures - 1)
+            LOGGER.warning(
+                "Download interrupted after %i bytes: %s. Resuming in %i seconds.",
+                offset,
+                error,
+                delay,
+            )
+            sleep(delay)
+
+
+class Downloader(Thread):
+    """Downloads an image into a pipe."""
+
+    def __init__(self, url: str, fd: int):
+        """Sets the URL and the write end of the pipe."""
+        super().__init__(name="downloader", daemon=True)
+        self.url = url
+        self.fd = fd
+        self.digest = None
+        self.error = None
+
+    def run(self):
+        """Downloads the image and closes the pipe."""
+        try:
+            with open(self.fd, "wb") as file:
+                self.digest = download(self.url, file)
+        except BrokenPipeError:
+            LOGGER.debug("Extraction stopped reading %s.", self.url)
+        except Exception as error:
+            LOGGER.error("Could not download %s: %s", self.url, error)
+            self.error = error
+
+
+@contextmanager
+def stream(url: str, *, checksum: str | None = None) -> Iterator[int]:
+    """Yields an fd from which the image at the URL can be read.
+
+    The image is downloaded in a background thread. The read-ahead is
+    bounded by the pipe buffer. If a checksum is given, the download
+    is verified against it after the image has been read completely.
+    Since the image has been extracted by then, the target must be
+    treated as invalid if the download fails or the checksum differs.
+    Both cases are logged and exit with status 1.
+    """
+
+    read_fd, write_fd = pipe()
+
+    try:
+        fcntl(write_fd, F_SETPIPE_SZ, READ_AHEAD)
+    except OSError as error:
+        LOGGER.debug("Cannot resize pipe buffer: %s", error)
+
+    downloader = Downloader(url, write_fd)
+    downloader.start()
+
+    try:
+        yield read_fd
+
+        while read(read_fd, CHUNK_SIZE):
+            pass  # Hash data the extraction did not need, e.g. padding.
+    finally:
+        close(read_fd)
+        downloader.join()
+
+    if downloader.error is not None:
+        LOGGER.critical("Download of %s failed. The target is invalid.", url)
+        raise SystemExit(1) from downloader.error
+
+    if checksum is not None and downloader.digest != checksum:
+        LOGGER.critical(
+            "Checksum mismatch of %s: %s, expected %s. The target is invalid.",
+            url,
+            downloader.digest,
+            checksum,
+        )
+        raise SystemExit(1)
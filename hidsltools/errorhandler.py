@@ -1,7 +1,7 @@
 """Common error handling."""
 
 from logging import Logger
-from subprocess import CalledProcessError
+from subprocess import CalledProcessError, TimeoutExpired
 from sys import exit
 
 
@@ -28,3 +28,8 @@ class ErrorHandler:
             self.logger.critical("Subprocess error.")
             self.logger.error(value)
             exit(value.returncode)
+
+        if isinstance(value, TimeoutExpired):
+            self.logger.critical("Subprocess timed out.")
+            self.logger.error(value)
+            exit(124)
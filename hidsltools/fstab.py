@@ -1,16 +1,27 @@
 """File system table related functions."""
 
 from pathlib import Path
+from typing import Iterable
 
 from hidsltools.defaults import ROOT
 from hidsltools.functions import chroot, exe
+from hidsltools.logging import LOGGER
+from hidsltools.superblock import Superblock, read_superblock
+from hidsltools.types import Filesystem, Partition
 
 
-__all__ = ["FSTAB", "genfstab"]
+__all__ = ["FSTAB", "genfstab", "mkfstab", "write_fstab"]
 
 
 FSTAB = Path("/etc/fstab")
 GENFSTAB = "/usr/bin/genfstab"
+OPTIONS = {
+    Filesystem.EXT4: "rw,relatime",
+    Filesystem.VFAT: (
+        "rw,relatime,fmask=0022,dmask=0022,codepage=437,"
+        "iocharset=ascii,shortname=mixed,utf8,errors=remount-ro"
+    ),
+}
 
 
 def genfstab(*, root: Path = ROOT, verbose: bool = False) -> None:
@@ -20,3 +31,67 @@ def genfstab(*, root: Path = ROOT, verbose: bool = False) -> None:
 
     with chroot(root, FSTAB).open("w") as file:
         exe(command, stdout=file, verbose=verbose)
+
+
+def mangle(string: str) -> str:
+    """Escapes white space and backslashes like genfstab does."""
+
+    for char in "\\ \t\n":
+        string = string.replace(char, f"\\{ord(char):03o}")
+
+    return string
+
+
+def get_superblock(partition: Partition) -> Superblock:
+    """Reads the superblock or falls back to the label passed to mkfs."""
+
+    try:
+        return read_superblock(partition.device, partition.filesystem)
+    except (OSError, ValueError) as error:
+        LOGGER.warning("Could not read superblock of %s.", partition.device)
+        LOGGER.debug(str(error))
+        return Superblock(partition.label, None)
+
+
+def fstab_entry(partition: Partition) -> str:
+    """Returns a file system table entry as genfstab -L writes it."""
+
+    superblock = get_superblock(partition)
+
+    if superblock.label:
+        comment = [str(partition.device)]
+
+        if superblock.uuid:
+            comment.append(f"UUID={superblock.uuid}")
+
+        source = f"LABEL={mangle(superblock.label)}"
+    else:
+        comment = [f"UUID={superblock.uuid}"] if superblock.uuid else []
+        source = mangle(str(partition.device))
+
+    target = mangle(str(partition.mountpoint))
+    passno = 1 if partition.mountpoint == ROOT else 2
+    header = f"# {' '.join(comment)}\n" if comment else ""
+    options = OPTIONS[partition.filesystem]
+    return (
+        f"{header}{source:<20}\t{target:<10}\t{partition.filesystem!s:<10}"
+        f"\t{options:<10}\t0 {passno}\n\n"
+    )
+
+
+def mkfstab(partitions: Iterable[Partition]) -> str:
+    """Returns a file system table for the given partitions."""
+
+    partitions = sorted(partitions, key=lambda partition: partition.mountpoint)
+    return "".join(map(fstab_entry, partitions))
+
+
+def write_fstab(partitions: Iterable[Partition], *, root: Path = ROOT) -> None:
+    """Writes a file system table for the given partitions.
+
+    This is equivalent to genfstab -L -p for the partitions
+    created by hirestore without scanning the mount tree.
+    """
+
+    with chroot(root, FSTAB).open("w") as file:
+        file.write(mkfstab(partitions))
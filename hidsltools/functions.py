@@ -1,14 +1,47 @@
 """Common functions."""
 
+from asyncio import (
+    Semaphore,
+    StreamReader,
+    create_subprocess_exec,
+    ensure_future,
+    gather,
+    get_running_loop,
+    run,
+    wait_for,
+)
+from asyncio import TimeoutError as AsyncTimeoutError
+from asyncio.subprocess import Process
+from concurrent.futures import ThreadPoolExecutor
+from logging import DEBUG, INFO
+from os import O_DIRECTORY, O_NOFOLLOW, O_RDONLY, DirEntry, close, cpu_count, killpg
+from os import open as os_open, rmdir, scandir, unlink
 from pathlib import Path
-from subprocess import DEVNULL, CompletedProcess, run
-from typing import IO, Iterable
+from signal import SIGKILL
+from subprocess import (
+    DEVNULL,
+    PIPE,
+    CalledProcessError,
+    CompletedProcess,
+    TimeoutExpired,
+)
+from typing import IO, Callable, Iterable
 
 from hidsltools.defaults import ROOT
 from hidsltools.logging import LOGGER
+from hidsltools.types import RemovalStats
 
 
-__all__ = ["arch_chroot", "chroot", "exe", "rmsubtree", "rmtree"]
+__all__ = [
+    "aexe",
+    "arch_chroot",
+    "chroot",
+    "disk_usage",
+    "exe",
+    "exe_all",
+    "rmsubtree",
+    "rmtree",
+]
 
 
 ARCH_CHROOT = "/usr/bin/arch-chroot"
@@ -30,38 +63,294 @@ def chroot(root: Path, path: Path) -> Path:
     return root.joinpath(path)
 
 
-def exe(
+async def log_stream(
+    stream: StreamReader,
+    level: int,
+    callback: Callable[[bytes], None] | None = None,
+) -> bytes:
+    """Logs the lines of the stream and returns its content."""
+
+    lines = []
+
+    async for line in stream:
+        lines.append(line)
+        LOGGER.log(level, "%s", line.decode(errors="replace").rstrip())
+
+        if callback is not None:
+            callback(line)
+
+    return b"".join(lines)
+
+
+async def kill(process: Process, group: bool = True) -> None:
+    """Kills the process or its process group and reaps it."""
+
+    try:
+        if group:
+            killpg(process.pid, SIGKILL)
+        else:
+            process.kill()
+    except ProcessLookupError:
+        pass
+
+    await process.wait()
+
+
+async def aexe(
     command,
     *,
     input: bytes | None = None,
+    stdin: IO | int | None = None,
     stdout: IO | None = None,
-    verbose: bool = False
+    verbose: bool = False,
+    timeout: float | None = None,
+    semaphore: Semaphore | None = None,
+    on_stderr: Callable[[bytes], None] | None = None,
+    session: bool = True,
 ) -> CompletedProcess:
-    """Returns stdout and stderr parameters for subprocess.run()."""
+    """Runs a command asynchronously.
+
+    If session is True, the command runs in its own process group, which
+    is killed as a whole on timeout or cancellation. Otherwise, it stays in
+    the caller's process group and receives the terminal's SIGINT with it.
+    Its stderr is streamed into the logger and each line is passed to
+    on_stderr, if given.
+    If stdout is PIPE, the output is returned in the completed process.
+    Instead of input, a file or fd to read from may be given as stdin.
+    """
+
+    if semaphore is not None:
+        async with semaphore:
+            return await aexe(
+                command,
+                input=input,
+                stdin=stdin,
+                stdout=stdout,
+                verbose=verbose,
+                timeout=timeout,
+                on_stderr=on_stderr,
+                session=session,
+            )
 
-    stderr = None if verbose else DEVNULL
     stdout = stdout if stdout is not None else None if verbose else DEVNULL
     LOGGER.debug("Running command: %s", command)
-    return run(command, input=input, check=True, stderr=stderr, stdout=stdout)
+    process = await create_subprocess_exec(
+        *command,
+        stdin=stdin if input is None else PIPE,
+        stdout=stdout,
+        stderr=PIPE,
+        start_new_session=session,
+    )
+
+    stderr = ensure_future(
+        log_stream(process.stderr, INFO if verbose else DEBUG, on_stderr)
+    )
+    output = ensure_future(process.stdout.read()) if stdout == PIPE else None
+
+    try:
+        if input is not None:
+            process.stdin.write(input)
+            await process.stdin.drain()
+            process.stdin.close()
+
+        returncode = await wait_for(process.wait(), timeout)
+    except AsyncTimeoutError:
+        await kill(process, session)
+        raise TimeoutExpired(command, timeout, stderr=await stderr) from None
+    except BaseException:
+        await kill(process, session)
+        stderr.cancel()
+        raise
+
+    output = None if output is None else await output
+
+    if returncode != 0:
+        raise CalledProcessError(returncode, command, output, await stderr)
 
+    return CompletedProcess(command, returncode, output, await stderr)
 
-def rmsubtree(directory: Path) -> None:
-    """Removes all files and folders below the given directory."""
+
+async def exe_all(
+    commands: Iterable, *, jobs: int | None = None, **kwargs
+) -> list[CompletedProcess]:
+    """Runs the commands concurrently with at most jobs processes at a time."""
+
+    semaphore = Semaphore(jobs or cpu_count() or 1)
+    return await gather(
+        *(aexe(command, semaphore=semaphore, **kwargs) for command in commands)
+    )
+
+
+def exe(
+    command,
+    *,
+    input: bytes | None = None,
+    stdin: IO | int | None = None,
+    stdout: IO | None = None,
+    verbose: bool = False,
+    timeout: float | None = None,
+    on_stderr: Callable[[bytes], None] | None = None,
+) -> CompletedProcess:
+    """Runs a command synchronously.
+
+    Without a timeout, the command stays in the caller's process group,
+    so that Ctrl-C also reaches commands started from worker threads.
+    With a timeout, it runs in its own process group to be killed as a whole.
+    If the calling thread runs an event loop, the command is run
+    from a separate thread with its own event loop.
+    """
+
+    coroutine = aexe(
+        command,
+        input=input,
+        stdin=stdin,
+        stdout=stdout,
+        verbose=verbose,
+        timeout=timeout,
+        on_stderr=on_stderr,
+        session=timeout is not None,
+    )
+
+    try:
+        get_running_loop()
+    except RuntimeError:
+        return run(coroutine)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(run, coroutine).result()
+
+
+def disk_usage(directory: Path) -> RemovalStats:
+    """Returns what rmsubtree() would remove below the directory."""
+
+    stats = RemovalStats()
 
     if not directory.is_dir():
-        return
+        return stats
+
+    stack = [directory]
 
-    for child in directory.iterdir():
-        rmtree(child)
+    while stack:
+        with scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                    stats += RemovalStats(directories=1)
+                else:
+                    blocks = entry.stat(follow_symlinks=False).st_blocks
+                    stats += RemovalStats(files=1, bytes=blocks * 512)
 
+    return stats
 
-def rmtree(inode: Path) -> None:
-    """Recursively removes the inode."""
 
-    if inode.is_dir():
-        for child in inode.iterdir():
-            rmtree(child)
+def remove_entry(entry: DirEntry, dir_fd: int) -> RemovalStats:
+    """Removes a non-directory entry relative to its directory's fd."""
 
+    stat = entry.stat(follow_symlinks=False)
+    unlink(entry.name, dir_fd=dir_fd)
+    return RemovalStats(files=1, bytes=stat.st_blocks * 512)
+
+
+def open_directory(name: str | Path, dir_fd: int | None = None) -> int:
+    """Opens a directory without following symlinks."""
+
+    return os_open(name, O_RDONLY | O_DIRECTORY | O_NOFOLLOW, dir_fd=dir_fd)
+
+
+def remove_contents(fd: int) -> RemovalStats:
+    """Iteratively removes everything within the directory fd.
+
+    The fd is closed afterwards.
+    """
+
+    stats = RemovalStats()
+    # Each stack frame holds a directory fd, its remaining entries and its name.
+    stack = [(fd, scandir_list(fd), None)]
+
+    try:
+        while stack:
+            dir_fd, entries, name = stack[-1]
+
+            if entries:
+                if (entry := entries.pop()).is_dir(follow_symlinks=False):
+                    child = open_directory(entry.name, dir_fd)
+                    stack.append((child, scandir_list(child), entry.name))
+                else:
+                    stats += remove_entry(entry, dir_fd)
+
+                continue
+
+            stack.pop()
+            close(dir_fd)
+
+            if stack:
+                rmdir(name, dir_fd=stack[-1][0])
+                stats += RemovalStats(directories=1)
+    finally:
+        for dir_fd, _, _ in stack:
+            close(dir_fd)
+
+    return stats
+
+
+def scandir_list(fd: int) -> list[DirEntry]:
+    """Returns the entries of the directory fd."""
+
+    with scandir(fd) as entries:
+        return list(entries)
+
+
+def remove_subdirectory(name: str, dir_fd: int) -> RemovalStats:
+    """Removes the subdirectory with the given name."""
+
+    stats = remove_contents(open_directory(name, dir_fd))
+    rmdir(name, dir_fd=dir_fd)
+    return stats + RemovalStats(directories=1)
+
+
+def rmsubtree(directory: Path, *, workers: int = 1) -> RemovalStats:
+    """Removes all files and folders below the given directory.
+
+    Symlinks are never followed below the given directory.
+    With more than one worker, the subtrees are removed concurrently.
+    """
+
+    if not directory.is_dir():
+        return RemovalStats()
+
+    fd = os_open(directory, O_RDONLY | O_DIRECTORY)
+
+    if workers <= 1:
+        return remove_contents(fd)
+
+    stats = RemovalStats()
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = []
+
+            for entry in scandir_list(fd):
+                if entry.is_dir(follow_symlinks=False):
+                    futures.append(executor.submit(remove_subdirectory, entry.name, fd))
+                else:
+                    stats += remove_entry(entry, fd)
+
+        for future in futures:
+            stats += future.result()
+    finally:
+        close(fd)
+
+    return stats
+
+
+def rmtree(inode: Path, *, workers: int = 1) -> RemovalStats:
+    """Recursively removes the inode without following symlinks."""
+
+    if inode.is_dir() and not inode.is_symlink():
+        stats = rmsubtree(inode, workers=workers)
         inode.rmdir()
-    else:
-        inode.unlink()
+        return stats + RemovalStats(directories=1)
+
+    stat = inode.lstat()
+    inode.unlink()
+    return RemovalStats(files=1, bytes=stat.st_blocks * 512)
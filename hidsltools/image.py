@@ -1,22 +1,32 @@
 """Create HIDSL images."""
 
+from __future__ import annotations
 from argparse import ArgumentParser, Namespace
 from datetime import date
 from getpass import getpass
 from logging import DEBUG, INFO, basicConfig
+from os import environ
 from pathlib import Path
+from typing import IO, Callable
 
-from hidsltools.bsdtar import create
 from hidsltools.defaults import ROOT
-from hidsltools.errorhandler import ErrorHandler
-from hidsltools.functions import chroot
+from hidsltools.lazy import lazy_import
 from hidsltools.logging import FORMAT, LOGGER
-from hidsltools.mount import MountContext
 from hidsltools.types import Compression
 from hidsltools.types import Filesystem
 from hidsltools.types import Partition
 from hidsltools.types import SafeTemporaryDirectory
 
+# Loaded on first use to keep --help and argument errors fast.
+errorhandler = lazy_import("hidsltools.errorhandler")
+functions = lazy_import("hidsltools.functions")
+manifest = lazy_import("hidsltools.manifest")
+members = lazy_import("hidsltools.members")
+mount = lazy_import("hidsltools.mount")
+prefetch = lazy_import("hidsltools.prefetch")
+sidecar = lazy_import("hidsltools.sidecar")
+variants = lazy_import("hidsltools.variants")
+
 
 __all__ = ["main"]
 
@@ -35,7 +45,7 @@ def get_args() -> Namespace:
         "--file",
         default=FILENAME_TEMPLATE,
         metavar="filename",
-        help="the image file name",
+        help="the image file name, formatted with the date and compression suffix",
     )
     parser.add_argument("-c", "--cifs", metavar="share", help="CIFS share")
     parser.add_argument(
@@ -44,10 +54,11 @@ def get_args() -> Namespace:
     parser.add_argument(
         "-x",
         "--compression",
-        type=Compression,
+        nargs="+",
+        type=Compression.from_name,
         metavar="compression",
-        default=Compression.LZOP,
-        help="compression algorithm",
+        default=[Compression.LZOP],
+        help="compression algorithms, one image per algorithm",
     )
     parser.add_argument(
         "-l",
@@ -57,40 +68,174 @@ def get_args() -> Namespace:
         default=9,
         help="compression level",
     )
+    parser.add_argument(
+        "-s",
+        "--sort",
+        action="store_true",
+        help="group similar files in a deterministic order",
+    )
+    parser.add_argument(
+        "-R",
+        "--reproducible",
+        action="store_true",
+        help=(
+            "sort members, store numeric owners only, drop access and change "
+            "times and clamp modification times to $SOURCE_DATE_EPOCH"
+        ),
+    )
+    parser.add_argument(
+        "-P",
+        "--prefetch",
+        type=int,
+        metavar="MiB",
+        default=0,
+        help="read up to this much ahead of the archiver (experimental)",
+    )
+    parser.add_argument(
+        "--no-manifest",
+        action="store_false",
+        dest="manifest",
+        help="do not write a per-file manifest of the image",
+    )
+    parser.add_argument(
+        "--no-sparse",
+        action="store_false",
+        dest="sparse",
+        help="archive holes of sparse files as zeros",
+    )
     parser.add_argument(
         "-v", "--verbose", action="store_true", help="show output of subprocesses"
     )
     parser.add_argument(
         "-d", "--debug", action="store_true", help="enable verbose logging"
     )
-    return parser.parse_args()
+    args = parser.parse_args()
+    compressions = set(args.compression)
+
+    if Compression.LRZIP in compressions and len(compressions) > 1:
+        parser.error("lrzip buffers the whole stream and cannot share it")
+
+    if len({get_filename(args, c) for c in compressions}) < len(compressions):
+        parser.error(f"file name {args.file!r} repeats for several compressions")
 
+    return args
 
-def get_filename(args: Namespace) -> str:
+
+def get_filename(args: Namespace, compression: Compression) -> str:
     """Returns the image file name."""
 
-    return args.file.format(date.today().isoformat(), args.compression.suffix)
+    return args.file.format(date.today().isoformat(), compression.suffix)
 
 
-def cifs_mount(mountpoint: Path, args: Namespace) -> MountContext:
+def cifs_mount(mountpoint: Path, args: Namespace) -> mount.MountContext:
     """Returns a mount context."""
 
     passwd = getpass("CIFS password: ")
     options = {"user": args.user, "password": passwd}
     fstab = Partition(args.cifs, ROOT, Filesystem.CIFS)
-    return MountContext([fstab], root=mountpoint, verbose=args.verbose, **options)
+    return mount.MountContext([fstab], root=mountpoint, verbose=args.verbose, **options)
+
+
+def source_date_epoch() -> int | None:
+    """Returns the timestamp to clamp modification times to, if set."""
+
+    if (epoch := environ.get("SOURCE_DATE_EPOCH")) is None:
+        return None
+
+    return int(epoch)
+
+
+def manifest_writer(image: Path, root: Path) -> Callable[[IO[bytes]], None]:
+    """Returns a consumer that writes the image manifest from the tar stream."""
 
+    def write(source: IO[bytes]) -> None:
+        manifest.write_manifest(image, manifest.stream(source, root))
 
-def make_image(file: Path, args: Namespace) -> int:
-    """Creates a tarball from a reference system's root directory."""
+    return write
 
-    create(
-        file,
+
+def archive(
+    files: dict[Compression, Path],
+    ordered: list[members.Member],
+    args: Namespace,
+    on_member: Callable[[bytes], None] | None = None,
+) -> dict[Compression, str]:
+    """Archives the root into one tarball per compression.
+
+    If requested, the manifest of the first tarball is written
+    from the same stream. Returns the SHA-256 hex digests of the tarballs.
+    """
+
+    if len(files) > 1:
+        LOGGER.info("Compressing %i images from one archive stream.", len(files))
+
+    consumers = []
+
+    if args.manifest:
+        LOGGER.info("Writing image manifest from the archive stream.")
+        consumers.append(manifest_writer(next(iter(files.values())), args.root))
+
+    return variants.create(
+        files,
         args.root,
-        compression=args.compression,
+        members=ordered,
+        numeric_owner=args.reproducible,
+        sparse=args.sparse,
         compression_level=args.compression_level,
+        reproducible=args.reproducible,
+        mtime=source_date_epoch() if args.reproducible else None,
+        on_member=on_member,
+        consumers=consumers,
         verbose=args.verbose,
     )
+
+
+def make_image(files: dict[Compression, Path], args: Namespace) -> int:
+    """Creates tarballs from a reference system's root directory.
+
+    The root is walked once to list the members, from which the sidecar
+    metadata is counted, and read once by bsdtar. Several compressions
+    and the manifest share a single tar stream.
+    """
+
+    LOGGER.info("Listing archive members.")
+    ordered = list(members.walk(args.root))
+
+    if args.sort or args.reproducible:
+        LOGGER.info("Sorting archive members.")
+        ordered = members.order(ordered)
+
+    if not args.prefetch:
+        digests = archive(files, ordered, args)
+    else:
+        LOGGER.info("Prefetching up to %i MiB ahead.", args.prefetch)
+
+        with prefetch.Prefetcher(
+            args.root, ordered, args.prefetch * 1024 * 1024
+        ) as prefetcher:
+            digests = archive(files, ordered, args, prefetcher.advance)
+
+    LOGGER.info("Writing image metadata.")
+    metadata = None
+
+    for compression, file in files.items():
+        if metadata is None:
+            metadata = sidecar.collect(args.root, compression, ordered)
+
+        metadata = metadata._replace(
+            compression=compression, sha256=digests[compression]
+        )
+        sidecar.write_sidecar(file, metadata)
+
+    if metadata.holes:
+        LOGGER.info("Sparse files contain %i bytes in holes.", metadata.holes)
+
+    if args.manifest:
+        first, *others = files.values()
+
+        for file in others:
+            manifest.copy_manifest(first, file)
+
     return 0
 
 
@@ -101,14 +246,23 @@ def mkhidslimg(args: Namespace) -> int:
         LOGGER.error("Specified root is not a mount point.")
         return 1
 
-    file = Path(get_filename(args))
+    files = {
+        compression: Path(get_filename(args, compression))
+        for compression in dict.fromkeys(args.compression)
+    }
 
     if args.cifs:
         with SafeTemporaryDirectory() as tmpd:
-            with cifs_mount(tmpd, args) as mount:
-                return make_image(chroot(mount, file), args)
+            with cifs_mount(tmpd, args) as share:
+                return make_image(
+                    {
+                        compression: functions.chroot(share, file)
+                        for compression, file in files.items()
+                    },
+                    args,
+                )
 
-    return make_image(file, args)
+    return make_image(files, args)
 
 
 def main() -> int:
@@ -117,5 +271,5 @@ def main() -> int:
     args = get_args()
     basicConfig(format=FORMAT, level=DEBUG if args.debug else INFO)
 
-    with ErrorHandler(LOGGER):
+    with errorhandler.ErrorHandler(LOGGER):
         return mkhidslimg(args)
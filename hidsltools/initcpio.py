@@ -1,24 +1,257 @@
 """Initramfs tools."""
 
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha256
+from os import walk
 from pathlib import Path
+from shlex import join, split
+from shutil import copy2, rmtree
+from tempfile import mkdtemp
+from time import perf_counter
+from typing import Iterable, Iterator
 
-from hidsltools.functions import arch_chroot, exe
-from hidsltools.types import Glob
+from hidsltools.defaults import INITRAMFS_CACHE, ROOT
+from hidsltools.functions import arch_chroot, chroot as chroot_path, exe
+from hidsltools.logging import LOGGER
+from hidsltools.systemd import SYSTEMCTL, enable_units
+from hidsltools.types import Glob, Preset
 
 
-__all__ = ["INITRAMFS", "mkinitcpio"]
+__all__ = [
+    "INITRAMFS",
+    "INITRAMFS_CACHE",
+    "cache_key",
+    "load_presets",
+    "mkinitcpio",
+]
 
 
+BOOT = Path("/boot")
+CONFIG_FILES = [
+    Glob("/etc", "mkinitcpio.conf"),
+    Glob("/etc/mkinitcpio.conf.d", "*.conf"),
+    Glob("/etc/mkinitcpio.d", "*.preset"),
+    Glob("/etc/initcpio", "**/*"),
+    Glob("/usr/lib/initcpio", "**/*"),
+]
+DEFERRED_UNIT = Path("/etc/systemd/system/hidsl-initramfs.service")
+FIRMWARE = Path("/usr/lib/firmware")
 INITRAMFS = Glob("/boot", "initramfs-linux*.img")
+KERNELS = Glob("/usr/lib/modules", "*/vmlinuz")
 MKINITCPIO = "/usr/bin/mkinitcpio"
+PRESETS = Glob("/etc/mkinitcpio.d", "*.preset")
+SHELL = "/bin/sh"
 
 
-def mkinitcpio(*, chroot: Path | None = None, verbose: bool = False) -> None:
-    """Re-generates the initramfs."""
+def cache_key(*, root: Path = ROOT, presets: Iterable[str] = ()) -> str:
+    """Returns a digest over everything that determines the initramfs.
 
-    command = [MKINITCPIO, "-P"]
+    Configuration, presets and hooks are hashed by content, the kernels by
+    their version and the firmware tree by its metadata only.
+    The names of the presets to be built are part of the key as well.
+    """
+
+    digest = sha256()
+    digest.update(",".join(sorted(presets)).encode())
+
+    for kernel in sorted(Glob(chroot_path(root, KERNELS.path), KERNELS.glob)):
+        digest.update(kernel.parent.name.encode())
+        digest.update(str(kernel.stat().st_size).encode())
+
+    for glob in CONFIG_FILES:
+        for file in sorted(Glob(chroot_path(root, glob.path), glob.glob)):
+            if file.is_file():
+                digest.update(str(file.relative_to(root)).encode())
+                digest.update(file.read_bytes())
+
+    for directory, _, files in sorted(walk(chroot_path(root, FIRMWARE))):
+        for file in sorted(files):
+            stat = (path := Path(directory, file)).lstat()
+            name = path.relative_to(root)
+            digest.update(f"{name}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+
+    return digest.hexdigest()
+
+
+def install_cached(cached: Path, boot: Path) -> None:
+    """Installs cached initramfs images into the boot directory."""
+
+    for image in cached.iterdir():
+        LOGGER.debug("Installing cached %s.", image.name)
+        copy2(image, boot / image.name)
+
+
+def populate_cache(cached: Path, boot: Path) -> None:
+    """Stores the freshly generated initramfs images in the cache."""
+
+    cached.parent.mkdir(parents=True, exist_ok=True)
+    tmpd = Path(mkdtemp(dir=cached.parent))
+
+    try:
+        for image in Glob(boot, INITRAMFS.glob):
+            copy2(image, tmpd / image.name)
+
+        tmpd.rename(cached)
+    except OSError as error:
+        LOGGER.warning("Could not cache initramfs: %s", error)
+        rmtree(tmpd, ignore_errors=True)
+
+
+def load_presets(*, root: Path = ROOT) -> Iterator[Preset]:
+    """Yields the presets defined in the preset files."""
+
+    for file in sorted(Glob(chroot_path(root, PRESETS.path), PRESETS.glob)):
+        variables = {}
+
+        with file.open("r", encoding="utf-8") as lines:
+            for line in lines:
+                if "=" in (line := line.strip()) and not line.startswith("#"):
+                    key, value = line.split("=", maxsplit=1)
+                    variables[key] = " ".join(split(value.strip("()")))
+
+        for name in split(variables.get("PRESETS", "")):
+            yield Preset(
+                file.stem,
+                name,
+                variables.get(f"{name}_kver", variables.get("ALL_kver")),
+                variables.get(f"{name}_config", variables.get("ALL_config")),
+                variables.get(f"{name}_image"),
+                variables.get(f"{name}_options"),
+            )
+
+
+def select(presets: Iterable[Preset], names: Iterable[str]) -> list[Preset]:
+    """Selects presets by name ("fallback") or file and name ("linux:fallback")."""
+
+    names = set(names)
+    return [preset for preset in presets if {preset.name, str(preset)} & names]
+
+
+def build(
+    preset: Preset, *, chroot: Path | None = None, verbose: bool = False
+) -> float:
+    """Builds a single preset and returns the time it took in seconds."""
+
+    command = [MKINITCPIO, *preset.args]
 
     if chroot is not None:
         command = arch_chroot(chroot, command)
 
+    start = perf_counter()
     exe(command, verbose=verbose)
+    duration = perf_counter() - start
+    LOGGER.info("Built preset %s in %.2f s.", preset, duration)
+    return duration
+
+
+def script(presets: Iterable[Preset]) -> str:
+    """Returns a shell script that builds the presets concurrently.
+
+    The script fails if any of the builds fails.
+    """
+
+    lines = []
+
+    for preset in presets:
+        lines.append(f'{join([MKINITCPIO, *preset.args])} & pids="$pids $!"')
+
+    lines.append("status=0")
+    lines.append('for pid in $pids; do wait "$pid" || status=1; done')
+    lines.append("exit $status")
+    return "\n".join(lines)
+
+
+def build_all(
+    presets: Iterable[Preset], *, chroot: Path | None = None, verbose: bool = False
+) -> None:
+    """Builds the given presets concurrently.
+
+    In a chroot, all builds run from a single arch-chroot, since each
+    arch-chroot unmounts the API file systems that the others still use.
+    """
+
+    presets = list(presets)
+
+    if chroot is not None:
+        start = perf_counter()
+        exe(arch_chroot(chroot, [SHELL, "-c", script(presets)]), verbose=verbose)
+        LOGGER.info(
+            "Built %i presets in %.2f s.", len(presets), perf_counter() - start
+        )
+        return
+
+    with ThreadPoolExecutor(max_workers=len(presets) or 1) as executor:
+        futures = [
+            executor.submit(build, preset, chroot=chroot, verbose=verbose)
+            for preset in presets
+        ]
+
+    for future in futures:
+        future.result()
+
+
+def defer(presets: Iterable[Preset], *, root: Path = ROOT) -> None:
+    """Installs a oneshot unit that builds the given presets on first boot."""
+
+    with chroot_path(root, DEFERRED_UNIT).open("w", encoding="utf-8") as file:
+        file.write("[Unit]\n")
+        file.write("Description=Generate deferred initramfs presets\n\n")
+        file.write("[Service]\n")
+        file.write("Type=oneshot\n")
+
+        for preset in presets:
+            LOGGER.info("Deferring preset %s to first boot.", preset)
+            file.write(f"ExecStart={join([MKINITCPIO, *preset.args])}\n")
+
+        file.write(f"ExecStartPost={SYSTEMCTL} disable {DEFERRED_UNIT.name}\n\n")
+        file.write("[Install]\n")
+        file.write("WantedBy=multi-user.target\n")
+
+    enable_units([DEFERRED_UNIT.name], root=root)
+
+
+def mkinitcpio(
+    *,
+    chroot: Path | None = None,
+    presets: Iterable[str] | None = None,
+    deferred: Iterable[str] | None = None,
+    cache: Path | None = INITRAMFS_CACHE,
+    force: bool = False,
+    verbose: bool = False,
+) -> None:
+    """Re-generates the initramfs.
+
+    Each preset is built in a separate, concurrent mkinitcpio invocation.
+    If presets are given, only those are built, otherwise all presets are.
+    Deferred presets are built on first boot by a oneshot unit instead.
+
+    If a cache directory is given, the images are installed from it if
+    the cache key matches and stored in it otherwise.
+    Setting force always re-generates the images.
+    """
+
+    root = ROOT if chroot is None else chroot
+    boot = chroot_path(root, BOOT)
+    available = list(load_presets(root=root))
+
+    if deferred := select(available, deferred or ()):
+        defer(deferred, root=root)
+
+    if presets is not None:
+        available = select(available, presets)
+
+    if not (presets := [preset for preset in available if preset not in deferred]):
+        LOGGER.warning("No mkinitcpio presets to build.")
+
+    key = cache_key(root=root, presets=map(str, presets))
+    cached = None if cache is None else cache / key
+
+    if cached is not None and not force and cached.is_dir():
+        LOGGER.info("Installing initramfs from cache.")
+        return install_cached(cached, boot)
+
+    build_all(presets, chroot=chroot, verbose=verbose)
+
+    if cached is not None:
+        rmtree(cached, ignore_errors=True)
+        populate_cache(cached, boot)
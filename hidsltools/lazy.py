@@ -0,0 +1,29 @@
+"""Lazy module loading for fast program startup."""
+
+from importlib import import_module
+from importlib.util import LazyLoader, find_spec, module_from_spec
+from sys import modules
+from types import ModuleType
+
+
+__all__ = ["lazy_import"]
+
+
+def lazy_import(name: str) -> ModuleType:
+    """Returns the module, which is executed on first attribute access."""
+
+    if (module := modules.get(name)) is not None:
+        return module
+
+    spec = find_spec(name)
+    spec.loader = LazyLoader(spec.loader)
+    module = module_from_spec(spec)
+    modules[name] = module
+    spec.loader.exec_module(module)
+    parent, _, child = name.rpartition(".")
+
+    if parent:
+        # Like a regular import, bind the submodule to its package.
+        setattr(import_module(parent), child, module)
+
+    return module
@@ -0,0 +1,15 @@
+"""Access to C library functions not wrapped by the os module."""
+
+from ctypes import CDLL
+from ctypes.util import find_library
+from functools import cache
+
+
+__all__ = ["libc"]
+
+
+@cache
+def libc() -> CDLL:
+    """Returns the C library."""
+
+    return CDLL(find_library("c"), use_errno=True)
@@ -0,0 +1,250 @@
+"""Per-file manifests of images."""
+
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatchcase
+from gzip import GzipFile, open as gzip_open
+from hashlib import sha256
+from json import dumps, loads
+from os import readlink, scandir, stat_result
+from pathlib import Path
+from shutil import copyfile
+from stat import S_IMODE
+from tarfile import TarFile, TarInfo, open as tar_open
+from typing import IO, Iterable, Iterator
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+from hidsltools.checksums import hash_file
+from hidsltools.logging import LOGGER
+from hidsltools.types import ManifestEntry, MemberType
+
+
+__all__ = ["copy_manifest", "read_manifest", "stream", "verify", "write_manifest"]
+
+
+CHUNK_SIZE = 1024 * 1024
+COMPRESSION_LEVEL = 6
+SUFFIX = ".manifest.gz"
+TIMEOUT = 30  # Seconds
+
+
+def manifest(image: Path | str) -> Path | str:
+    """Returns the path or URL of the image's manifest file."""
+
+    if isinstance(image, str):
+        return image + SUFFIX
+
+    return image.with_name(image.name + SUFFIX)
+
+
+def skipped(path: str, skip: Iterable[str]) -> bool:
+    """Checks whether the path matches any of the glob patterns."""
+
+    return any(fnmatchcase(path, pattern) for pattern in skip)
+
+
+def walk(
+    root: Path, skip: Iterable[str] = ()
+) -> Iterator[tuple[str, MemberType, stat_result]]:
+    """Yields path, type and lstat() of all inodes below root."""
+
+    stack = [""]
+
+    while stack:
+        prefix = stack.pop()
+
+        with scandir(root / prefix if prefix else root) as entries:
+            for entry in entries:
+                path = f"{prefix}/{entry.name}" if prefix else entry.name
+
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(path)
+                    typ = MemberType.DIRECTORY
+                elif entry.is_symlink():
+                    typ = MemberType.SYMLINK
+                elif entry.is_file(follow_symlinks=False):
+                    typ = MemberType.FILE
+                else:
+                    typ = MemberType.OTHER
+
+                if not skipped(path, skip):
+                    yield path, typ, entry.stat(follow_symlinks=False)
+
+
+def hash_files(
+    root: Path, paths: Iterable[str], workers: int | None = None
+) -> Iterator[str]:
+    """Yields the SHA-256 hex digests of the files, hashed in parallel."""
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(hash_file, (root / path for path in paths))
+
+
+def hash_member(file: IO[bytes]) -> str:
+    """Returns the SHA-256 hex digest of an archived file's content."""
+
+    digest = sha256()
+
+    while chunk := file.read(CHUNK_SIZE):
+        digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def member_path(name: str) -> str:
+    """Returns the path of a tar member relative to root."""
+
+    return "/".join(part for part in name.split("/") if part not in {"", "."})
+
+
+def member_entry(member: TarInfo, tar: TarFile, root: Path) -> ManifestEntry:
+    """Returns the manifest entry of a tar member.
+
+    Hard links are hashed from their target below root,
+    since the archive only stores the content once.
+    """
+
+    size, digest = 0, None
+
+    if member.isdir():
+        typ = MemberType.DIRECTORY
+    elif member.issym():
+        typ, digest = MemberType.SYMLINK, member.linkname
+    elif member.islnk():
+        typ, file = MemberType.FILE, root / member_path(member.linkname)
+        size, digest = file.stat().st_size, hash_file(file)
+    elif member.isreg():
+        typ, size = MemberType.FILE, member.size
+        digest = hash_member(tar.extractfile(member))
+    else:
+        typ = MemberType.OTHER
+
+    return ManifestEntry(
+        member_path(member.name), typ, member.mode, member.uid, member.gid, size, digest
+    )
+
+
+def stream(source: IO[bytes], root: Path) -> Iterator[ManifestEntry]:
+    """Yields the manifest entries of an uncompressed tar stream of root.
+
+    The members' content is hashed as it passes,
+    so that root is not read a second time.
+    """
+
+    with tar_open(fileobj=source, mode="r|") as tar:
+        while (member := tar.next()) is not None:
+            tar.members.clear()
+
+            if member_path(member.name):
+                yield member_entry(member, tar, root)
+
+
+def compare(entry: ManifestEntry, typ: MemberType, stat: stat_result) -> str | None:
+    """Returns a description of the metadata divergence, if any."""
+
+    if typ is not entry.type:
+        return f"type is {typ.label}, expected {entry.type.label}"
+
+    if (mode := S_IMODE(stat.st_mode)) != entry.mode:
+        return f"mode is {mode:04o}, expected {entry.mode:04o}"
+
+    if (stat.st_uid, stat.st_gid) != (entry.uid, entry.gid):
+        return (
+            f"owner is {stat.st_uid}:{stat.st_gid}, "
+            f"expected {entry.uid}:{entry.gid}"
+        )
+
+    if typ is MemberType.FILE and stat.st_size != entry.size:
+        return f"size is {stat.st_size}, expected {entry.size}"
+
+    return None
+
+
+def verify(
+    root: Path,
+    entries: Iterable[ManifestEntry],
+    *,
+    workers: int | None = None,
+    skip: Iterable[str] = (),
+) -> list[str]:
+    """Verifies the tree below root against the manifest entries.
+
+    Files are only hashed if their metadata matches.
+    Paths matching any of the skip patterns are ignored.
+    Returns descriptions of all divergences.
+    """
+
+    skip = tuple(skip)
+    inodes = {path: (typ, stat) for path, typ, stat in walk(root, skip)}
+    divergences = []
+    files = []
+
+    for entry in entries:
+        if skipped(entry.path, skip):
+            continue
+
+        if (inode := inodes.pop(entry.path, None)) is None:
+            divergences.append(f"{entry.path}: missing")
+        elif (divergence := compare(entry, *inode)) is not None:
+            divergences.append(f"{entry.path}: {divergence}")
+        elif entry.type is MemberType.FILE:
+            files.append(entry)
+        elif entry.type is MemberType.SYMLINK:
+            if (target := readlink(root / entry.path)) != entry.digest:
+                divergences.append(f"{entry.path}: points to {target}")
+
+    digests = hash_files(root, (entry.path for entry in files), workers)
+
+    for entry, digest in zip(files, digests):
+        if digest != entry.digest:
+            divergences.append(f"{entry.path}: content differs")
+
+    for path in inodes:
+        divergences.append(f"{path}: unexpected")
+
+    return divergences
+
+
+def write_manifest(image: Path, entries: Iterable[ManifestEntry]) -> None:
+    """Writes the manifest file of the image."""
+
+    with gzip_open(
+        manifest(image), "wt", compresslevel=COMPRESSION_LEVEL, encoding="ascii"
+    ) as file:
+        for entry in entries:
+            file.write(dumps(entry.to_json()))
+            file.write("\n")
+
+
+def copy_manifest(image: Path, other: Path) -> None:
+    """Copies the manifest file of the image to the other image."""
+
+    copyfile(manifest(image), manifest(other))
+
+
+def parse(file: IO[bytes]) -> list[ManifestEntry]:
+    """Parses a gzip compressed manifest."""
+
+    with GzipFile(fileobj=file) as lines:
+        return [ManifestEntry.from_json(loads(line)) for line in lines]
+
+
+def read_manifest(image: Path | str) -> list[ManifestEntry] | None:
+    """Reads the manifest of the image file or URL if it exists."""
+
+    try:
+        if isinstance(image, str):
+            with urlopen(manifest(image), timeout=TIMEOUT) as response:
+                return parse(response)
+
+        with manifest(image).open("rb") as file:
+            return parse(file)
+    except FileNotFoundError:
+        pass
+    except HTTPError as error:
+        if error.code != 404:
+            raise
+
+    LOGGER.debug("No manifest for image %s.", image)
+    return None
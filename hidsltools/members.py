@@ -0,0 +1,58 @@
+"""Archive member lists."""
+
+from os import scandir
+from pathlib import Path
+from typing import Iterable, Iterator
+
+from hidsltools.sparse import holes
+from hidsltools.types import Member, MemberType
+
+
+__all__ = ["order", "walk"]
+
+
+def walk(root: Path) -> Iterator[Member]:
+    """Yields all inodes below root as members relative to root."""
+
+    stack = [""]
+
+    while stack:
+        prefix = stack.pop()
+
+        with scandir(root / prefix if prefix else root) as entries:
+            for entry in entries:
+                path = f"{prefix}/{entry.name}" if prefix else entry.name
+
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(path)
+                    yield Member(path, MemberType.DIRECTORY, 0)
+                elif entry.is_symlink():
+                    yield Member(path, MemberType.SYMLINK, 0)
+                elif entry.is_file(follow_symlinks=False):
+                    stat = entry.stat(follow_symlinks=False)
+                    yield Member(
+                        path, MemberType.FILE, stat.st_size, holes(entry.path, stat)
+                    )
+                else:
+                    yield Member(path, MemberType.OTHER, 0)
+
+
+def locality_key(member: Member) -> tuple[int, str, int, str]:
+    """Returns a sort key grouping similar members.
+
+    Directories come first, sorted by path, so that they precede their
+    contents. Files are grouped by extension and by size class.
+    """
+
+    if member.type != MemberType.FILE:
+        return (member.type.rank, "", 0, member.path)
+
+    name = member.path.rsplit("/", maxsplit=1)[-1]
+    extension = name.rsplit(".", maxsplit=1)[-1] if "." in name[1:] else ""
+    return (member.type.rank, extension, member.size.bit_length() // 2, member.path)
+
+
+def order(members: Iterable[Member]) -> list[Member]:
+    """Returns the members in a deterministic, locality-sorted order."""
+
+    return sorted(members, key=locality_key)
@@ -1,17 +1,85 @@
 """File system creation."""
 
+from os import SEEK_END
 from pathlib import Path
 
 from hidsltools.functions import exe
-from hidsltools.types import Filesystem
+from hidsltools.types import (
+    BlockDeviceInfo,
+    Ext4Options,
+    Filesystem,
+    ImageMetadata,
+    MkfsProfile,
+)
 
 
-__all__ = ["mkfs"]
+__all__ = ["get_size", "mkfs", "tune_ext4"]
 
 
+BLOCK_SIZE = 4096
+DEFAULT_INODE_RATIO = 16 * 1024  # mke2fs.conf default
+INODE_HEADROOM = 4  # Inodes per image file for updates and runtime data.
+JOURNAL_SIZE = 64  # MiB, mke2fs default for 2 to 16 GiB.
+JOURNAL_THRESHOLD = 16 * 1024**3  # Bytes, above which mke2fs uses more.
+MAX_INODE_RATIO = 1024 * 1024
 MKFS = "/usr/bin/mkfs"
 
 
+def get_size(device: Path) -> int:
+    """Returns the size of a device or file in bytes."""
+
+    with device.open("rb") as file:
+        return file.seek(0, SEEK_END)
+
+
+def tune_ext4(
+    size: int,
+    *,
+    profile: MkfsProfile = MkfsProfile.DEFAULT,
+    metadata: ImageMetadata | None = None,
+    info: BlockDeviceInfo | None = None,
+    discarded: bool = False,
+) -> Ext4Options:
+    """Returns ext4 options for a file system of the given size in bytes.
+
+    The default profile keeps the mke2fs defaults, like hirestore does.
+    Otherwise, the inode ratio is derived from the image's file count,
+    the stride and stripe width from the device topology. The image
+    profile fully initializes the fewer inode tables at mkfs time, so that
+    the kernel does not initialize them during extraction. The lazy
+    profile leaves inode tables and journal to be initialized lazily.
+    """
+
+    if profile is MkfsProfile.DEFAULT:
+        return Ext4Options()
+
+    bytes_per_inode = None
+
+    if metadata is not None and metadata.files:
+        ratio = size // (metadata.files * INODE_HEADROOM)
+        bytes_per_inode = max(DEFAULT_INODE_RATIO, min(ratio, MAX_INODE_RATIO))
+        bytes_per_inode -= bytes_per_inode % BLOCK_SIZE
+
+    stride = stripe_width = None
+
+    if info is not None and info.minimum_io_size > BLOCK_SIZE:
+        stride = info.minimum_io_size // BLOCK_SIZE
+
+        if info.optimal_io_size > info.minimum_io_size:
+            stripe_width = info.optimal_io_size // BLOCK_SIZE
+
+    lazy = profile is MkfsProfile.LAZY
+    return Ext4Options(
+        bytes_per_inode=bytes_per_inode,
+        journal_size=JOURNAL_SIZE if size > JOURNAL_THRESHOLD else None,
+        lazy_itable_init=lazy,
+        lazy_journal_init=lazy,
+        discard=False if discarded else None,
+        stride=stride,
+        stripe_width=stripe_width,
+    )
+
+
 def mkvfat(
     device: Path, *, label: str | None = None, fat_size: int = 32, verbose: bool = False
 ) -> None:
@@ -29,7 +97,36 @@ def mkvfat(
     exe(command, verbose=verbose)
 
 
-def mkext4(device: Path, *, label: str | None = None, verbose: bool = False) -> None:
+def extended_options(options: Ext4Options) -> list[str]:
+    """Returns the extended options of mke2fs -E."""
+
+    extended = []
+
+    if options.lazy_itable_init is not None:
+        extended.append(f"lazy_itable_init={int(options.lazy_itable_init)}")
+
+    if options.lazy_journal_init is not None:
+        extended.append(f"lazy_journal_init={int(options.lazy_journal_init)}")
+
+    if options.discard is not None:
+        extended.append("discard" if options.discard else "nodiscard")
+
+    if options.stride is not None:
+        extended.append(f"stride={options.stride}")
+
+    if options.stripe_width is not None:
+        extended.append(f"stripe_width={options.stripe_width}")
+
+    return extended
+
+
+def mkext4(
+    device: Path,
+    *,
+    label: str | None = None,
+    options: Ext4Options = Ext4Options(),
+    verbose: bool = False,
+) -> None:
     """Creates an ext4 file system."""
 
     command = [MKFS, "-t", "ext4", "-F"]
@@ -37,6 +134,15 @@ def mkext4(device: Path, *, label: str | None = None, verbose: bool = False) ->
     if label is not None:
         command += ["-L", label]
 
+    if options.bytes_per_inode is not None:
+        command += ["-i", str(options.bytes_per_inode)]
+
+    if options.journal_size is not None:
+        command += ["-J", f"size={options.journal_size}"]
+
+    if extended := extended_options(options):
+        command += ["-E", ",".join(extended)]
+
     command.append(str(device))
     exe(command, verbose=verbose)
 
@@ -1,10 +1,14 @@
 """Common functions."""
 
+from ctypes import c_long, c_ulong, get_errno
+from errno import ENOSYS
+from os import close, fsencode, read, strerror
 from pathlib import Path
 from typing import Iterable
 
 from hidsltools.defaults import ROOT
 from hidsltools.functions import chroot, exe
+from hidsltools.libc import libc
 from hidsltools.logging import LOGGER
 from hidsltools.types import Filesystem, Partition
 
@@ -12,8 +16,132 @@ from hidsltools.types import Filesystem, Partition
 __all__ = ["MountContext"]
 
 
+AT_FDCWD = -100
+FSCONFIG_CMD_CREATE = 6
+FSCONFIG_SET_STRING = 1
+FSMOUNT_CLOEXEC = 0x1
+FSOPEN_CLOEXEC = 0x1
+MESSAGE_SIZE = 4096
 MOUNT = "/usr/bin/mount"
+MOVE_MOUNT_F_EMPTY_PATH = 0x4
+SYS_FSCONFIG = 431  # The new mount API has the same numbers on all
+SYS_FSMOUNT = 432  # architectures but alpha.
+SYS_FSOPEN = 430
+SYS_MOVE_MOUNT = 429
 UMOUNT = "/usr/bin/umount"
+UMOUNT_NOFOLLOW = 0x8
+
+
+def check(result: int, *filenames: Path | str) -> int:
+    """Raises an OSError if the C function failed."""
+
+    if result < 0:
+        raise OSError(errno := get_errno(), strerror(errno), *map(str, filenames))
+
+    return result
+
+
+def syscall(number: int, *args) -> int:
+    """Invokes a system call."""
+
+    function = libc().syscall
+    function.restype = c_long
+    args = [c_long(arg) if isinstance(arg, int) else arg for arg in args]
+    return check(function(number, *args))
+
+
+def messages(fs_fd: int) -> Iterable[str]:
+    """Yields the messages the kernel logged to a file system context."""
+
+    while True:
+        try:
+            message = read(fs_fd, MESSAGE_SIZE)
+        except OSError:
+            return  # ENODATA, once all messages have been read.
+
+        if not message:
+            return
+
+        yield message.decode(errors="replace")
+
+
+def fsmount(
+    device: Path, mountpoint: Path, fstype: Filesystem, options: dict[str, str]
+) -> None:
+    """Mounts a file system using the new mount API."""
+
+    fs_fd = syscall(SYS_FSOPEN, fsencode(str(fstype)), FSOPEN_CLOEXEC)
+
+    try:
+        try:
+            for key, value in {"source": device, **options}.items():
+                syscall(
+                    SYS_FSCONFIG,
+                    fs_fd,
+                    FSCONFIG_SET_STRING,
+                    fsencode(key),
+                    fsencode(str(value)),
+                    0,
+                )
+
+            syscall(SYS_FSCONFIG, fs_fd, FSCONFIG_CMD_CREATE, None, None, 0)
+        except OSError as error:
+            error.filename = str(device)
+
+            for message in messages(fs_fd):
+                LOGGER.debug("Kernel: %s", message)
+
+            raise
+
+        mount_fd = syscall(SYS_FSMOUNT, fs_fd, FSMOUNT_CLOEXEC, 0)
+    finally:
+        close(fs_fd)
+
+    try:
+        syscall(
+            SYS_MOVE_MOUNT,
+            mount_fd,
+            b"",
+            AT_FDCWD,
+            fsencode(mountpoint),
+            MOVE_MOUNT_F_EMPTY_PATH,
+        )
+    finally:
+        close(mount_fd)
+
+
+def native_mount(
+    device: Path, mountpoint: Path, fstype: Filesystem, options: dict[str, str]
+) -> None:
+    """Mounts a file system via system calls.
+
+    Falls back to mount(2) on kernels without the new mount API.
+    """
+
+    try:
+        return fsmount(device, mountpoint, fstype, options)
+    except OSError as error:
+        if error.errno != ENOSYS:
+            raise
+
+    data = ",".join(f"{key}={value}" for key, value in options.items())
+    check(
+        libc().mount(
+            fsencode(device),
+            fsencode(mountpoint),
+            fsencode(str(fstype)),
+            c_ulong(0),
+            data.encode() or None,
+        ),
+        device,
+        mountpoint,
+    )
+
+
+def native_umount(mountpoint: Path) -> None:
+    """Umounts a mountpoint via umount2(2)."""
+
+    check(libc().umount2(fsencode(mountpoint), UMOUNT_NOFOLLOW), mountpoint)
 
 
 def mount(
@@ -21,10 +149,21 @@ def mount(
     mountpoint: Path,
     *,
     fstype: Filesystem | None = None,
+    native: bool = True,
     verbose: bool = False,
     **options,
 ) -> None:
-    """Mounts a partition."""
+    """Mounts a partition.
+
+    If native is True, local file systems are mounted via system calls
+    and the mount utility is only used as a fallback.
+    """
+
+    if native and fstype in {Filesystem.EXT4, Filesystem.VFAT}:
+        try:
+            return native_mount(device, mountpoint, fstype, options)
+        except OSError as error:
+            LOGGER.warning("Could not mount %s natively: %s", device, error)
 
     command = [MOUNT]
 
@@ -38,8 +177,22 @@ def mount(
     exe(command, verbose=verbose)
 
 
-def umount(mountpoint_or_device: Path, *, verbose: bool = False) -> None:
-    """Umounts a mountpoint."""
+def umount(
+    mountpoint_or_device: Path, *, native: bool = True, verbose: bool = False
+) -> None:
+    """Umounts a mountpoint.
+
+    If native is True, umount2(2) is used
+    and the umount utility is only used as a fallback.
+    """
+
+    if native:
+        try:
+            return native_umount(mountpoint_or_device)
+        except OSError as error:
+            LOGGER.warning(
+                "Could not umount %s natively: %s", mountpoint_or_device, error
+            )
 
     exe([UMOUNT, str(mountpoint_or_device)], verbose=verbose)
 
@@ -52,12 +205,14 @@ class MountContext:
         partitions: Iterable[Partition],
         *,
         root: Path | str = ROOT,
+        native: bool = True,
         verbose: bool = False,
         **options,
     ):
         """Sets the partitions."""
         self.partitions = partitions
         self.root = Path(root)
+        self.native = native
         self.verbose = verbose
         self.options = options
 
@@ -84,6 +239,7 @@ class MountContext:
                 partition.device,
                 mountpoint,
                 fstype=partition.filesystem,
+                native=self.native,
                 verbose=self.verbose,
                 **self.options,
             )
@@ -93,4 +249,4 @@ class MountContext:
         for partition in self.sorted_partitions(reverse=True):
             mountpoint = chroot(self.root, partition.mountpoint)
             LOGGER.debug("Umounting %s.", mountpoint)
-            umount(mountpoint, verbose=self.verbose)
+            umount(mountpoint, native=self.native, verbose=self.verbose)
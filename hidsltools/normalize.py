@@ -0,0 +1,160 @@
+"""Normalization of tar stream metadata for reproducible images."""
+
+from __future__ import annotations
+from typing import IO, Iterator
+
+
+__all__ = ["normalize"]
+
+
+BLOCK_SIZE = 512
+CHECKSUM = slice(148, 156)
+CHUNK_SIZE = 1024 * 1024
+DROPPED = {b"atime", b"ctime", b"gname", b"uname", b"LIBARCHIVE.creationtime"}
+EXTENDED = 482  # Offset of the GNU sparse header's extension flag.
+EXTENSION_EXTENDED = 504  # Offset of the flag in an extension block.
+GNU_SPARSE = b"S"
+GROUP_NAME = slice(297, 329)
+MTIME = slice(136, 148)
+PAX_HEADERS = {b"g", b"x"}
+SIZE = slice(124, 136)
+TYPE = 156
+USER_NAME = slice(265, 297)
+ZERO_BLOCK = bytes(BLOCK_SIZE)
+
+
+def read_blocks(source: IO[bytes], size: int) -> bytes:
+    """Reads the blocks holding size bytes.
+
+    Returns an empty bytes object at the end of the stream.
+    """
+
+    size += -size % BLOCK_SIZE
+    data = b""
+
+    while len(data) < size:
+        if not (chunk := source.read(size - len(data))):
+            if data:
+                raise EOFError("Truncated tar stream.")
+
+            break
+
+        data += chunk
+
+    return data
+
+
+def parse_number(field: bytes) -> int:
+    """Parses an octal or base-256 number field."""
+
+    if field[0] & 0x80:
+        return int.from_bytes(field[1:], "big")
+
+    return int(field.strip(b"\0 ") or b"0", 8)
+
+
+def clamp(value: bytes, mtime: int | None) -> bytes:
+    """Clamps a pax time value to mtime."""
+
+    if mtime is None or float(value) <= mtime:
+        return value
+
+    return str(mtime).encode()
+
+
+def pax_record(key: bytes, value: bytes) -> bytes:
+    """Returns a pax extended header record."""
+
+    payload = b" " + key + b"=" + value + b"\n"
+    length = len(payload) + len(str(len(payload)))
+
+    if len(str(length)) > len(str(len(payload))):
+        length += 1
+
+    return str(length).encode() + payload
+
+
+def pax_records(data: bytes, mtime: int | None) -> bytes:
+    """Removes volatile records from pax extended header data
+    and clamps the modification time.
+    """
+
+    records = []
+    offset = 0
+
+    while offset < len(data):
+        length, _ = data[offset:].split(b" ", maxsplit=1)
+        record = data[offset + len(length) + 1 : offset + int(length) - 1]
+        offset += int(length)
+        key, value = record.split(b"=", maxsplit=1)
+
+        if key in DROPPED:
+            continue
+
+        if key == b"mtime":
+            value = clamp(value, mtime)
+
+        records.append(pax_record(key, value))
+
+    return b"".join(records)
+
+
+def header(block: bytes, mtime: int | None, size: int | None = None) -> bytes:
+    """Returns the header block without owner names, with the
+    modification time clamped to mtime and with a new checksum.
+    """
+
+    block = bytearray(block)
+    block[USER_NAME] = bytes(USER_NAME.stop - USER_NAME.start)
+    block[GROUP_NAME] = bytes(GROUP_NAME.stop - GROUP_NAME.start)
+
+    if size is not None:
+        block[SIZE] = b"%011o\0" % size
+
+    if mtime is not None and not block[MTIME][0] & 0x80:
+        if parse_number(block[MTIME]) > mtime:
+            block[MTIME] = b"%011o\0" % mtime
+
+    block[CHECKSUM] = b" " * 8
+    block[CHECKSUM] = b"%06o\0 " % sum(block)
+    return bytes(block)
+
+
+def normalize(source: IO[bytes], mtime: int | None = None) -> Iterator[bytes]:
+    """Yields the tar stream with normalized metadata.
+
+    Owner names and access and change times are removed
+    and modification times are clamped to mtime, if given.
+    Member data is passed through unchanged.
+    """
+
+    while block := read_blocks(source, BLOCK_SIZE):
+        if block == ZERO_BLOCK:
+            yield block
+
+            while chunk := source.read(BLOCK_SIZE * 16):
+                yield chunk
+
+            return
+
+        size = parse_number(block[SIZE])
+
+        if block[TYPE : TYPE + 1] in PAX_HEADERS:
+            data = pax_records(read_blocks(source, size)[:size], mtime)
+            yield header(block, mtime, len(data))
+            yield data + bytes(-len(data) % BLOCK_SIZE)
+            continue
+
+        yield header(block, mtime)
+        extended = block[TYPE : TYPE + 1] == GNU_SPARSE and block[EXTENDED]
+
+        while extended:
+            yield (extension := read_blocks(source, BLOCK_SIZE))
+            extended = extension[EXTENSION_EXTENDED]
+
+        while size > 0:
+            if not (chunk := read_blocks(source, min(size, CHUNK_SIZE))):
+                raise EOFError("Truncated tar stream.")
+
+            yield chunk
+            size -= len(chunk)
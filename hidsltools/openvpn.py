@@ -4,15 +4,16 @@ from pathlib import Path
 
 from hidsltools.defaults import ROOT
 from hidsltools.functions import chroot, rmsubtree
+from hidsltools.types import RemovalStats
 
 
-__all__ = ["delete_client_config"]
+__all__ = ["CLIENTS_DIR", "delete_client_config"]
 
 
 CLIENTS_DIR = Path("/etc/openvpn/client")
 
 
-def delete_client_config(*, root: Path = ROOT) -> None:
+def delete_client_config(*, root: Path = ROOT) -> RemovalStats:
     """Deletes OpenVPN clients configuration."""
 
-    rmsubtree(chroot(root, CLIENTS_DIR))
+    return rmsubtree(chroot(root, CLIENTS_DIR))
@@ -1,17 +1,25 @@
 """Pacman related operations."""
 
+from contextlib import contextmanager
+from os import O_CREAT, O_EXCL, O_WRONLY, close, open as os_open
 from pathlib import Path
+from typing import Iterator
 
-from hidsltools.functions import exe
-from hidsltools.types import Glob
+from hidsltools.defaults import ROOT
+from hidsltools.functions import chroot, exe
+from hidsltools.logging import LOGGER
+from hidsltools.types import Glob, RemovalStats
 
 
-__all__ = ["CACHED_PKGS", "LOCKFILE", "clean"]
+__all__ = ["CACHED_PKGS", "LOCKFILE", "clean", "lock"]
 
 
 CACHED_PKGS = Glob("/var/cache/pacman/pkg", "*.pkg*")
+LOCAL_DB = Glob("/var/lib/pacman/local", "*/desc")
 LOCKFILE = Path("/var/lib/pacman/db.lck")
 PACMAN = "/usr/bin/pacman"
+PACMAN_CONF = Path("/etc/pacman.conf")
+SYNC_DBS = Glob("/var/lib/pacman/sync", "*")
 
 
 def pacman_sc(*, root: Path | None = None, verbose: bool = False) -> None:
@@ -36,8 +44,103 @@ def pacman_scc(*, root: Path | None = None, verbose: bool = False) -> None:
     exe(command, verbose=verbose)
 
 
-def clean(*, root: Path | None = None, verbose: bool = False) -> None:
-    """Clean the pacman cache."""
+def installed_packages(*, root: Path = ROOT) -> Iterator[str]:
+    """Yields the package file name prefixes of installed packages."""
 
-    pacman_sc(root=root, verbose=verbose)
-    pacman_scc(root=root, verbose=verbose)
+    for desc in Glob(chroot(root, LOCAL_DB.path), LOCAL_DB.glob):
+        fields = {}
+
+        with desc.open("r", encoding="utf-8") as file:
+            for block in file.read().split("\n\n"):
+                if block.startswith("%") and "\n" in block:
+                    key, value = block.split("\n", maxsplit=1)
+                    fields[key.strip("%")] = value.strip()
+
+        yield f"{fields['NAME']}-{fields['VERSION']}-{fields['ARCH']}.pkg"
+
+
+def repositories(*, root: Path = ROOT) -> set[str]:
+    """Returns the names of the repositories configured in pacman.conf."""
+
+    with chroot(root, PACMAN_CONF).open("r", encoding="utf-8") as file:
+        return {
+            line[1:-1]
+            for line in map(str.strip, file)
+            if line.startswith("[") and line.endswith("]") and line != "[options]"
+        }
+
+
+def stale_sync_dbs(*, root: Path = ROOT) -> Iterator[Path]:
+    """Yields sync database files of repositories no longer configured.
+
+    Directories, such as pacman's temporary download directories, are skipped.
+    """
+
+    repos = repositories(root=root)
+
+    for file in Glob(chroot(root, SYNC_DBS.path), SYNC_DBS.glob):
+        if file.is_file() and file.name.split(".", maxsplit=1)[0] not in repos:
+            yield file
+
+
+def cached_packages(
+    *, root: Path = ROOT, keep_installed: bool = False
+) -> Iterator[Path]:
+    """Yields the cached package files to be removed."""
+
+    keep = tuple(installed_packages(root=root)) if keep_installed else ()
+
+    for file in Glob(chroot(root, CACHED_PKGS.path), CACHED_PKGS.glob):
+        if not keep or not file.name.startswith(keep):
+            yield file
+
+
+def clean(
+    *,
+    root: Path | None = None,
+    keep_installed: bool = False,
+    verbose: bool = False,
+) -> RemovalStats:
+    """Clean the pacman cache.
+
+    This is equivalent to pacman -Sc followed by pacman -Scc, but does not
+    load the databases. If keep_installed is True, packages of the installed
+    versions are kept in the cache, like pacman -Sc alone does.
+    """
+
+    root = ROOT if root is None else root
+    stats = RemovalStats()
+
+    with lock(root=root):
+        files = [
+            *cached_packages(root=root, keep_installed=keep_installed),
+            *stale_sync_dbs(root=root),
+        ]
+
+        for file in files:
+            if verbose:
+                LOGGER.info("Removing: %s", file)
+
+            stats += RemovalStats(files=1, bytes=file.lstat().st_blocks * 512)
+            file.unlink()
+
+    LOGGER.debug("Reclaimed %i bytes from the package cache.", stats.bytes)
+    return stats
+
+
+@contextmanager
+def lock(*, root: Path = ROOT) -> Iterator[None]:
+    """Holds the pacman database lock."""
+
+    lockfile = chroot(root, LOCKFILE)
+
+    try:
+        close(os_open(lockfile, O_WRONLY | O_CREAT | O_EXCL, 0o000))
+    except FileExistsError:
+        LOGGER.critical("Pacman database is locked: %s", lockfile)
+        raise SystemExit(1) from None
+
+    try:
+        yield
+    finally:
+        lockfile.unlink()
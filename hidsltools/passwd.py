@@ -1,44 +1,97 @@
-"""Parsing of /etc/passwd."""
+"""Parsing of /etc/passwd and /etc/group."""
 
 from __future__ import annotations
 from pathlib import Path
-from typing import Callable, Iterator
+from typing import Callable, Generic, Iterator, TypeVar
 
 from hidsltools.defaults import ROOT
-from hidsltools.types import PasswdEntry
+from hidsltools.types import GroupEntry, PasswdEntry
 
 
-__all__ = ["get_user", "passwd"]
+__all__ = ["get_group", "get_user", "group", "passwd"]
 
 
+ETC_GROUP = Path("etc/group")
 ETC_PASSWD = Path("etc/passwd")
+Entry = TypeVar("Entry", GroupEntry, PasswdEntry)
 
 
-def passwd(*, root: Path = ROOT) -> Iterator[PasswdEntry]:
-    """Yields passwd entries."""
+class Database(Generic[Entry]):
+    """A parsed database file indexed by name and ID."""
+
+    __slots__ = ("entries", "by_name", "by_id", "stamp")
+
+    def __init__(self, entries: list[Entry], stamp: tuple[int, int, int, int]):
+        """Indexes the entries."""
+        self.entries = entries
+        self.by_name = {}
+        self.by_id = {}
+        self.stamp = stamp
+
+        for entry in entries:
+            # Like getpwnam() and getpwuid(), the first entry wins.
+            self.by_name.setdefault(entry.name, entry)
+            self.by_id.setdefault(entry[2], entry)  # UID or GID
+
+    def get(self, ident: str | int) -> Entry:
+        """Returns the entry with the given name or ID."""
+        if isinstance(ident, str):
+            return self.by_name[ident]
+
+        if isinstance(ident, int):
+            return self.by_id[ident]
+
+        raise TypeError("Identifier must be str (name) or int (ID).")
+
+
+CACHE: dict[Path, Database] = {}
+
 
-    with (root / ETC_PASSWD).open("r", encoding="utf-8") as file:
-        for line in file:
-            if line := line.strip():
-                yield PasswdEntry.from_string(line)
+def load(file: Path, parser: Callable[[str], Entry]) -> Database[Entry]:
+    """Returns the database of the file.
 
+    The parsed database is cached until the file's
+    device, inode, size or modification time change.
+    """
 
-def match(ident: str | int) -> Callable[[PasswdEntry], bool]:
-    """Returns a function to match passwd entries."""
+    stat = file.stat()
+    stamp = (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
 
-    if isinstance(ident, str):
-        return lambda passwd_entry: passwd_entry.name == ident
+    if (database := CACHE.get(file)) is not None and database.stamp == stamp:
+        return database
 
-    if isinstance(ident, int):
-        return lambda passwd_entry: passwd_entry.uid == ident
+    with file.open("r", encoding="utf-8") as lines:
+        entries = [parser(line) for line in map(str.strip, lines) if line]
 
-    raise TypeError("Identifier must be str (name) or int (UID).")
+    CACHE[file] = database = Database(entries, stamp)
+    return database
+
+
+def passwd(*, root: Path = ROOT) -> Iterator[PasswdEntry]:
+    """Yields passwd entries."""
+
+    yield from load(root / ETC_PASSWD, PasswdEntry.from_string).entries
+
+
+def group(*, root: Path = ROOT) -> Iterator[GroupEntry]:
+    """Yields group entries."""
+
+    yield from load(root / ETC_GROUP, GroupEntry.from_string).entries
 
 
 def get_user(ident: str | int, *, root: Path = ROOT) -> PasswdEntry:
     """Returns the passwd entry for the given user."""
 
-    for passwd_entry in filter(match(ident), passwd(root=root)):
-        return passwd_entry
+    try:
+        return load(root / ETC_PASSWD, PasswdEntry.from_string).get(ident)
+    except KeyError:
+        raise ValueError("No matching passwd entry found.") from None
+
+
+def get_group(ident: str | int, *, root: Path = ROOT) -> GroupEntry:
+    """Returns the group entry for the given group."""
 
-    raise ValueError("No matching passwd entry found.")
+    try:
+        return load(root / ETC_GROUP, GroupEntry.from_string).get(ident)
+    except KeyError:
+        raise ValueError("No matching group entry found.") from None
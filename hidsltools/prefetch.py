@@ -0,0 +1,120 @@
+"""Read-ahead of files ahead of the archiver."""
+
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+from itertools import accumulate
+from os import O_NOATIME, O_RDONLY, POSIX_FADV_WILLNEED, close, open as os_open
+from os import posix_fadvise
+from pathlib import Path
+from threading import Condition, Thread
+
+from hidsltools.logging import LOGGER
+from hidsltools.types import Member, MemberType
+
+
+__all__ = ["Prefetcher"]
+
+
+LISTING = b"a "  # Prefix of bsdtar's verbose listing lines.
+WORKERS = 8  # Concurrent requests, so that the I/O scheduler can sort seeks.
+
+
+def prefetch(file: Path, size: int) -> None:
+    """Asks the kernel to read the file into the page cache."""
+
+    try:
+        fd = os_open(file, O_RDONLY | O_NOATIME)
+    except PermissionError:
+        fd = os_open(file, O_RDONLY)  # O_NOATIME requires ownership.
+
+    try:
+        posix_fadvise(fd, 0, size, POSIX_FADV_WILLNEED)
+    finally:
+        close(fd)
+
+
+class Prefetcher(Thread):
+    """Reads the members' files ahead of the archiver.
+
+    At most budget bytes are read ahead of the member
+    that the archiver has last reported via advance().
+    """
+
+    def __init__(
+        self, root: Path, members: list[Member], budget: int, workers: int = WORKERS
+    ):
+        """Sets the root, the members in archive order and the budget in bytes."""
+        super().__init__(name="prefetcher", daemon=True)
+        self.root = root
+        self.members = members
+        self.offsets = [0, *accumulate(member.size for member in members)]
+        self.budget = budget
+        self.workers = workers
+        self.archived = 0
+        self.stopped = False
+        self.condition = Condition()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *_):
+        self.stop()
+
+    def advance(self, line: bytes) -> None:
+        """Counts a member reported by the archiver.
+
+        Other output of the archiver, such as warnings, is ignored.
+        """
+        if not line.startswith(LISTING):
+            return
+
+        with self.condition:
+            self.archived += 1
+            self.condition.notify()
+
+    def stop(self) -> None:
+        """Stops prefetching."""
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+
+        self.join()
+
+    def ahead(self, index: int) -> bool:
+        """Checks whether the member may be prefetched within the budget."""
+        archived = min(self.archived, index)
+        return self.offsets[index + 1] - self.offsets[archived] <= self.budget
+
+    def run(self):
+        """Prefetches the files in archive order."""
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+
+        try:
+            for index, member in enumerate(self.members):
+                if member.type is not MemberType.FILE or not member.size:
+                    continue
+
+                with self.condition:
+                    self.condition.wait_for(
+                        lambda: self.stopped
+                        or index < self.archived
+                        or self.ahead(index)
+                    )
+
+                    if self.stopped:
+                        break
+
+                    if index < self.archived:
+                        continue  # The archiver has already read the file.
+
+                executor.submit(self.prefetch, member)
+        finally:
+            executor.shutdown(cancel_futures=True)
+
+    def prefetch(self, member: Member) -> None:
+        """Prefetches a member's file."""
+        try:
+            prefetch(self.root / member.path, member.size)
+        except OSError as error:
+            LOGGER.debug("Cannot prefetch %s: %s", member.path, error)
@@ -1,24 +1,28 @@
 """Resets a HIDSL installation."""
 
+from __future__ import annotations
 from argparse import ArgumentParser, Namespace
+from concurrent.futures import ThreadPoolExecutor
 from logging import DEBUG, INFO, basicConfig
 from pathlib import Path
-from subprocess import CalledProcessError
 from typing import Iterator
 
-from hidsltools.errorhandler import ErrorHandler
-from hidsltools.fstab import FSTAB
-from hidsltools.functions import chroot
-from hidsltools.hostid import HOST_ID, HOSTNAME, MACHINE_ID
-from hidsltools.initcpio import INITRAMFS
+from hidsltools.lazy import lazy_import
 from hidsltools.logging import FORMAT, LOGGER
-from hidsltools.openvpn import delete_client_config
-from hidsltools.pacman import CACHED_PKGS, LOCKFILE, clean
-from hidsltools.ssh import HOST_KEYS
-from hidsltools.syslinux import AUTOUPDATE
-from hidsltools.systemd import CORE_DUMPS, JOURNALS, vacuum, disable, enable
-from hidsltools.types import Glob
-from hidsltools.users import clean_homes
+
+# Loaded on first use to keep --help and argument errors fast.
+errorhandler = lazy_import("hidsltools.errorhandler")
+fstab = lazy_import("hidsltools.fstab")
+functions = lazy_import("hidsltools.functions")
+hostid = lazy_import("hidsltools.hostid")
+initcpio = lazy_import("hidsltools.initcpio")
+openvpn = lazy_import("hidsltools.openvpn")
+pacman = lazy_import("hidsltools.pacman")
+ssh = lazy_import("hidsltools.ssh")
+syslinux = lazy_import("hidsltools.syslinux")
+systemd = lazy_import("hidsltools.systemd")
+types = lazy_import("hidsltools.types")
+users = lazy_import("hidsltools.users")
 
 
 __all__ = ["main"]
@@ -33,8 +37,7 @@ SYSTEMD_UNITS_TO_DISABLE = {
 DESCRIPTION = "Resets operating system for image creation."
 WARNING = "unconfigured-warning.service"
 MOUNTPOINT = Path("/mnt")
-REMOVE_FILES = [AUTOUPDATE, FSTAB, HOST_ID, HOSTNAME, LOCKFILE, MACHINE_ID]
-REMOVE_GLOBS = [CACHED_PKGS, CORE_DUMPS, HOST_KEYS, INITRAMFS, JOURNALS]
+WORKERS = 4  # Per home directory.
 
 
 def get_args() -> Namespace:
@@ -60,18 +63,136 @@ def get_args() -> Namespace:
     parser.add_argument(
         "-e", "--ignore", action="store_true", help="dont delete home directory"
     )
+    parser.add_argument(
+        "-n",
+        "--dry-run",
+        action="store_true",
+        help="only report the planned actions and their sizes",
+    )
     return parser.parse_args()
 
 
 def get_files_to_be_removed(root: Path) -> Iterator[Path]:
     """Yields files to be removed."""
 
-    for file in REMOVE_FILES:
-        yield chroot(root, file)
+    for file in [
+        syslinux.AUTOUPDATE,
+        fstab.FSTAB,
+        hostid.HOST_ID,
+        hostid.HOSTNAME,
+        pacman.LOCKFILE,
+        hostid.MACHINE_ID,
+    ]:
+        yield functions.chroot(root, file)
+
+    for glob in [
+        pacman.CACHED_PKGS,
+        systemd.CORE_DUMPS,
+        ssh.HOST_KEYS,
+        initcpio.INITRAMFS,
+        systemd.JOURNALS,
+    ]:
+        yield from types.Glob(functions.chroot(root, glob.path), glob.glob)
+
+
+def file_size(file: Path) -> types.RemovalStats:
+    """Returns the removal statistics of a single file."""
+
+    return types.RemovalStats(files=1, bytes=file.lstat().st_blocks * 512)
+
+
+def remove_file(file: Path) -> types.RemovalStats:
+    """Removes a file if it exists and returns the removal statistics."""
 
-    for glob in REMOVE_GLOBS:
-        for file in Glob(chroot(root, glob.path), glob.glob):
-            yield file
+    try:
+        stats = file_size(file)
+        file.unlink()
+    except FileNotFoundError:
+        return types.RemovalStats()
+
+    return stats
+
+
+def plan(args: Namespace, *, sizes: bool = False) -> types.ResetPlan:
+    """Determines all actions of the reset.
+
+    Sizes are only determined if requested,
+    since this walks all trees to be removed.
+    """
+
+    files = tuple(
+        file
+        for file in get_files_to_be_removed(args.root)
+        if file.is_symlink() or file.is_file()
+    )
+    homes = () if args.ignore else tuple(users.get_homes(root=args.root))
+
+    usage = {}
+
+    if sizes:
+        usage["files"] = sum(map(file_size, files), types.RemovalStats())
+        usage["openvpn"] = functions.disk_usage(
+            functions.chroot(args.root, openvpn.CLIENTS_DIR)
+        )
+        usage["homes"] = sum(map(functions.disk_usage, homes), types.RemovalStats())
+
+    return types.ResetPlan(
+        frozenset(SYSTEMD_UNITS_TO_DISABLE), frozenset({WARNING}), files, homes, usage
+    )
+
+
+def report(reset_plan: types.ResetPlan) -> None:
+    """Logs the planned actions and their sizes."""
+
+    for unit in sorted(reset_plan.disable):
+        LOGGER.info("Would disable %s.", unit)
+
+    for unit in sorted(reset_plan.enable):
+        LOGGER.info("Would enable %s.", unit)
+
+    for file in reset_plan.files:
+        LOGGER.info("Would remove: %s", file)
+
+    for home in reset_plan.homes:
+        LOGGER.info("Would clean home: %s", home)
+
+    for group, stats in [*reset_plan.sizes.items(), ("total", reset_plan.total)]:
+        LOGGER.info(
+            "%s: %i files, %i directories, %i bytes",
+            group,
+            stats.files,
+            stats.directories,
+            stats.bytes,
+        )
+
+
+def clean_up(reset_plan: types.ResetPlan, args: Namespace) -> types.RemovalStats:
+    """Concurrently runs the clean-ups that work on separate subtrees.
+
+    Returns the statistics of the removed home directory contents.
+    """
+
+    with ThreadPoolExecutor() as executor:
+        LOGGER.info("Clearing journal.")
+        jobs = [executor.submit(systemd.vacuum, root=args.root, verbose=args.verbose)]
+        LOGGER.info("Cleaning up package cache.")
+        jobs.append(executor.submit(pacman.clean, root=args.root, verbose=args.verbose))
+        homes = []
+
+        if reset_plan.homes:
+            LOGGER.info("Cleaning up home folders.")
+
+            for home in reset_plan.homes:
+                homes.append(
+                    executor.submit(functions.rmsubtree, home, workers=WORKERS)
+                )
+        else:
+            LOGGER.info("Dont clean home directories.")
+
+    for future in jobs:
+        future.result()
+
+    return sum((future.result() for future in homes), types.RemovalStats())
 
 
 def reset(args: Namespace) -> int:
@@ -84,33 +205,26 @@ def reset(args: Namespace) -> int:
 
         LOGGER.warning("Specified root is not a mount point.")
 
-    for systemd_unit in SYSTEMD_UNITS_TO_DISABLE:
-        LOGGER.info("Disabling %s.", systemd_unit)
+    reset_plan = plan(args, sizes=args.dry_run)
 
-        try:
-            disable(systemd_unit, root=args.root, verbose=args.verbose)
-        except CalledProcessError as error:
-            if error.returncode != 1:  # Ignore non-existent units
-                raise
+    if args.dry_run:
+        report(reset_plan)
+        return 0
+
+    LOGGER.info("Disabling %s.", ", ".join(sorted(reset_plan.disable)))
+    systemd.disable_units(sorted(reset_plan.disable), root=args.root)
+    LOGGER.info("Enabling %s.", ", ".join(sorted(reset_plan.enable)))
+    systemd.enable_units(sorted(reset_plan.enable), root=args.root)
 
-    LOGGER.info("Enabling unconfigured-warning.service.")
-    enable(WARNING, root=args.root, verbose=args.verbose)
     LOGGER.info("Removing OpenVPN client configuration.")
-    delete_client_config(root=args.root)
+    freed = openvpn.delete_client_config(root=args.root)
 
-    for file in get_files_to_be_removed(args.root):
+    for file in reset_plan.files:
         LOGGER.info("Removing: %s", file)
-        file.unlink(missing_ok=True)
-
-    LOGGER.info("Clearing journal.")
-    vacuum(root=args.root, verbose=args.verbose)
-    LOGGER.info("Cleaning up package cache.")
-    clean(root=args.root, verbose=args.verbose)
-    if not args.ignore:
-        LOGGER.info("Cleaning up home folders.")
-        clean_homes(root=args.root)
-    else:
-        LOGGER.info("Dont clean home directories.")
+        freed += remove_file(file)
+
+    freed += clean_up(reset_plan, args)
+    LOGGER.info("Freed %i bytes.", freed.bytes)
     return 0
 
 
@@ -120,5 +234,5 @@ def main() -> int:
     args = get_args()
     basicConfig(format=FORMAT, level=DEBUG if args.debug else INFO)
 
-    with ErrorHandler(LOGGER):
+    with errorhandler.ErrorHandler(LOGGER):
         return reset(args)
@@ -1,41 +1,83 @@
 """Restores HIDSL images."""
 
+from __future__ import annotations
 from argparse import ArgumentParser, Namespace
+from contextlib import nullcontext
 from logging import DEBUG, INFO, basicConfig
 from pathlib import Path
+from shutil import disk_usage
 from tempfile import TemporaryDirectory
+from typing import Iterable
 
-from hidsltools.beep import beep
-from hidsltools.bsdtar import extract
-from hidsltools.checksums import validate_files
-from hidsltools.device import Device
-from hidsltools.defaults import DEVICE, IMAGE, SSH_KEYS
-from hidsltools.errorhandler import ErrorHandler
-from hidsltools.fstab import genfstab
-from hidsltools.hostid import mkhostid
-from hidsltools.initcpio import mkinitcpio
+from hidsltools.defaults import DEVICE, IMAGE, INITRAMFS_CACHE, JOURNALS, ROOT
+from hidsltools.defaults import SSH_KEYS
+from hidsltools.lazy import lazy_import
 from hidsltools.logging import FORMAT, LOGGER
-from hidsltools.mkfs import mkfs
-from hidsltools.mount import MountContext
-from hidsltools.os_release import write_os_release
-from hidsltools.sgdisk import mkparts
-from hidsltools.ssh import generate_host_keys, restore_authorized_keys
-from hidsltools.syslinux import install_update
-from hidsltools.wipefs import wipefs
+
+# Loaded on first use to keep --help and argument errors fast.
+beep = lazy_import("hidsltools.beep")
+bsdtar = lazy_import("hidsltools.bsdtar")
+checkpoint = lazy_import("hidsltools.checkpoint")
+checksums = lazy_import("hidsltools.checksums")
+decompress = lazy_import("hidsltools.decompress")
+device = lazy_import("hidsltools.device")
+download = lazy_import("hidsltools.download")
+errorhandler = lazy_import("hidsltools.errorhandler")
+fstab = lazy_import("hidsltools.fstab")
+functions = lazy_import("hidsltools.functions")
+hostid = lazy_import("hidsltools.hostid")
+initcpio = lazy_import("hidsltools.initcpio")
+manifest = lazy_import("hidsltools.manifest")
+mkfs = lazy_import("hidsltools.mkfs")
+mount = lazy_import("hidsltools.mount")
+os_release = lazy_import("hidsltools.os_release")
+sgdisk = lazy_import("hidsltools.sgdisk")
+sidecar = lazy_import("hidsltools.sidecar")
+spool = lazy_import("hidsltools.spool")
+ssh = lazy_import("hidsltools.ssh")
+syslinux = lazy_import("hidsltools.syslinux")
+unpack = lazy_import("hidsltools.unpack")
+wipefs = lazy_import("hidsltools.wipefs")
 
 
 __all__ = ["main"]
 
 
+SIZE_OVERHEAD = 1.1  # File system metadata and reserved blocks.
+
+
+def block_device(path: str) -> device.Device:
+    """Returns a block device."""
+
+    return device.Device(path)
+
+
+def image_source(source: str) -> Path | str:
+    """Returns the image file or the image URL."""
+
+    return source if download.is_url(source) else Path(source)
+
+
+def mkfs_profile(name: str) -> mkfs.MkfsProfile:
+    """Returns a file system creation profile."""
+
+    return mkfs.MkfsProfile(name)
+
+
 def get_args() -> Namespace:
     """Returns the CLI arguments."""
 
     parser = ArgumentParser(description="Restore operating system images.")
     parser.add_argument(
-        "device", nargs="?", type=Device, default=DEVICE, help="target device"
+        "device", nargs="?", type=block_device, default=DEVICE, help="target device"
     )
     parser.add_argument(
-        "-i", "--image", type=Path, metavar="file", default=IMAGE, help="image file"
+        "-i",
+        "--image",
+        type=image_source,
+        metavar="file|url",
+        default=IMAGE,
+        help="image file or HTTP(S) URL",
     )
     parser.add_argument(
         "-r", "--root", type=Path, metavar="mountpoint", help="target root directory"
@@ -46,6 +88,17 @@ def get_args() -> Namespace:
         action="store_true",
         help="wipe filesystems before partitioning",
     )
+    parser.add_argument(
+        "-D",
+        "--discard",
+        action="store_true",
+        help="discard all blocks of the device before partitioning",
+    )
+    parser.add_argument(
+        "--secure-discard",
+        action="store_true",
+        help="securely discard all blocks, implies --discard",
+    )
     parser.add_argument(
         "-m",
         "--mbr",
@@ -60,6 +113,96 @@ def get_args() -> Namespace:
         default=SSH_KEYS,
         help="restore SSH keys from this JSON file",
     )
+    parser.add_argument(
+        "-p",
+        "--preset",
+        action="append",
+        metavar="name",
+        dest="presets",
+        help="build only this mkinitcpio preset (default: all)",
+    )
+    parser.add_argument(
+        "--defer-preset",
+        action="append",
+        metavar="name",
+        dest="deferred_presets",
+        help="build this mkinitcpio preset on first boot",
+    )
+    parser.add_argument(
+        "--initramfs-cache",
+        type=Path,
+        metavar="dir",
+        default=INITRAMFS_CACHE,
+        help="initramfs cache directory",
+    )
+    parser.add_argument(
+        "--no-initramfs-cache",
+        action="store_const",
+        const=None,
+        dest="initramfs_cache",
+        help="do not use the initramfs cache",
+    )
+    parser.add_argument(
+        "--rebuild-initramfs",
+        action="store_true",
+        help="re-generate the initramfs even if it is cached",
+    )
+    parser.add_argument(
+        "-P",
+        "--mkfs-profile",
+        type=mkfs_profile,
+        metavar="default|image|lazy",
+        default="default",
+        help="tune file systems for the image and device",
+    )
+    parser.add_argument(
+        "--no-sparse",
+        action="store_false",
+        dest="sparse",
+        help="write holes and blocks of zeros to the target",
+    )
+    parser.add_argument(
+        "-N",
+        "--native",
+        action="store_true",
+        help="extract in-process with parallel writers instead of bsdtar",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        metavar="n",
+        help="amount of parallel workers of --native and --verify",
+    )
+    parser.add_argument(
+        "-V",
+        "--verify",
+        action="store_true",
+        help="verify the restored files against the image manifest",
+    )
+    parser.add_argument(
+        "--spool",
+        type=int,
+        metavar="MiB",
+        default=0,
+        dest="spool_size",
+        help="decompress the image into a RAM spool of this size while formatting",
+    )
+    parser.add_argument(
+        "-R",
+        "--resume",
+        action="store_true",
+        help="skip the phases completed by a previous, failed restore",
+    )
+    parser.add_argument(
+        "--journal",
+        type=Path,
+        metavar="file",
+        help=(
+            "checkpoint journal of completed phases, "
+            f"by default one per target in {JOURNALS}"
+        ),
+    )
     parser.add_argument(
         "-q", "--quiet", action="store_true", help="do not beep after completion"
     )
@@ -69,81 +212,402 @@ def get_args() -> Namespace:
     parser.add_argument(
         "-d", "--debug", action="store_true", help="enable verbose logging"
     )
-    return parser.parse_args()
+    args = parser.parse_args()
+    args.discard = args.discard or args.secure_discard
+    return args
 
 
-def restore_image(args: Namespace, mountpoint: Path | None = None) -> None:
-    """Restores an image."""
+def preflight(args: Namespace) -> sidecar.ImageMetadata | None:
+    """Checks the image's sidecar metadata against the target."""
 
-    if mountpoint is None:
-        mountpoint = args.root
+    if isinstance(args.image, str):
+        metadata = download.fetch_sidecar(args.image)
+    else:
+        metadata = sidecar.read_sidecar(args.image)
+
+    if metadata is None:
+        LOGGER.warning("No image metadata found. Skipping preflight checks.")
+        return None
+
+    LOGGER.info(
+        "Image contains %i files with %i bytes (%s, kernel %s).",
+        metadata.files,
+        metadata.size,
+        metadata.compression.full_name,
+        ", ".join(metadata.kernels),
+    )
+
+    if not bsdtar.supports(metadata.compression):
+        LOGGER.critical("Compression not supported: %s", metadata.compression.full_name)
+        raise SystemExit(1)
+
+    if args.root:
+        available = disk_usage(args.root).free
+    else:
+        try:
+            available = args.device.info.size - (0 if args.mbr else sgdisk.EFI_SIZE)
+        except KeyError:
+            LOGGER.warning("Cannot determine capacity of %s.", args.device)
+            return metadata
+
+    if (required := int(metadata.size * SIZE_OVERHEAD)) > available:
+        LOGGER.critical(
+            "Not enough space: %i bytes required, %i bytes available.",
+            required,
+            available,
+        )
+        raise SystemExit(1)
+
+    return metadata
+
+
+def extract(
+    args: Namespace, image: Path | int, mountpoint: Path, *, decompressed: bool = False
+) -> None:
+    """Extracts the image file or the image read from an fd."""
+
+    total = None if args.metadata is None else args.metadata.files
+
+    if args.native:
+        unpack.unpack(
+            image,
+            mountpoint,
+            compression=(
+                None
+                if decompressed or args.metadata is None
+                else args.metadata.compression
+            ),
+            workers=args.jobs,
+            total=total,
+            sparse=args.sparse,
+        )
+    else:
+        bsdtar.extract(
+            image,
+            mountpoint,
+            total=total,
+            sparse=args.sparse,
+            verbose=args.verbose,
+        )
+
+
+def rewritten() -> list[str]:
+    """Returns glob patterns of the files that the restore rewrites."""
+
+    files = [
+        hostid.HOST_ID,
+        hostid.HOSTNAME,
+        hostid.MACHINE_ID,
+        fstab.FSTAB,
+        os_release.OS_RELEASE,
+        syslinux.AUTOUPDATE,
+        initcpio.DEFERRED_UNIT,
+        initcpio.INITRAMFS.path / initcpio.INITRAMFS.glob,
+        Path(ssh.KEY_TEMPLATE.format(cipher="*") + "*"),
+    ]
+    return [
+        *(str(file.relative_to(ROOT)) for file in files),
+        f"etc/systemd/system/*.wants/{initcpio.DEFERRED_UNIT.name}",
+        "*/.ssh",
+        "*/.ssh/authorized_keys",
+    ]
+
+
+def verify(args: Namespace, mountpoint: Path) -> None:
+    """Verifies the restored files against the image manifest."""
+
+    if (entries := manifest.read_manifest(args.image)) is None:
+        LOGGER.warning("No image manifest found. Skipping verification.")
+        return
+
+    divergences = manifest.verify(
+        mountpoint, entries, workers=args.jobs, skip=rewritten()
+    )
+
+    for divergence in divergences:
+        LOGGER.error("%s", divergence)
+
+    if divergences:
+        LOGGER.critical("%i files diverge from the image.", len(divergences))
+        raise SystemExit(1)
+
+    LOGGER.info("All %i files match the image.", len(entries))
+
+
+def open_journal(args: Namespace) -> checkpoint.Journal:
+    """Returns the checkpoint journal, resumed if requested and valid."""
+
+    target = args.root or args.device
+    current = checkpoint.Checkpoint(
+        str(target),
+        str(args.image),
+        None if args.metadata is None else args.metadata.sha256,
+    )
+    args.journal = args.journal or checkpoint.journal_file(target)
+    journal = checkpoint.Journal(args.journal, current)
+
+    if not args.resume:
+        journal.update()
+        return journal
+
+    if (previous := checkpoint.read_journal(args.journal)) is None:
+        LOGGER.warning("No checkpoint journal found. Starting over.")
+    elif (previous.target, previous.image, previous.sha256) != (
+        current.target,
+        current.image,
+        current.sha256,
+    ):
+        LOGGER.warning("Checkpoint journal is of another restore. Starting over.")
+    else:
+        LOGGER.info(
+            "Resuming after phases: %s",
+            ", ".join(phase.value for phase in previous.phases) or "none",
+        )
+        journal.checkpoint = previous
+
+    journal.update()
+    return journal
+
+
+def extract_image(
+    args: Namespace, journal: checkpoint.Journal, mountpoint: Path
+) -> None:
+    """Extracts the image, removing a partially extracted tree first."""
+
+    if journal.interrupted(checkpoint.Phase.EXTRACT):
+        LOGGER.warning("Removing partially extracted tree.")
+        functions.rmsubtree(mountpoint, workers=args.jobs or 1)
 
     LOGGER.info("Extracting image archive.")
-    extract(args.image, mountpoint, verbose=args.verbose)
+
+    if args.spool is not None:
+        with args.spool.stream() as fd:
+            extract(args, fd, mountpoint, decompressed=True)
+    elif isinstance(args.image, str):
+        checksum = None if args.metadata is None else args.metadata.sha256
+
+        with download.stream(args.image, checksum=checksum) as fd:
+            extract(args, fd, mountpoint)
+    else:
+        extract(args, args.image, mountpoint)
+
+    if args.sparse and args.metadata is not None and args.metadata.holes:
+        LOGGER.info("Skipped writing %i bytes in holes.", args.metadata.holes)
+
+
+def configure(
+    args: Namespace,
+    mountpoint: Path,
+    partitions: Iterable[mount.Partition] | None = None,
+) -> None:
+    """Configures the restored system."""
+
     LOGGER.info("Creating a unique host ID.")
-    mkhostid(root=mountpoint)
+    hostid.mkhostid(root=mountpoint)
     LOGGER.info("Generating SSH host keys.")
-    generate_host_keys(root=mountpoint, verbose=args.verbose)
+    ssh.generate_host_keys(root=mountpoint, verbose=args.verbose)
     LOGGER.info("Restoring SSH keys.")
-    restore_authorized_keys(args.ssh_keys, root=mountpoint)
+    ssh.restore_authorized_keys(args.ssh_keys, root=mountpoint)
     LOGGER.info("Generating fstab.")
-    genfstab(root=mountpoint, verbose=args.verbose)
+
+    if partitions is None:
+        fstab.genfstab(root=mountpoint, verbose=args.verbose)
+    else:
+        fstab.write_fstab(partitions, root=mountpoint)
 
     if args.mbr:
         LOGGER.info("Installing syslinux.")
-        install_update(chroot=mountpoint, verbose=args.verbose)
+        syslinux.install_update(chroot=mountpoint, verbose=args.verbose)
+
+
+def mkinitcpio(args: Namespace, mountpoint: Path) -> None:
+    """Generates the initramfs."""
 
     LOGGER.info("Generating initramfs.")
-    mkinitcpio(chroot=mountpoint, verbose=args.verbose)
+    initcpio.mkinitcpio(
+        chroot=mountpoint,
+        presets=args.presets,
+        deferred=args.deferred_presets,
+        cache=args.initramfs_cache,
+        force=args.rebuild_initramfs,
+        verbose=args.verbose,
+    )
+
+
+def finalize(mountpoint: Path) -> None:
+    """Stores the image installation data."""
+
     LOGGER.info("Storing image installation data.")
-    write_os_release(mountpoint)
+    os_release.write_os_release(mountpoint)
 
 
-def restore(args: Namespace) -> None:
-    """Restores the HIDSL image."""
+def restore_image(
+    args: Namespace,
+    journal: checkpoint.Journal,
+    mountpoint: Path | None = None,
+    partitions: Iterable[mount.Partition] | None = None,
+) -> None:
+    """Restores an image."""
 
-    if args.root:
-        restore_image(args)
-        return
+    if mountpoint is None:
+        mountpoint = args.root
 
-    if not args.device.is_block_device():
-        LOGGER.critical("%s is not a block device.", args.device)
+    journal.run(checkpoint.Phase.EXTRACT, extract_image, args, journal, mountpoint)
+    journal.run(checkpoint.Phase.CONFIGURE, configure, args, mountpoint, partitions)
+    journal.run(checkpoint.Phase.INITRAMFS, mkinitcpio, args, mountpoint)
+    journal.run(checkpoint.Phase.FINALIZE, finalize, mountpoint)
 
-    LOGGER.info("Validating file checksums.")
-    validate_files()
+    if args.verify:
+        LOGGER.info("Verifying restored files.")
+        journal.run(checkpoint.Phase.VERIFY, verify, args, mountpoint)
+
+
+def partition(args: Namespace) -> None:
+    """Wipes and partitions the device."""
+
+    if args.discard:
+        LOGGER.info("Discarding blocks: %s", args.device)
+
+        try:
+            wipefs.wipe(args.device, secure=args.secure_discard)
+        except OSError as error:
+            LOGGER.error("Could not discard %s: %s", args.device, error)
+            LOGGER.warning("Falling back to wiping file systems.")
+            wipefs.wipefs(args.device, verbose=args.verbose)
 
     if args.wipefs:
         LOGGER.info("Wiping file systems: %s", args.device)
-        wipefs(args.device, verbose=args.verbose)
+        wipefs.wipefs(args.device, verbose=args.verbose)
 
     LOGGER.info("Partitioning disk: %s", args.device)
-    partitions = []
 
-    for partition in mkparts(args.device, efi=not args.mbr, verbose=args.verbose):
-        partitions.append(partition)
-        LOGGER.debug("Created partition: %s", partition)
+    for part in sgdisk.mkparts(args.device, efi=not args.mbr, verbose=args.verbose):
+        LOGGER.debug("Created partition: %s", part)
+
+
+def format_partitions(
+    args: Namespace, partitions: Iterable[mount.Partition]
+) -> None:
+    """Creates the file systems on the partitions."""
 
     LOGGER.info("Creating file systems.")
 
-    for partition in partitions:
+    try:
+        info = args.device.info
+    except KeyError:
+        info = None
+
+    for part in partitions:
         LOGGER.info(
             "Formatting %s with %s as %s.",
-            partition.device,
-            partition.filesystem,
-            partition.label,
+            part.device,
+            part.filesystem,
+            part.label,
         )
-        mkfs(
-            partition.device,
-            partition.filesystem,
-            label=partition.label,
+        options = {}
+
+        if part.filesystem is mkfs.Filesystem.EXT4:
+            options["options"] = mkfs.tune_ext4(
+                mkfs.get_size(part.device),
+                profile=args.mkfs_profile,
+                metadata=args.metadata,
+                info=info,
+                discarded=args.discard,
+            )
+            LOGGER.debug("Tuning: %s", options["options"])
+
+        mkfs.mkfs(
+            part.device,
+            part.filesystem,
+            label=part.label,
             verbose=args.verbose,
+            **options,
         )
 
+
+def spool_image(
+    args: Namespace, journal: checkpoint.Journal
+) -> spool.Spool | nullcontext:
+    """Returns a spool decompressing the image during partitioning, if enabled."""
+
+    if (
+        not args.spool_size
+        or isinstance(args.image, str)
+        or checkpoint.Phase.EXTRACT in journal
+    ):
+        return nullcontext()
+
+    if args.metadata is not None:
+        compression = args.metadata.compression
+    else:
+        with args.image.open("rb") as file:
+            head = file.read(decompress.HEAD_SIZE)
+
+        try:
+            compression = decompress.detect(head)
+        except ValueError:
+            LOGGER.warning("Unknown format of %s. Not spooling.", args.image)
+            return nullcontext()
+
+        if compression is None:
+            LOGGER.debug("Image %s is not compressed. Not spooling.", args.image)
+            return nullcontext()
+
+    LOGGER.info("Decompressing image into a %i MiB spool.", args.spool_size)
+    return spool.Spool(args.image, compression, args.spool_size * 1024 * 1024)
+
+
+def restore_device(args: Namespace, journal: checkpoint.Journal) -> None:
+    """Restores the image onto the device."""
+
+    if not args.device.is_block_device():
+        LOGGER.critical("%s is not a block device.", args.device)
+
+    LOGGER.info("Validating file checksums.")
+    checksums.validate_files()
+    partitions = list(sgdisk.layout(args.device, efi=not args.mbr))
+
+    if checkpoint.Phase.PARTITION in journal and not all(
+        part.device.is_block_device() for part in partitions
+    ):
+        LOGGER.warning("Partitions are missing. Partitioning again.")
+        journal.rewind(checkpoint.Phase.PARTITION)
+
+    journal.run(checkpoint.Phase.PARTITION, partition, args)
+
+    if checkpoint.Phase.FORMAT in journal:
+        if checkpoint.uuids(partitions) != journal.checkpoint.partitions:
+            LOGGER.warning("File systems have changed. Formatting again.")
+            journal.rewind(checkpoint.Phase.FORMAT)
+        elif journal.interrupted(checkpoint.Phase.EXTRACT):
+            LOGGER.warning("Image was partially extracted. Formatting again.")
+            journal.rewind(checkpoint.Phase.FORMAT)
+
+    if checkpoint.Phase.FORMAT not in journal:
+        journal.run(checkpoint.Phase.FORMAT, format_partitions, args, partitions)
+        journal.update(partitions=checkpoint.uuids(partitions))
+
     LOGGER.info("Mounting partitions.")
 
     with TemporaryDirectory() as tmpd:
-        with MountContext(partitions, root=tmpd) as mountpoint:
-            restore_image(args, mountpoint=mountpoint)
+        with mount.MountContext(partitions, root=tmpd) as mountpoint:
+            restore_image(args, journal, mountpoint=mountpoint, partitions=partitions)
+
+
+def restore(args: Namespace) -> None:
+    """Restores the HIDSL image."""
+
+    args.metadata = preflight(args)
+    journal = open_journal(args)
+
+    if args.root:
+        args.spool = None
+        restore_image(args, journal)
+    else:
+        with spool_image(args, journal) as args.spool:
+            restore_device(args, journal)
+
+    journal.remove()
 
 
 def main() -> None:
@@ -152,8 +616,8 @@ def main() -> None:
     args = get_args()
     basicConfig(format=FORMAT, level=DEBUG if args.debug else INFO)
 
-    with ErrorHandler(LOGGER):
+    with errorhandler.ErrorHandler(LOGGER):
         restore(args)
 
         if not args.quiet:
-            beep()
+            beep.beep()
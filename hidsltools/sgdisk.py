@@ -8,16 +8,17 @@ from hidsltools.functions import exe
 from hidsltools.types import Filesystem, Partition
 
 
-__all__ = ["mkparts"]
+__all__ = ["EFI_SIZE", "layout", "mkparts"]
 
 
+EFI_SIZE = 500 * 1024 * 1024
 SGDISK = "/usr/bin/sgdisk"
 
 
-def mkefipart(device: Device, *, size: str = "500M", verbose: bool = False) -> None:
+def mkefipart(device: Device, *, size: int = EFI_SIZE, verbose: bool = False) -> None:
     """Creates an EFI partition."""
 
-    exe([SGDISK, "-n", f"1::+{size}", str(device)], verbose=verbose)
+    exe([SGDISK, "-n", f"1::+{size // 1024}K", str(device)], verbose=verbose)
     exe([SGDISK, "-t", "1:ef00", str(device)], verbose=verbose)
 
 
@@ -28,6 +29,18 @@ def mkroot(device: Device, *, partno: int = 1, verbose: bool = False) -> None:
     exe([SGDISK, "-t", f"{partno}:8304", str(device)], verbose=verbose)
 
 
+def layout(device: Device, *, efi: bool = True) -> Iterator[Partition]:
+    """Yields the partitions that mkparts() creates."""
+
+    root_partition_number = 2 if efi else 1
+
+    if efi:
+        yield Partition(device.partition(1), BOOT, Filesystem.VFAT, "EFI")
+
+    partition = device.partition(root_partition_number)
+    yield Partition(partition, ROOT, Filesystem.EXT4, "root")
+
+
 def mkparts(
     device: Device, *, efi: bool = True, verbose: bool = False
 ) -> Iterator[Partition]:
@@ -39,9 +52,7 @@ def mkparts(
     if efi:
         root_partition_number = 2
         mkefipart(device, verbose=verbose)
-        partition = device.partition(1)
-        yield Partition(partition, BOOT, Filesystem.VFAT, "EFI")
 
     mkroot(device, partno=root_partition_number, verbose=verbose)
-    partition = device.partition(root_partition_number)
-    yield Partition(partition, ROOT, Filesystem.EXT4, "root")
+    device.wait_for_partitions(range(1, root_partition_number + 1))
+    yield from layout(device, efi=efi)
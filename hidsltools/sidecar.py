@@ -0,0 +1,82 @@
+"""Image sidecar metadata."""
+
+from datetime import datetime
+from json import dump, load
+from pathlib import Path
+from typing import Iterable
+
+from hidsltools.functions import chroot
+from hidsltools.logging import LOGGER
+from hidsltools.types import Compression, ImageMetadata, Member
+
+
+__all__ = ["collect", "read_sidecar", "sidecar", "write_sidecar"]
+
+
+MODULES = Path("/usr/lib/modules")
+SUFFIX = ".json"
+
+
+def sidecar(image: Path) -> Path:
+    """Returns the path of the image's sidecar file."""
+
+    return image.with_name(image.name + SUFFIX)
+
+
+def kernels(root: Path) -> tuple[str, ...]:
+    """Returns the kernel versions installed below root."""
+
+    modules = chroot(root, MODULES)
+
+    if not modules.is_dir():
+        return ()
+
+    return tuple(sorted(path.parent.name for path in modules.glob("*/vmlinuz")))
+
+
+def collect(
+    root: Path,
+    compression: Compression,
+    members: Iterable[Member],
+    sha256: str | None = None,
+) -> ImageMetadata:
+    """Collects metadata of an image created from the given root.
+
+    Files, sizes and holes are counted from the archived members,
+    so that the root is not walked again.
+    """
+
+    files = size = sparse = 0
+
+    for member in members:
+        files += 1
+        size += member.size
+        sparse += member.holes
+
+    return ImageMetadata(
+        compression,
+        size,
+        files,
+        datetime.now(),
+        kernels(root),
+        sha256,
+        sparse,
+    )
+
+
+def write_sidecar(image: Path, metadata: ImageMetadata) -> None:
+    """Writes the sidecar file of the image."""
+
+    with sidecar(image).open("w", encoding="utf-8") as file:
+        dump(metadata.to_json(), file, indent=2)
+
+
+def read_sidecar(image: Path) -> ImageMetadata | None:
+    """Reads the sidecar file of the image if it exists."""
+
+    try:
+        with sidecar(image).open("r", encoding="utf-8") as file:
+            return ImageMetadata.from_json(load(file))
+    except FileNotFoundError:
+        LOGGER.debug("No sidecar file for image %s.", image)
+        return None
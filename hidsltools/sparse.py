@@ -0,0 +1,51 @@
+"""Sparse file detection."""
+
+from errno import EINVAL, ENXIO
+from os import O_NOFOLLOW, O_RDONLY, SEEK_DATA, SEEK_HOLE, close, lseek
+from os import open as os_open, stat_result
+from pathlib import Path
+
+
+__all__ = ["holes", "is_sparse"]
+
+
+BLOCK_SIZE = 512  # Unit of st_blocks.
+
+
+def is_sparse(stat: stat_result) -> bool:
+    """Checks whether the file occupies less space than its size."""
+
+    return stat.st_blocks * BLOCK_SIZE < stat.st_size
+
+
+def holes(file: Path | str, stat: stat_result) -> int:
+    """Returns the amount of bytes in holes of the file.
+
+    Only files that occupy less space than their size are inspected.
+    """
+
+    if not is_sparse(stat):
+        return 0
+
+    fd = os_open(file, O_RDONLY | O_NOFOLLOW)
+    data = offset = 0
+
+    try:
+        while offset < stat.st_size:
+            try:
+                start = lseek(fd, offset, SEEK_DATA)
+            except OSError as error:
+                if error.errno == ENXIO:  # No data beyond offset.
+                    break
+
+                if error.errno == EINVAL:  # File system lacks SEEK_DATA.
+                    return 0
+
+                raise
+
+            offset = lseek(fd, start, SEEK_HOLE)
+            data += offset - start
+    finally:
+        close(fd)
+
+    return stat.st_size - data
@@ -0,0 +1,107 @@
+"""Bounded spooling of decompressed images."""
+
+from __future__ import annotations
+from contextlib import contextmanager
+from os import close, pipe
+from pathlib import Path
+from queue import Queue
+from subprocess import PIPE, CalledProcessError, Popen
+from threading import Thread
+from typing import Iterator
+
+from hidsltools.decompress import decompressor
+from hidsltools.logging import LOGGER
+from hidsltools.types import Compression
+
+
+__all__ = ["Spool"]
+
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class Spool(Thread):
+    """Decompresses an image into a bounded in-memory buffer.
+
+    Once the buffer is full, the decompressor blocks until
+    the buffered chunks have been read from stream().
+    """
+
+    def __init__(self, image: Path, compression: Compression, size: int):
+        """Sets the image, its compression and the buffer size in bytes."""
+        super().__init__(name="spool", daemon=True)
+        self.command = decompressor(compression, image)
+        self.chunks = Queue(maxsize=max(1, size // CHUNK_SIZE))
+        self.process = None
+        self.error = None
+        self.cancelled = False
+        self.spooled = 0
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *_):
+        self.cancel()
+
+    def run(self):
+        """Reads the decompressor's output into the buffer."""
+        try:
+            with Popen(self.command, stdout=PIPE) as self.process:
+                if self.cancelled:
+                    self.process.kill()  # cancel() ran before Popen returned.
+
+                while chunk := self.process.stdout.read(CHUNK_SIZE):
+                    self.chunks.put(chunk)
+                    self.spooled += len(chunk)
+
+            if self.process.returncode != 0 and not self.cancelled:
+                raise CalledProcessError(self.process.returncode, self.command)
+        except Exception as error:
+            self.error = error
+        finally:
+            self.chunks.put(None)
+
+    def cancel(self) -> None:
+        """Stops the decompression and discards the buffer."""
+        if not self.is_alive():
+            return
+
+        self.cancelled = True
+
+        if self.process is not None:
+            self.process.kill()
+
+        while self.chunks.get() is not None:
+            pass
+
+        self.join()
+
+    def write(self, fd: int) -> None:
+        """Writes the buffered chunks into the fd and closes it."""
+        try:
+            with open(fd, "wb") as file:
+                while (chunk := self.chunks.get()) is not None:
+                    file.write(chunk)
+        except BrokenPipeError:
+            LOGGER.debug("Extraction stopped reading the spool.")
+            self.cancel()
+
+    @contextmanager
+    def stream(self) -> Iterator[int]:
+        """Yields an fd from which the decompressed image can be read."""
+        LOGGER.debug("Spooled %i bytes before extraction.", self.spooled)
+        read_fd, write_fd = pipe()
+        writer = Thread(target=self.write, args=(write_fd,), daemon=True)
+        writer.start()
+
+        try:
+            yield read_fd
+        finally:
+            close(read_fd)
+            writer.join()
+
+        self.join()
+
+        if self.error is not None:
+            raise self.error
@@ -0,0 +1,62 @@
+"""Minimal file system superblock reader."""
+
+from pathlib import Path
+from typing import NamedTuple
+from uuid import UUID
+
+from hidsltools.types import Filesystem
+
+
+__all__ = ["Superblock", "read_superblock"]
+
+
+EXT4_SUPERBLOCK = 1024
+EXT4_MAGIC = b"\x53\xef"
+VFAT_MAGIC = b"FAT32   "
+
+
+class Superblock(NamedTuple):
+    """Identifiers stored in a file system superblock."""
+
+    label: str | None
+    uuid: str | None
+
+
+def read_ext4(data: bytes) -> Superblock:
+    """Reads label and UUID from an ext4 superblock."""
+
+    superblock = data[EXT4_SUPERBLOCK : EXT4_SUPERBLOCK + 1024]
+
+    if superblock[0x38:0x3A] != EXT4_MAGIC:
+        raise ValueError("Not an ext4 file system.")
+
+    label = superblock[0x78:0x88].split(b"\0", maxsplit=1)[0].decode()
+    uuid = str(UUID(bytes=superblock[0x68:0x78]))
+    return Superblock(label or None, uuid)
+
+
+def read_vfat(data: bytes) -> Superblock:
+    """Reads label and volume ID from a FAT32 boot sector."""
+
+    if data[0x52:0x5A] != VFAT_MAGIC:
+        raise ValueError("Not a FAT32 file system.")
+
+    label = data[0x47:0x52].decode("ascii").rstrip()
+    volume_id = int.from_bytes(data[0x43:0x47], "little")
+    uuid = f"{volume_id >> 16:04X}-{volume_id & 0xFFFF:04X}"
+    return Superblock(None if label == "NO NAME" else label, uuid)
+
+
+def read_superblock(device: Path, filesystem: Filesystem) -> Superblock:
+    """Reads the superblock of the given device."""
+
+    with device.open("rb") as file:
+        data = file.read(EXT4_SUPERBLOCK * 2)
+
+    if filesystem == Filesystem.EXT4:
+        return read_ext4(data)
+
+    if filesystem == Filesystem.VFAT:
+        return read_vfat(data)
+
+    raise NotImplementedError("File system not implemented:", filesystem)
@@ -1,17 +1,24 @@
 """Systemd invocation."""
 
+from os import readlink
 from pathlib import Path
+from typing import Iterable, Iterator
 
-from hidsltools.functions import exe
-from hidsltools.types import Glob
+from hidsltools.defaults import ROOT
+from hidsltools.functions import chroot, exe
+from hidsltools.logging import LOGGER
+from hidsltools.types import Glob, InstallSection
 
 
 __all__ = [
     "CORE_DUMPS",
     "JOURNALS",
     "disable",
+    "disable_units",
     "enable",
+    "enable_units",
     "journalctl",
+    "parse_install",
     "systemctl",
     "vacuum",
     "vacuum_size",
@@ -20,9 +27,28 @@ __all__ = [
 
 
 CORE_DUMPS = Glob("/var/lib/systemd/coredump", "*")
+DEPENDENCY_DIRS = {
+    "wanted_by": "wants",
+    "required_by": "requires",
+    "upheld_by": "upholds",
+}
+INSTALL_KEYS = {
+    "WantedBy": "wanted_by",
+    "RequiredBy": "required_by",
+    "UpheldBy": "upheld_by",
+    "Alias": "alias",
+    "Also": "also",
+}
 JOURNALCTL = "/usr/bin/journalctl"
 JOURNALS = Glob("/var/log/journal", "*")
 SYSTEMCTL = "/usr/bin/systemctl"
+SYSTEM_CONFIG = Path("/etc/systemd/system")
+UNIT_PATHS = [
+    SYSTEM_CONFIG,
+    Path("/run/systemd/system"),
+    Path("/usr/local/lib/systemd/system"),
+    Path("/usr/lib/systemd/system"),
+]
 
 
 def systemctl(*args: str, root: Path | None = None, verbose: bool = False) -> None:
@@ -48,6 +74,156 @@ def enable(unit: str, *, root: Path | None = None, verbose: bool = False) -> Non
     systemctl("enable", unit, root=root, verbose=verbose)
 
 
+def parse_install(unit_file: Path) -> InstallSection:
+    """Parses the [Install] section of a unit file."""
+
+    values = {key: [] for key in INSTALL_KEYS.values()}
+    default_instance = None
+    section = None
+
+    with unit_file.open("r", encoding="utf-8") as file:
+        for line in file:
+            if not (line := line.strip()) or line.startswith(("#", ";")):
+                continue
+
+            if line.startswith("[") and line.endswith("]"):
+                section = line[1:-1]
+                continue
+
+            if section != "Install" or "=" not in line:
+                continue
+
+            key, value = map(str.strip, line.split("=", maxsplit=1))
+
+            if key == "DefaultInstance":
+                default_instance = value or None
+            elif (field := INSTALL_KEYS.get(key)) is not None:
+                if value:
+                    values[field].extend(value.split())
+                else:
+                    values[field].clear()
+
+    return InstallSection(
+        **{key: tuple(value) for key, value in values.items()},
+        default_instance=default_instance,
+    )
+
+
+def template(unit: str) -> str:
+    """Returns the template name of an instance unit or the unit itself."""
+
+    if "@" not in unit:
+        return unit
+
+    prefix, suffix = unit.split("@", maxsplit=1)
+    return f"{prefix}@.{suffix.rsplit('.', maxsplit=1)[-1]}"
+
+
+def find_unit(unit: str, *, root: Path = ROOT) -> Path | None:
+    """Returns the unit file path relative to root or None if not found."""
+
+    for directory in UNIT_PATHS:
+        for name in (unit, template(unit)):
+            if chroot(root, path := directory / name).is_file():
+                return path
+
+    return None
+
+
+def resolve_units(
+    units: Iterable[str], *, root: Path = ROOT
+) -> Iterator[tuple[str, Path, InstallSection]]:
+    """Yields (unit, unit file, install section) including Also= units."""
+
+    pending = list(units)
+    seen = set()
+
+    while pending:
+        if (unit := pending.pop(0)) in seen:
+            continue
+
+        seen.add(unit)
+
+        if (unit_file := find_unit(unit, root=root)) is None:
+            LOGGER.warning("No such unit: %s", unit)
+            continue
+
+        install = parse_install(chroot(root, unit_file))
+        pending.extend(install.also)
+        yield unit, unit_file, install
+
+
+def get_links(unit: str, install: InstallSection) -> Iterator[Path]:
+    """Yields the symlinks that enabling the unit creates."""
+
+    if "@." in unit:
+        if install.default_instance is None:
+            return
+
+        unit = unit.replace("@.", f"@{install.default_instance}.")
+
+    for field, suffix in DEPENDENCY_DIRS.items():
+        for target in getattr(install, field):
+            yield SYSTEM_CONFIG / f"{target}.{suffix}" / unit
+
+    for alias in install.alias:
+        yield SYSTEM_CONFIG / alias
+
+
+def enable_units(units: Iterable[str], *, root: Path = ROOT) -> None:
+    """Enables units in an offline root without running systemctl.
+
+    This creates the symlinks for WantedBy=, RequiredBy=, UpheldBy= and
+    Alias= of the units and the units named in their Also= settings.
+    """
+
+    for unit, unit_file, install in resolve_units(units, root=root):
+        LOGGER.debug("Enabling %s.", unit)
+
+        for link in get_links(unit, install):
+            link = chroot(root, link)
+            link.parent.mkdir(mode=0o755, parents=True, exist_ok=True)
+
+            if link.is_symlink():
+                if readlink(link) == str(unit_file):
+                    continue
+
+                link.unlink()
+
+            link.symlink_to(unit_file)
+
+
+def disable_units(units: Iterable[str], *, root: Path = ROOT) -> None:
+    """Disables units in an offline root without running systemctl.
+
+    This removes all symlinks below /etc/systemd/system that are named after
+    the units or their aliases, or point to their unit files.
+    Units that do not exist are skipped.
+    """
+
+    names = set()
+    unit_files = set()
+
+    for unit, unit_file, install in resolve_units(units, root=root):
+        LOGGER.debug("Disabling %s.", unit)
+        names.add(unit)
+        names.update(install.alias)
+        unit_files.add(str(unit_file))
+
+    config = chroot(root, SYSTEM_CONFIG)
+
+    if not names or not config.is_dir():
+        return
+
+    for link in [*config.iterdir(), *config.glob("*.*/*")]:
+        if not link.is_symlink() or readlink(link) == "/dev/null":
+            continue  # Masked units stay masked.
+
+        if link.name in names or readlink(link) in unit_files:
+            LOGGER.debug("Removing %s.", link)
+            link.unlink()
+
+
 def journalctl(*args: str, root: Path | None = None, verbose: bool = False) -> None:
     """Runs journalctl."""
 
@@ -1,26 +1,99 @@
 """Common data types."""
 
 from __future__ import annotations
+from datetime import datetime
 from enum import Enum
 from pathlib import Path
 from re import fullmatch
+from shlex import split
 from tempfile import TemporaryDirectory
 from typing import Iterator, NamedTuple, Protocol
 
 
 __all__ = [
+    "BlockDeviceInfo",
+    "Checkpoint",
     "Compression",
     "DeviceType",
+    "Ext4Options",
     "Filesystem",
     "Glob",
+    "GroupEntry",
     "Hash",
+    "ImageMetadata",
+    "InstallSection",
+    "ManifestEntry",
+    "Member",
+    "MemberType",
+    "MkfsProfile",
     "Note",
     "Partition",
     "PasswdEntry",
+    "Phase",
+    "Preset",
+    "RemovalStats",
+    "ResetPlan",
     "SafeTemporaryDirectory",
+    "Timing",
 ]
 
 
+class BlockDeviceInfo(NamedTuple):
+    """Information about a block device from sysfs."""
+
+    name: str
+    size: int
+    rotational: bool
+    logical_block_size: int
+    physical_block_size: int
+    minimum_io_size: int
+    optimal_io_size: int
+    discard: bool
+    partitions: tuple[str, ...]
+
+    @property
+    def io_size(self) -> int:
+        """Returns the preferred I/O size in bytes."""
+        return self.optimal_io_size or self.physical_block_size
+
+
+class Checkpoint(NamedTuple):
+    """State of a restore stored in a checkpoint journal.
+
+    Partitions map partition devices to their file system UUIDs.
+    """
+
+    target: str
+    image: str
+    sha256: str | None = None
+    partitions: dict[str, str | None] = {}
+    phases: tuple[Phase, ...] = ()
+    started: Phase | None = None
+
+    @classmethod
+    def from_json(cls, json: dict) -> Checkpoint:
+        """Creates a checkpoint from a JSON-ish dict."""
+        return cls(
+            json["target"],
+            json["image"],
+            json.get("sha256"),
+            json.get("partitions", {}),
+            tuple(Phase(phase) for phase in json.get("phases", ())),
+            None if (started := json.get("started")) is None else Phase(started),
+        )
+
+    def to_json(self) -> dict:
+        """Returns a JSON-ish dict."""
+        return {
+            "target": self.target,
+            "image": self.image,
+            "sha256": self.sha256,
+            "partitions": self.partitions,
+            "phases": [phase.value for phase in self.phases],
+            "started": None if self.started is None else self.started.value,
+        }
+
+
 class Compression(Enum):
     """Compression types."""
 
@@ -38,6 +111,15 @@ class Compression(Enum):
         self.full_name = full_name
         self.suffix = suffix or full_name
 
+    @classmethod
+    def from_name(cls, name: str) -> Compression:
+        """Returns the compression by its full name or suffix."""
+        for compression in cls:
+            if name in {compression.full_name, compression.suffix}:
+                return compression
+
+        raise ValueError("Unknown compression:", name)
+
 
 class DeviceType(NamedTuple):
     """Block device types."""
@@ -50,6 +132,21 @@ class DeviceType(NamedTuple):
         return fullmatch(self.regex, path.stem) and path.is_block_device()
 
 
+class Ext4Options(NamedTuple):
+    """Tuning options of an ext4 file system.
+
+    None leaves the choice to mke2fs.
+    """
+
+    bytes_per_inode: int | None = None
+    journal_size: int | None = None  # MiB
+    lazy_itable_init: bool | None = None
+    lazy_journal_init: bool | None = None
+    discard: bool | None = None
+    stride: int | None = None  # Blocks
+    stripe_width: int | None = None  # Blocks
+
+
 class Filesystem(Enum):
     """Known file systems."""
 
@@ -76,6 +173,21 @@ class Glob:
         return self.path.glob(self.glob)
 
 
+class GroupEntry(NamedTuple):
+    """An /etc/group entry."""
+
+    name: str
+    password: str
+    gid: int
+    members: tuple[str, ...]
+
+    @classmethod
+    def from_string(cls, string: str) -> GroupEntry:
+        """Creates a group entry from a string."""
+        name, password, gid, members = string.split(":")
+        return cls(name, password, int(gid), tuple(filter(None, members.split(","))))
+
+
 class Hash(Protocol):
     """Objects returned from hashlib.* algorithms."""
 
@@ -86,6 +198,123 @@ class Hash(Protocol):
         pass
 
 
+class ImageMetadata(NamedTuple):
+    """Image metadata stored in a sidecar file."""
+
+    compression: Compression
+    size: int
+    files: int
+    created: datetime
+    kernels: tuple[str, ...]
+    sha256: str | None = None
+    holes: int = 0
+
+    @classmethod
+    def from_json(cls, json: dict) -> ImageMetadata:
+        """Creates image metadata from a JSON-ish dict."""
+        return cls(
+            Compression.from_name(json["compression"]),
+            json["size"],
+            json["files"],
+            datetime.fromisoformat(json["created"]),
+            tuple(json["kernels"]),
+            json.get("sha256"),
+            json.get("holes", 0),
+        )
+
+    def to_json(self) -> dict:
+        """Returns a JSON-ish dict."""
+        return {
+            "compression": self.compression.full_name,
+            "size": self.size,
+            "files": self.files,
+            "created": self.created.isoformat(),
+            "kernels": list(self.kernels),
+            "sha256": self.sha256,
+            "holes": self.holes,
+        }
+
+
+class InstallSection(NamedTuple):
+    """The [Install] section of a systemd unit file."""
+
+    wanted_by: tuple[str, ...] = ()
+    required_by: tuple[str, ...] = ()
+    upheld_by: tuple[str, ...] = ()
+    alias: tuple[str, ...] = ()
+    also: tuple[str, ...] = ()
+    default_instance: str | None = None
+
+
+class ManifestEntry(NamedTuple):
+    """An inode listed in an image manifest.
+
+    The digest is the SHA-256 hex digest of files
+    and the target of symlinks.
+    """
+
+    path: str
+    type: MemberType
+    mode: int
+    uid: int
+    gid: int
+    size: int
+    digest: str | None = None
+
+    @classmethod
+    def from_json(cls, json: list) -> ManifestEntry:
+        """Creates a manifest entry from a JSON-ish list."""
+        path, typ, mode, uid, gid, size, digest = json
+        return cls(path, MemberType.from_label(typ), mode, uid, gid, size, digest)
+
+    def to_json(self) -> list:
+        """Returns a JSON-ish list."""
+        return [*self._replace(type=self.type.label)]
+
+
+class MemberType(Enum):
+    """Archive member types in their archiving order."""
+
+    DIRECTORY = ("directory", 0)
+    SYMLINK = ("symlink", 1)
+    OTHER = ("other", 2)
+    FILE = ("file", 3)
+
+    def __init__(self, label: str, rank: int):
+        """Creates a member type."""
+        self.label = label
+        self.rank = rank
+
+    @classmethod
+    def from_label(cls, label: str) -> MemberType:
+        """Returns the member type by its label."""
+        for member_type in cls:
+            if member_type.label == label:
+                return member_type
+
+        raise ValueError("Unknown member type:", label)
+
+
+class Member(NamedTuple):
+    """An archive member."""
+
+    path: str
+    type: MemberType
+    size: int
+    holes: int = 0
+
+
+class MkfsProfile(Enum):
+    """Profiles of file system creation."""
+
+    DEFAULT = "default"
+    IMAGE = "image"
+    LAZY = "lazy"
+
+    def __str__(self):
+        return self.value
+
+
 class Note(NamedTuple):
     """A note for a beep melody."""
 
@@ -145,6 +374,80 @@ class PasswdEntry(NamedTuple):
         return self.password
 
 
+class Phase(Enum):
+    """Phases of a restore in the order they run."""
+
+    PARTITION = "partition"
+    FORMAT = "format"
+    EXTRACT = "extract"
+    CONFIGURE = "configure"
+    INITRAMFS = "initramfs"
+    FINALIZE = "finalize"
+    VERIFY = "verify"
+
+    def __lt__(self, other: Phase) -> bool:
+        members = list(type(self))
+        return members.index(self) < members.index(other)
+
+
+class Preset(NamedTuple):
+    """A mkinitcpio preset."""
+
+    file: str
+    name: str
+    kver: str | None = None
+    config: str | None = None
+    image: str | None = None
+    options: str | None = None
+
+    def __str__(self):
+        return f"{self.file}:{self.name}"
+
+    @property
+    def args(self) -> Iterator[str]:
+        """Yields arguments for the mkinitcpio command."""
+        if self.kver is not None:
+            yield "-k"
+            yield self.kver
+
+        if self.config is not None:
+            yield "-c"
+            yield self.config
+
+        if self.image is not None:
+            yield "-g"
+            yield self.image
+
+        if self.options is not None:
+            yield from split(self.options)
+
+
+class RemovalStats(NamedTuple):
+    """Statistics of removed inodes."""
+
+    files: int = 0
+    directories: int = 0
+    bytes: int = 0
+
+    def __add__(self, other: RemovalStats) -> RemovalStats:
+        return type(self)(*(a + b for a, b in zip(self, other)))
+
+
+class ResetPlan(NamedTuple):
+    """Actions to be performed by a reset."""
+
+    disable: frozenset[str]
+    enable: frozenset[str]
+    files: tuple[Path, ...]
+    homes: tuple[Path, ...]
+    sizes: dict[str, RemovalStats]
+
+    @property
+    def total(self) -> RemovalStats:
+        """Returns the total statistics of all removals."""
+        return sum(self.sizes.values(), RemovalStats())
+
+
 class SafeTemporaryDirectory(TemporaryDirectory):
     """Temporary directory that only gets
     deleted if no exception occurred.
@@ -155,3 +458,30 @@ class SafeTemporaryDirectory(TemporaryDirectory):
             return super().__exit__(typ, value, traceback)
 
         return None
+
+
+class Timing(NamedTuple):
+    """The duration of a benchmark phase."""
+
+    phase: str
+    seconds: float
+    bytes: int = 0
+
+    @property
+    def throughput(self) -> float:
+        """Returns the processed bytes per second."""
+        return self.bytes / self.seconds if self.seconds else 0
+
+    @classmethod
+    def from_json(cls, json: dict) -> Timing:
+        """Creates a timing from a JSON-ish dict."""
+        return cls(json["phase"], json["seconds"], json.get("bytes", 0))
+
+    def to_json(self) -> dict:
+        """Returns a JSON-ish dict."""
+        return {
+            "phase": self.phase,
+            "seconds": self.seconds,
+            "bytes": self.bytes,
+            "throughput": self.throughput,
+        }
@@ -0,0 +1,616 @@
+"""In-process extraction of images with parallel file writers."""
+
+from __future__ import annotations
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from errno import ELOOP, ENOTDIR
+from functools import cache
+from io import BufferedReader, RawIOBase
+from grp import getgrnam
+from os import (
+    O_CLOEXEC,
+    O_CREAT,
+    O_DIRECTORY,
+    O_EXCL,
+    O_NOFOLLOW,
+    O_RDONLY,
+    O_WRONLY,
+    SEEK_CUR,
+    chmod,
+    chown,
+    close,
+    cpu_count,
+    dup,
+    ftruncate,
+    geteuid,
+    link,
+    lseek,
+    makedev,
+    mkdir,
+    mknod,
+    posix_fallocate,
+    read,
+    readv,
+    setxattr,
+    symlink,
+    unlink,
+    utime,
+    write,
+)
+from os import open as os_open
+from pathlib import Path
+from pwd import getpwnam
+from shutil import copyfileobj
+from stat import S_IFBLK, S_IFCHR, S_IFIFO
+from subprocess import PIPE, CalledProcessError, Popen
+from tarfile import BLKTYPE, CHRTYPE, FIFOTYPE, TarFile, TarInfo
+from tarfile import open as tar_open
+from threading import BoundedSemaphore, Thread
+from typing import IO, Iterable, Iterator
+
+from hidsltools.bsdtar import progress_logger
+from hidsltools.decompress import HEAD_SIZE, decompressor, detect
+from hidsltools.logging import LOGGER
+from hidsltools.types import Compression
+
+
+__all__ = ["unpack"]
+
+
+BLOCK_SIZE = 64 * 1024  # Granularity of hole detection.
+CACHE_SIZE = 64  # Open parent directory fds.
+CHUNK_SIZE = 1024 * 1024  # Larger files are streamed by the parser thread.
+NODE_TYPES = {BLKTYPE: S_IFBLK, CHRTYPE: S_IFCHR, FIFOTYPE: S_IFIFO}
+QUEUE_SIZE = 8  # Pending files per writer.
+XATTR_PREFIX = "SCHILY.xattr."
+ZEROS = bytes(BLOCK_SIZE)
+
+
+class Prefixed(RawIOBase):
+    """Reads the already consumed prefix and then the rest of an fd."""
+
+    def __init__(self, prefix: bytes, fd: int):
+        """Sets the prefix and the fd."""
+        super().__init__()
+        self.prefix = prefix
+        self.fd = fd
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        """Reads into the buffer."""
+        if not self.prefix:
+            return readv(self.fd, [buffer])
+
+        size = min(len(buffer), len(self.prefix))
+        buffer[:size] = self.prefix[:size]
+        self.prefix = self.prefix[size:]
+        return size
+
+
+def read_head(fd: int) -> bytes:
+    """Reads the first bytes of the stream to detect its format."""
+
+    head = b""
+
+    while len(head) < HEAD_SIZE and (chunk := read(fd, HEAD_SIZE - len(head))):
+        head += chunk
+
+    return head
+
+
+def copy(source: IO[bytes], sink: IO[bytes]) -> None:
+    """Copies the source into the sink and closes the sink."""
+
+    try:
+        with sink:
+            copyfileobj(source, sink, CHUNK_SIZE)
+    except BrokenPipeError:
+        LOGGER.debug("Decompressor stopped reading.")
+
+
+@contextmanager
+def archive(
+    tarball: Path | int, compression: Compression | None
+) -> Iterator[TarFile]:
+    """Opens the tarball as a stream.
+
+    The tarball is either a file or an fd to read from.
+    If the compression is not given, it is detected from the first bytes.
+    The decompression runs in a separate process,
+    so that it does not compete with parsing for the GIL.
+    """
+
+    stdin = tarball if isinstance(tarball, int) else None
+    source = None
+
+    if compression is None:
+        if stdin is None:
+            with open(tarball, "rb") as file:
+                head = file.read(HEAD_SIZE)
+        else:
+            source = BufferedReader(Prefixed(head := read_head(stdin), stdin))
+
+        try:
+            compression = detect(head)
+        except ValueError:
+            LOGGER.critical("Unknown compression of image %s.", tarball)
+            raise SystemExit(1) from None
+
+    if compression is None:
+        with source or open(tarball, "rb") as file:
+            with tar_open(fileobj=file, mode="r|") as tar:
+                yield tar
+
+        return
+
+    command = decompressor(compression, None if stdin is not None else tarball)
+    feeder = None
+
+    if source is not None:  # The head was consumed from the fd.
+        stdin = PIPE
+
+    with Popen(command, stdin=stdin, stdout=PIPE) as process:
+        if source is not None:
+            feeder = Thread(target=copy, args=(source, process.stdin), daemon=True)
+            feeder.start()
+
+        try:
+            with tar_open(fileobj=process.stdout, mode="r|") as tar:
+                yield tar
+
+            process.stdout.read()  # Padding after the end of the archive.
+        except BaseException:
+            process.kill()
+            raise
+        finally:
+            if feeder is not None:
+                feeder.join()
+
+    if process.returncode != 0:
+        raise CalledProcessError(process.returncode, command)
+
+
+def member_path(name: str) -> str | None:
+    """Returns the member's path relative to the target or None if unsafe."""
+
+    parts = [part for part in name.split("/") if part not in {"", "."}]
+
+    if ".." in parts:
+        return None
+
+    return "/".join(parts) or "."
+
+
+@cache
+def uid(user: str, default: int) -> int:
+    """Returns the UID of the user on this system, like bsdtar does."""
+
+    try:
+        return getpwnam(user).pw_uid
+    except KeyError:
+        return default
+
+
+@cache
+def gid(group: str, default: int) -> int:
+    """Returns the GID of the group on this system, like bsdtar does."""
+
+    try:
+        return getgrnam(group).gr_gid
+    except KeyError:
+        return default
+
+
+def nanoseconds(member: TarInfo, key: str) -> int:
+    """Returns the member's timestamp in nanoseconds.
+
+    Pax timestamps are parsed from their decimal representation,
+    since floats cannot hold them with nanosecond precision.
+    """
+
+    if (value := member.pax_headers.get(key)) is None:
+        return int(member.mtime) * 1_000_000_000
+
+    seconds, _, fraction = value.partition(".")
+    nanos = int(fraction[:9].ljust(9, "0"))
+    return int(seconds) * 1_000_000_000 + (-nanos if value[0] == "-" else nanos)
+
+
+def set_metadata(
+    target: int | str, member: TarInfo, dir_fd: int | None = None
+) -> None:
+    """Sets ownership, mode, xattrs and timestamps of an extracted inode.
+
+    The target is either an open fd or a path relative to dir_fd.
+    Extended attributes are only set on fds.
+    """
+
+    at = {} if dir_fd is None else {"dir_fd": dir_fd}
+    nofollow = {} if dir_fd is None else {**at, "follow_symlinks": False}
+
+    if geteuid() == 0:
+        owner = (uid(member.uname, member.uid), gid(member.gname, member.gid))
+        chown(target, *owner, **nofollow)
+
+    if not member.issym():
+        chmod(target, member.mode, **at)
+
+    if dir_fd is None:
+        for key, value in member.pax_headers.items():
+            if key.startswith(XATTR_PREFIX):
+                name = key[len(XATTR_PREFIX) :]
+                setxattr(target, name, value.encode("utf-8", "surrogateescape"))
+
+    mtime = nanoseconds(member, "mtime")
+    atime = nanoseconds(member, "atime") if "atime" in member.pax_headers else mtime
+    utime(target, ns=(atime, mtime), **nofollow)
+
+
+def write_all(fd: int, data: memoryview) -> None:
+    """Writes all data to the fd."""
+
+    while data:
+        data = data[write(fd, data) :]
+
+
+def write_chunk(fd: int, chunk: bytes, sparse: bool) -> None:
+    """Writes a chunk, seeking over blocks of zeros if sparse is True."""
+
+    view = memoryview(chunk)
+
+    if not sparse:
+        write_all(fd, view)
+        return
+
+    for offset in range(0, len(view), BLOCK_SIZE):
+        block = view[offset : offset + BLOCK_SIZE]
+
+        if block == ZEROS[: len(block)]:
+            lseek(fd, len(block), SEEK_CUR)
+        else:
+            write_all(fd, block)
+
+
+def create_file(name: str, dir_fd: int) -> int:
+    """Creates a new file, replacing any existing inode."""
+
+    flags = O_WRONLY | O_CREAT | O_EXCL | O_NOFOLLOW | O_CLOEXEC
+
+    try:
+        return os_open(name, flags, 0o600, dir_fd=dir_fd)
+    except FileExistsError:
+        unlink(name, dir_fd=dir_fd)
+        return os_open(name, flags, 0o600, dir_fd=dir_fd)
+
+
+def write_file(
+    name: str,
+    member: TarInfo,
+    chunks: Iterable[bytes],
+    dir_fd: int,
+    sparse: bool,
+) -> None:
+    """Writes a regular file and its metadata."""
+
+    fd = create_file(name, dir_fd)
+
+    try:
+        if sparse:
+            for chunk in chunks:
+                write_chunk(fd, chunk, sparse)
+
+            ftruncate(fd, member.size)  # Trailing holes.
+        else:
+            if member.size >= CHUNK_SIZE:
+                try:
+                    posix_fallocate(fd, 0, member.size)
+                except OSError as error:
+                    LOGGER.debug("Cannot preallocate %s: %s", name, error)
+
+            for chunk in chunks:
+                write_chunk(fd, chunk, sparse)
+
+        set_metadata(fd, member)
+    finally:
+        close(fd)
+
+
+def read_chunks(file: IO[bytes]) -> Iterator[bytes]:
+    """Yields the content of the file in chunks."""
+
+    while chunk := file.read(CHUNK_SIZE):
+        yield chunk
+
+
+def make_directory(name: str, dir_fd: int, mode: int = 0o700) -> None:
+    """Creates a directory, by default only accessible
+    by its owner until it is complete.
+    """
+
+    if name == ".":
+        return
+
+    try:
+        mkdir(name, mode, dir_fd=dir_fd)
+    except FileExistsError:
+        pass
+
+
+def finish_directory(name: str, member: TarInfo, dir_fd: int) -> None:
+    """Sets the metadata of an extracted directory."""
+
+    flags = O_RDONLY | O_DIRECTORY | O_NOFOLLOW | O_CLOEXEC
+    fd = os_open(name, flags, dir_fd=dir_fd)
+
+    try:
+        set_metadata(fd, member)
+    finally:
+        close(fd)
+
+
+def make_symlink(name: str, member: TarInfo, dir_fd: int) -> None:
+    """Creates a symlink and sets its metadata."""
+
+    try:
+        symlink(member.linkname, name, dir_fd=dir_fd)
+    except FileExistsError:
+        unlink(name, dir_fd=dir_fd)
+        symlink(member.linkname, name, dir_fd=dir_fd)
+
+    set_metadata(name, member, dir_fd)
+
+
+def make_hardlink(name: str, member: TarInfo, dir_fd: int, parents: Parents) -> None:
+    """Creates a hard link to a previously extracted member."""
+
+    if (target := member_path(member.linkname)) is None:
+        LOGGER.warning("Skipping unsafe hard link: %s", member.name)
+        return
+
+    src_dir_fd, target = parents.split(target)
+    at = {"src_dir_fd": src_dir_fd, "dst_dir_fd": dir_fd, "follow_symlinks": False}
+
+    try:
+        link(target, name, **at)
+    except FileExistsError:
+        unlink(name, dir_fd=dir_fd)
+        link(target, name, **at)
+
+
+def make_node(name: str, member: TarInfo, dir_fd: int) -> None:
+    """Creates a device node or FIFO and sets its metadata."""
+
+    mode = NODE_TYPES[member.type] | 0o600
+    device = makedev(member.devmajor, member.devminor)
+
+    try:
+        mknod(name, mode, device, dir_fd=dir_fd)
+    except FileExistsError:
+        unlink(name, dir_fd=dir_fd)
+        mknod(name, mode, device, dir_fd=dir_fd)
+
+    set_metadata(name, member, dir_fd)
+
+
+def open_directory(name: str, dir_fd: int) -> int:
+    """Opens a directory without following symlinks.
+
+    Missing directories are created, like bsdtar does.
+    """
+
+    flags = O_RDONLY | O_DIRECTORY | O_NOFOLLOW | O_CLOEXEC
+
+    try:
+        return os_open(name, flags, dir_fd=dir_fd)
+    except FileNotFoundError:
+        make_directory(name, dir_fd, 0o755)
+        return os_open(name, flags, dir_fd=dir_fd)
+
+
+class Parents:
+    """Cached fds of the parent directories of members.
+
+    Each directory is opened relative to its parent with O_NOFOLLOW,
+    so that an extracted symlink cannot redirect later members
+    outside of the target.
+    """
+
+    def __init__(self, dir_fd: int):
+        """Sets the target directory's fd."""
+        self.dir_fd = dir_fd
+        self.fds: OrderedDict[str, int] = OrderedDict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, typ, value, traceback):
+        for fd in self.fds.values():
+            close(fd)
+
+        self.fds.clear()
+
+    def open(self, path: str) -> int:
+        """Returns the fd of the directory relative to the target."""
+        if not path:
+            return self.dir_fd
+
+        if (fd := self.fds.get(path)) is not None:
+            self.fds.move_to_end(path)
+            return fd
+
+        parent, _, name = path.rpartition("/")
+        self.fds[path] = fd = open_directory(name, self.open(parent))
+
+        if len(self.fds) > CACHE_SIZE:
+            close(self.fds.popitem(last=False)[1])
+
+        return fd
+
+    def split(self, path: str) -> tuple[int, str]:
+        """Returns the fd of the parent directory and the base name."""
+        parent, _, name = path.rpartition("/")
+        return self.open(parent), name
+
+
+def run_in(dir_fd: int, function, name: str, *args, **kwargs) -> None:
+    """Runs the function on the name in the directory and closes its fd."""
+
+    try:
+        function(name, *args, dir_fd=dir_fd, **kwargs)
+    finally:
+        close(dir_fd)
+
+
+class Writers:
+    """A bounded pool of file writers.
+
+    With a single worker, the jobs run in the calling thread.
+    """
+
+    def __init__(self, workers: int):
+        """Creates the pool."""
+        self.executor = ThreadPoolExecutor(workers) if workers > 1 else None
+        self.slots = BoundedSemaphore(workers * QUEUE_SIZE)
+        self.pending: dict[str, Future] = {}
+        self.errors: list[BaseException] = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, typ, value, traceback):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=typ is not None)
+
+        if typ is None:
+            self.check()
+
+    def submit(self, name: str, function, *args, **kwargs) -> None:
+        """Runs the function for the inode with the given name in the pool."""
+        if self.executor is None:
+            function(*args, **kwargs)
+            return
+
+        self.check()
+        self.slots.acquire()
+        future = self.executor.submit(function, *args, **kwargs)
+        self.pending[name] = future
+        future.add_done_callback(lambda _: self.done(name, future))
+
+    def done(self, name: str, future: Future) -> None:
+        """Releases the slot of a finished job."""
+        if self.pending.get(name) is future:
+            del self.pending[name]
+
+        if not future.cancelled() and (error := future.exception()) is not None:
+            self.errors.append(error)
+
+        self.slots.release()
+
+    def wait(self, name: str) -> None:
+        """Waits for the job of the inode with the given name to finish."""
+        if (future := self.pending.get(name)) is not None:
+            future.result()
+
+    def check(self) -> None:
+        """Raises the first error of a finished job."""
+        if self.errors:
+            raise self.errors[0]
+
+
+def members(tar: TarFile) -> Iterator[TarInfo]:
+    """Yields the members of a streamed archive without retaining them."""
+
+    while (member := tar.next()) is not None:
+        yield member
+        tar.members.clear()
+
+
+def extract(
+    member: TarInfo, tar: TarFile, parents: Parents, writers: Writers, sparse: bool
+) -> str | None:
+    """Extracts a member except for directory metadata.
+
+    Returns the member's path or None if it was skipped.
+    """
+
+    if (name := member_path(member.name)) is None:
+        LOGGER.warning("Skipping unsafe member: %s", member.name)
+        return None
+
+    try:
+        parent, base = parents.split(name)
+
+        if member.isdir():
+            make_directory(base, parent)
+        elif member.isreg() and member.size >= CHUNK_SIZE:
+            chunks = read_chunks(tar.extractfile(member))
+            write_file(base, member, chunks, parent, sparse)
+        elif member.isreg():
+            data = tar.extractfile(member).read()
+            job = (write_file, base, member, [data])
+            writers.submit(name, run_in, dup(parent), *job, sparse=sparse)
+        elif member.issym():
+            make_symlink(base, member, parent)  # Before members below it.
+        elif member.islnk():
+            writers.wait(member_path(member.linkname))
+            make_hardlink(base, member, parent, parents)
+        elif member.type in NODE_TYPES:
+            make_node(base, member, parent)
+        else:
+            LOGGER.warning("Skipping unsupported member: %s", member.name)
+            return None
+    except OSError as error:
+        if error.errno not in {ELOOP, ENOTDIR}:
+            raise
+
+        LOGGER.warning("Skipping member below symlink: %s", member.name)
+        return None
+
+    return name
+
+
+def unpack(
+    tarball: Path | int,
+    target: Path,
+    *,
+    compression: Compression | None = None,
+    workers: int | None = None,
+    total: int | None = None,
+    sparse: bool = True,
+) -> None:
+    """Extracts an image in-process.
+
+    One thread parses the decompressed stream while a pool of workers
+    writes the files relative to the fds of their parent directories,
+    which are opened without following symlinks. Files larger
+    than CHUNK_SIZE are streamed by the parsing thread itself.
+    Directory metadata is applied last, deepest directories first.
+    """
+
+    workers = workers or cpu_count() or 1
+    log_progress = progress_logger(total) if total else None
+    directories = []
+    dir_fd = os_open(target, O_RDONLY | O_DIRECTORY | O_CLOEXEC)
+
+    try:
+        with Parents(dir_fd) as parents:
+            with archive(tarball, compression) as tar, Writers(workers) as writers:
+                for member in members(tar):
+                    if log_progress is not None:
+                        log_progress(b"x ")  # A listing line of bsdtar -x -v.
+
+                    name = extract(member, tar, parents, writers, sparse)
+
+                    if name is not None and member.isdir():
+                        directories.append((name, member))
+
+            directories.sort(key=lambda item: item[0].count("/"), reverse=True)
+
+            for name, member in directories:
+                parent, base = parents.split(name)
+                finish_directory(base, member, parent)
+    finally:
+        close(dir_fd)
@@ -1,6 +1,7 @@
 """Digital signage data and user handling."""
 
 from pathlib import Path
+from typing import Iterator
 
 from hidsltools.defaults import ROOT
 from hidsltools.functions import chroot, rmsubtree
@@ -8,14 +9,14 @@ from hidsltools.logging import LOGGER
 from hidsltools.passwd import get_user
 
 
-__all__ = ["clean_homes"]
+__all__ = ["clean_homes", "get_homes"]
 
 
 USERS = {"digsig", "homeinfo", "root"}
 
 
-def clean_homes(*, root: Path = ROOT) -> None:
-    """Removes all digital-signage related data."""
+def get_homes(*, root: Path = ROOT) -> Iterator[Path]:
+    """Yields the home directories to be cleaned below root."""
 
     for user in sorted(USERS):
         try:
@@ -24,10 +25,24 @@ def clean_homes(*, root: Path = ROOT) -> None:
             LOGGER.error("No such user: %s", user)
             continue
 
-        LOGGER.debug("Cleaning home %s of user %s.", home, user)
+        LOGGER.debug("Home of user %s is %s.", user, home)
 
         if home == ROOT:
             LOGGER.warning("Skipping root directory.")
             continue
 
-        rmsubtree(chroot(root, home))
+        yield chroot(root, home)
+
+
+def clean_homes(*, root: Path = ROOT, workers: int = 4) -> None:
+    """Removes all digital-signage related data."""
+
+    for home in get_homes(root=root):
+        LOGGER.debug("Cleaning home %s.", home)
+        stats = rmsubtree(home, workers=workers)
+        LOGGER.debug(
+            "Removed %i files and %i directories, freeing %i bytes.",
+            stats.files,
+            stats.directories,
+            stats.bytes,
+        )
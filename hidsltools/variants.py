@@ -0,0 +1,218 @@
+"""Several compression variants of one tar stream."""
+
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from functools import partial
+from hashlib import sha256
+from os import close, pipe
+from pathlib import Path
+from queue import Queue
+from subprocess import PIPE, CalledProcessError, Popen
+from typing import IO, Callable, Iterable
+
+from hidsltools.bsdtar import create as bsdtar_create
+from hidsltools.logging import LOGGER
+from hidsltools.normalize import normalize
+from hidsltools.types import Compression, Member
+
+
+__all__ = ["create", "tee"]
+
+
+CHUNK_SIZE = 1024 * 1024
+QUEUE_SIZE = 8  # Chunks buffered per compressor.
+
+
+def compressor(compression: Compression, level: int | None) -> list[str]:
+    """Returns the command to compress stdin to stdout.
+
+    lrzip is run like libarchive runs it, which buffers the whole stream.
+    """
+
+    if compression is Compression.LRZIP:
+        command = [compression.full_name, "-q"]
+
+        if level is not None:
+            command += ["-L", str(level)]
+
+        return command
+
+    command = [compression.full_name, "-c"]
+
+    if level is not None:
+        command.append(f"-{level}")
+
+    return command
+
+
+def feed(chunks: Queue, sink: IO[bytes]) -> None:
+    """Writes the queued chunks into the sink until None is queued.
+
+    After a write error, the chunks are still consumed,
+    so that the other sinks are not blocked.
+    """
+
+    error = None
+
+    while (chunk := chunks.get()) is not None:
+        if error is None:
+            try:
+                sink.write(chunk)
+            except OSError as exception:
+                error = exception
+
+    try:
+        sink.close()
+    except OSError as exception:
+        error = error or exception
+
+    if error is not None:
+        raise error
+
+
+def tee(chunks: Iterable[bytes], sinks: Iterable[IO[bytes]]) -> None:
+    """Copies the chunks into all sinks concurrently.
+
+    Each sink is written by its own thread from a bounded queue,
+    so that the slowest sink throttles reading the chunks.
+    """
+
+    queues = [(Queue(maxsize=QUEUE_SIZE), sink) for sink in sinks]
+
+    with ThreadPoolExecutor(max_workers=len(queues)) as executor:
+        feeders = [executor.submit(feed, *queue) for queue in queues]
+
+        try:
+            for chunk in chunks:
+                for queue, _ in queues:
+                    queue.put(chunk)
+        finally:
+            for queue, _ in queues:
+                queue.put(None)
+
+    for feeder in feeders:
+        feeder.result()
+
+
+def store(source: IO[bytes], tarball: Path) -> str:
+    """Writes the source into the tarball and returns its SHA-256 hex digest."""
+
+    digest = sha256()
+
+    with source, tarball.open("wb") as file:
+        while chunk := source.read(CHUNK_SIZE):
+            digest.update(chunk)
+            file.write(chunk)
+
+    return digest.hexdigest()
+
+
+def consume(consumer: Callable[[IO[bytes]], None], source: IO[bytes]) -> None:
+    """Runs the consumer on the source and drains what it left unread."""
+
+    with source:
+        consumer(source)
+
+        while source.read(CHUNK_SIZE):
+            pass
+
+
+def archive(fd: int, root: Path, **kwargs) -> None:
+    """Writes an uncompressed tar stream of root into the fd and closes it."""
+
+    try:
+        bsdtar_create(fd, root, compression=None, compression_level=None, **kwargs)
+    finally:
+        close(fd)
+
+
+def create(
+    tarballs: dict[Compression, Path],
+    root: Path,
+    *,
+    members: Iterable[Member] | None = None,
+    numeric_owner: bool = False,
+    sparse: bool = True,
+    compression_level: int | None = 9,
+    reproducible: bool = False,
+    mtime: int | None = None,
+    on_member: Callable[[bytes], None] | None = None,
+    consumers: Iterable[Callable[[IO[bytes]], None]] = (),
+    verbose: bool = False,
+) -> dict[Compression, str]:
+    """Creates one tarball per compression from a single tar stream of root.
+
+    The uncompressed tar stream is teed to concurrent compressors
+    and to the consumers, which each read it from a pipe in a thread.
+    If reproducible is True, its metadata is normalized before.
+    The tarballs are hashed while they are written.
+    Returns the SHA-256 hex digests of the tarballs.
+    """
+
+    commands = [compressor(compression, compression_level) for compression in tarballs]
+    consumers = list(consumers)
+
+    with ExitStack() as stack:
+        processes = []
+
+        for command, tarball in zip(commands, tarballs.values()):
+            LOGGER.debug("Compressing %s with: %s", tarball, command)
+            processes.append(
+                stack.enter_context(Popen(command, stdin=PIPE, stdout=PIPE))
+            )
+
+        readers, writers = [], []
+
+        for _ in consumers:
+            consumer_fd, sink_fd = pipe()
+            readers.append(stack.enter_context(open(consumer_fd, "rb")))
+            writers.append(stack.enter_context(open(sink_fd, "wb")))
+
+        read_fd, write_fd = pipe()
+        source = stack.enter_context(open(read_fd, "rb"))
+
+        if reproducible:
+            chunks = normalize(source, mtime)
+        else:
+            chunks = iter(partial(source.read, CHUNK_SIZE), b"")
+
+        workers = len(processes) + len(readers) + 1
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            consumed = [
+                executor.submit(consume, consumer, reader)
+                for consumer, reader in zip(consumers, readers)
+            ]
+            digests = [
+                executor.submit(store, process.stdout, tarball)
+                for process, tarball in zip(processes, tarballs.values())
+            ]
+            archiver = executor.submit(
+                archive,
+                write_fd,
+                root,
+                members=members,
+                numeric_owner=numeric_owner,
+                sparse=sparse,
+                on_member=on_member,
+                verbose=verbose,
+            )
+            try:
+                tee(chunks, [*(process.stdin for process in processes), *writers])
+            except BaseException:
+                source.close()  # bsdtar would block writing the pipe otherwise.
+                raise
+
+        archiver.result()
+
+        for future in consumed:
+            future.result()
+
+    for command, process in zip(commands, processes):
+        if process.returncode != 0:
+            raise CalledProcessError(process.returncode, command)
+
+    return {
+        compression: digest.result() for compression, digest in zip(tarballs, digests)
+    }
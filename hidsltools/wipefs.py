@@ -1,17 +1,157 @@
 """File system wiping."""
 
-from hidsltools.device import Device
+from ctypes import c_int, c_long, get_errno
+from errno import EOPNOTSUPP
+from fcntl import ioctl
+from os import O_RDWR, O_WRONLY, close, fstat, fsync
+from os import open as os_open, pwrite, strerror
+from pathlib import Path
+from stat import S_ISBLK, S_ISREG
+from struct import pack, unpack
+from typing import Iterable
+
+from hidsltools.device import Device, inventory
 from hidsltools.functions import exe
+from hidsltools.libc import libc
+from hidsltools.logging import LOGGER
 
 
-__all__ = ["wipefs"]
+__all__ = ["discard", "supports_discard", "wipe", "wipefs"]
 
 
+BLKDISCARD = 0x1277
+BLKSECDISCARD = 0x127D
+BLKGETSIZE64 = 0x80081272
+FALLOC_FL_KEEP_SIZE = 0x01
+FALLOC_FL_PUNCH_HOLE = 0x02
+SIGNATURE_AREA = 1024 * 1024  # One MiB at either end holds MBR, GPT and fs sbs.
 WIPEFS = "/usr/bin/wipefs"
 
 
-def wipefs(device: Device, *, verbose: bool = False) -> None:
-    """Wipes file systems from a device."""
+def wipefs(device: Device, *, native: bool = True, verbose: bool = False) -> None:
+    """Wipes file systems from a device.
+
+    If native is True, the signature areas are zeroed in-process
+    and the wipefs utility is only used as a fallback.
+    """
+
+    if native:
+        try:
+            zero_signatures(device)
+            device.reread_partitions()
+            return
+        except OSError as error:
+            LOGGER.warning("Could not wipe %s natively: %s", device, error)
 
     command = [WIPEFS, "-a", "-f", str(device)]
     exe(command, verbose=verbose)
+
+
+def get_size(fd: int) -> int:
+    """Returns the size of a block device or regular file in bytes."""
+
+    if S_ISBLK((stat := fstat(fd)).st_mode):
+        return unpack("Q", ioctl(fd, BLKGETSIZE64, pack("Q", 0)))[0]
+
+    return stat.st_size
+
+
+def supports_discard(device: Path) -> bool:
+    """Checks whether the given device or file can be discarded."""
+
+    if device.is_file():
+        return True
+
+    name = device.resolve().name
+
+    for info in inventory().values():
+        # Partitions inherit the queue limits of their parent device.
+        if name == info.name or name in info.partitions:
+            return info.discard
+
+    return False
+
+
+def punch_hole(fd: int, offset: int, length: int) -> None:
+    """Deallocates the given range of a regular file."""
+
+    fallocate = libc().fallocate
+    fallocate.argtypes = [c_int, c_int, c_long, c_long]
+    mode = FALLOC_FL_PUNCH_HOLE | FALLOC_FL_KEEP_SIZE
+
+    if fallocate(fd, mode, offset, length) != 0:
+        raise OSError(errno := get_errno(), strerror(errno))
+
+
+def discard(
+    device: Path,
+    ranges: Iterable[tuple[int, int]] | None = None,
+    *,
+    secure: bool = False,
+) -> int:
+    """Discards the given (offset, length) ranges or the whole device.
+
+    Returns the amount of bytes discarded.
+    """
+
+    fd = os_open(device, O_WRONLY)
+
+    try:
+        size = get_size(fd)
+        ranges = [(0, size)] if ranges is None else list(ranges)
+        regular = S_ISREG(fstat(fd).st_mode)
+        request = BLKSECDISCARD if secure else BLKDISCARD
+
+        for offset, length in ranges:
+            if offset < 0 or length < 0 or offset + length > size:
+                raise ValueError(f"Range out of bounds: {offset}+{length} > {size}")
+
+            LOGGER.debug("Discarding %i bytes at offset %i.", length, offset)
+
+            if regular:
+                punch_hole(fd, offset, length)
+            else:
+                ioctl(fd, request, pack("QQ", offset, length))
+    finally:
+        close(fd)
+
+    return sum(length for _, length in ranges)
+
+
+def zero_signatures(device: Path, *, area: int = SIGNATURE_AREA) -> None:
+    """Zeroes the partition table and file system signature areas.
+
+    This covers the MBR, the primary and backup GPT as well as the
+    ext4 and vfat superblocks at the start of the device.
+    """
+
+    fd = os_open(device, O_RDWR)
+
+    try:
+        size = get_size(fd)
+        area = min(area, size)
+        zeros = bytes(area)
+        pwrite(fd, zeros, 0)
+        pwrite(fd, zeros, size - area)
+        fsync(fd)
+    finally:
+        close(fd)
+
+
+def wipe(
+    device: Path,
+    ranges: Iterable[tuple[int, int]] | None = None,
+    *,
+    secure: bool = False,
+) -> int:
+    """Discards the device's blocks and zeroes its signature areas.
+
+    Raises OSError with EOPNOTSUPP if the device does not support discard.
+    """
+
+    if not supports_discard(device):
+        raise OSError(EOPNOTSUPP, "Device does not support discard", str(device))
+
+    discarded = discard(device, ranges, secure=secure)
+    zero_signatures(device)
+    return discarded
@@ -15,6 +15,7 @@ setup(
     packages=["hidsltools"],
     entry_points={
         "console_scripts": [
+            "hidslbench = hidsltools.benchmark:main",
             "hireset = hidsltools.reset:main",
             "hirestore = hidsltools.restore:main",
             "mkhidslimg = hidsltools.image:main",
@@ -0,0 +1,138 @@
+"""Tests of the image download against a local HTTP server."""
+
+from hashlib import sha256
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os import read
+from threading import Thread
+from unittest import TestCase, main
+from unittest.mock import patch
+
+from hidsltools.download import fetch_sidecar, stream
+from hidsltools.sidecar import SUFFIX
+
+
+CHUNK_SIZE = 64 * 1024
+DATA = bytes(range(256)) * 4096  # 1 MiB
+DROP_AFTER = 300_000  # Bytes sent before dropping the first connection.
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Serves DATA with optional range support and dropped connections."""
+
+    drop = False
+    ranges = True
+    requests = []
+
+    def do_GET(self):
+        """Serves DATA or a part of it."""
+        self.requests.append(self.headers.get("Range"))
+
+        if self.path.endswith(SUFFIX):
+            self.send_error(404)
+            return
+
+        offset = 0
+
+        if self.ranges and (value := self.headers.get("Range")) is not None:
+            offset = int(value[len("bytes=") :].rstrip("-"))
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {offset}-{len(DATA) - 1}")
+        else:
+            self.send_response(200)
+
+        self.send_header("Content-Length", str(len(DATA) - offset))
+        self.end_headers()
+
+        if self.drop and not offset:
+            self.wfile.write(DATA[:DROP_AFTER])
+            self.close_connection = True
+            return
+
+        self.wfile.write(DATA[offset:])
+
+    def log_message(self, *_):
+        """Keeps the test output clean."""
+
+
+def read_all(fd: int) -> bytes:
+    """Reads the fd until EOF."""
+
+    data = bytearray()
+
+    while chunk := read(fd, CHUNK_SIZE):
+        data += chunk
+
+    return bytes(data)
+
+
+class TestDownload(TestCase):
+    """Tests streaming, resuming and verification of downloads."""
+
+    def setUp(self):
+        Handler.drop = False
+        Handler.ranges = True
+        Handler.requests = []
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        host, port = self.server.server_address
+        self.url = f"http://{host}:{port}/image.tar.zst"
+        self.patch = patch("hidsltools.download.RETRY_DELAY", 0)
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def test_full(self):
+        """Tests a download in a single response."""
+        with stream(self.url, checksum=sha256(DATA).hexdigest()) as fd:
+            self.assertEqual(read_all(fd), DATA)
+
+        self.assertEqual(Handler.requests, [None])
+
+    def test_resume(self):
+        """Tests that a dropped connection is resumed with a range request."""
+        Handler.drop = True
+
+        with stream(self.url, checksum=sha256(DATA).hexdigest()) as fd:
+            self.assertEqual(read_all(fd), DATA)
+
+        self.assertEqual(Handler.requests, [None, f"bytes={DROP_AFTER}-"])
+
+    def test_no_range_support(self):
+        """Tests that a full response to a range request is an error."""
+        Handler.drop = True
+        Handler.ranges = False
+
+        with self.assertRaises(SystemExit), self.assertLogs(level="CRITICAL"):
+            with stream(self.url) as fd:
+                self.assertEqual(read_all(fd), DATA[:DROP_AFTER])
+
+        self.assertEqual(Handler.requests, [None, f"bytes={DROP_AFTER}-"])
+
+    def test_checksum_mismatch(self):
+        """Tests that a checksum mismatch exits."""
+        with self.assertRaises(SystemExit), self.assertLogs(level="CRITICAL"):
+            with stream(self.url, checksum=sha256(b"").hexdigest()) as fd:
+                self.assertEqual(read_all(fd), DATA)
+
+    def test_partial_read(self):
+        """Tests that data the caller did not read is still verified."""
+        with stream(self.url, checksum=sha256(DATA).hexdigest()) as fd:
+            self.assertEqual(read(fd, 512), DATA[:512])
+
+    def test_no_sidecar(self):
+        """Tests that a missing sidecar file is no error."""
+        self.assertIsNone(fetch_sidecar(self.url))
+
+    def test_unreachable(self):
+        """Tests that an unreachable server exits."""
+        with self.assertRaises(SystemExit), self.assertLogs(level="CRITICAL"):
+            fetch_sidecar("http://127.0.0.1:1/image.tar.zst")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Tests of the native fstab generation against genfstab -L -p output."""
+
+from pathlib import Path
+from shutil import which
+from subprocess import DEVNULL, run
+from tempfile import TemporaryDirectory
+from unittest import TestCase, main, skipIf
+from unittest.mock import patch
+
+from hidsltools.defaults import BOOT, ROOT
+from hidsltools.fstab import mkfstab, write_fstab
+from hidsltools.superblock import Superblock
+from hidsltools.types import Filesystem, Partition
+
+
+MKFS_EXT4 = which("mkfs.ext4") or which("mkfs.ext4", path="/usr/sbin:/sbin")
+ROOT_UUID = "2c2b7a8e-4b5e-4a1f-9d7e-3f6a1b0c9d8e"
+SUPERBLOCKS = {
+    Filesystem.VFAT: Superblock("EFI", "3A1B-7C2D"),
+    Filesystem.EXT4: Superblock("root", ROOT_UUID),
+}
+EFI_LAYOUT = [
+    Partition(Path("/dev/sda1"), BOOT, Filesystem.VFAT, "EFI"),
+    Partition(Path("/dev/sda2"), ROOT, Filesystem.EXT4, "root"),
+]
+EFI_FSTAB = (
+    f"# /dev/sda2 UUID={ROOT_UUID}\n"
+    "LABEL=root          \t/         \text4      \trw,relatime\t0 1\n"
+    "\n"
+    "# /dev/sda1 UUID=3A1B-7C2D\n"
+    "LABEL=EFI           \t/boot     \tvfat      \trw,relatime,fmask=0022,"
+    "dmask=0022,codepage=437,iocharset=ascii,shortname=mixed,utf8,"
+    "errors=remount-ro\t0 2\n"
+    "\n"
+)
+MBR_LAYOUT = [Partition(Path("/dev/sda1"), ROOT, Filesystem.EXT4, "root")]
+MBR_FSTAB = (
+    f"# /dev/sda1 UUID={ROOT_UUID}\n"
+    "LABEL=root          \t/         \text4      \trw,relatime\t0 1\n"
+    "\n"
+)
+
+
+def read_superblock(_: Path, filesystem: Filesystem) -> Superblock:
+    """Returns the superblock of the fake devices."""
+
+    return SUPERBLOCKS[filesystem]
+
+
+class TestFstab(TestCase):
+    """Tests fstab generation."""
+
+    @patch("hidsltools.fstab.read_superblock", read_superblock)
+    def test_efi_layout(self):
+        """Tests the labeled vfat and ext4 partitions of an EFI installation."""
+        self.assertEqual(mkfstab(EFI_LAYOUT), EFI_FSTAB)
+
+    @patch("hidsltools.fstab.read_superblock", read_superblock)
+    def test_mbr_layout(self):
+        """Tests the single ext4 partition of an MBR installation."""
+        self.assertEqual(mkfstab(MBR_LAYOUT), MBR_FSTAB)
+
+    @patch(
+        "hidsltools.fstab.read_superblock",
+        lambda *_: Superblock(None, ROOT_UUID),
+    )
+    def test_unlabeled(self):
+        """Tests that unlabeled partitions are referred to by device."""
+        self.assertEqual(
+            mkfstab(MBR_LAYOUT),
+            f"# UUID={ROOT_UUID}\n"
+            "/dev/sda1           \t/         \text4      \trw,relatime\t0 1\n"
+            "\n",
+        )
+
+    @patch("hidsltools.fstab.read_superblock", side_effect=OSError)
+    def test_unreadable_superblock(self, _):
+        """Tests the fallback to the label passed to mkfs."""
+        self.assertEqual(
+            mkfstab(MBR_LAYOUT),
+            "# /dev/sda1\n"
+            "LABEL=root          \t/         \text4      \trw,relatime\t0 1\n"
+            "\n",
+        )
+
+    @patch(
+        "hidsltools.fstab.read_superblock",
+        lambda *_: Superblock("my root", ROOT_UUID),
+    )
+    def test_mangling(self):
+        """Tests that white space is escaped like genfstab does."""
+        _, entry, _ = mkfstab(MBR_LAYOUT).split("\n", maxsplit=2)
+        self.assertTrue(entry.startswith("LABEL=my\\040root "))
+
+    @skipIf(MKFS_EXT4 is None, "mkfs.ext4 not available")
+    def test_ext4_superblock(self):
+        """Tests the fstab of a real ext4 file system."""
+        with TemporaryDirectory() as tmpd:
+            image = Path(tmpd) / "root.img"
+
+            with image.open("wb") as file:
+                file.truncate(16 * 1024 * 1024)
+
+            run(
+                [MKFS_EXT4, "-q", "-F", "-L", "root", "-U", ROOT_UUID, str(image)],
+                check=True,
+                stdout=DEVNULL,
+            )
+            (Path(tmpd) / "etc").mkdir()
+            partition = Partition(image, ROOT, Filesystem.EXT4, "wrong")
+            write_fstab([partition], root=Path(tmpd))
+            self.assertEqual(
+                (Path(tmpd) / "etc/fstab").read_text(),
+                MBR_FSTAB.replace("/dev/sda1", str(image)),
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""Tests of the import time of the console script modules."""
+
+from pathlib import Path
+from statistics import median
+from subprocess import PIPE, run
+from sys import executable
+from unittest import TestCase, main
+
+
+BASE_DIR = Path(__file__).parent.parent
+BUDGET = 100_000  # Microseconds of cumulative import time.
+DEFERRED = {"hidsltools.bsdtar", "hidsltools.download", "hidsltools.unpack"}
+MODULES = ["hidsltools.image", "hidsltools.reset", "hidsltools.restore"]
+RUNS = 3
+
+
+def import_times(module: str) -> dict[str, int]:
+    """Returns the cumulative import times of all modules in microseconds."""
+
+    stderr = run(
+        [executable, "-X", "importtime", "-c", f"import {module}"],
+        check=True,
+        cwd=BASE_DIR,
+        stderr=PIPE,
+        text=True,
+    ).stderr
+    times = {}
+
+    for line in stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, name = line.split("|")
+
+            if cumulative.strip().isdigit():
+                times[name.strip()] = int(cumulative)
+
+    return times
+
+
+class TestImportTime(TestCase):
+    """Tests the import time of the console script modules."""
+
+    def test_budget(self):
+        """Tests that importing stays within the budget."""
+        for module in MODULES:
+            with self.subTest(module=module):
+                runs = [import_times(module)[module] for _ in range(RUNS)]
+                self.assertLessEqual(median(runs), BUDGET)
+
+    def test_lazy(self):
+        """Tests that the heavy modules are not imported eagerly."""
+        for module in MODULES:
+            with self.subTest(module=module):
+                self.assertFalse(DEFERRED & import_times(module).keys())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""Tests of the tar metadata normalization for reproducible images."""
+
+from io import BytesIO
+from os import utime
+from pathlib import Path
+from shutil import which
+from subprocess import DEVNULL, PIPE, run
+from tarfile import PAX_FORMAT, TarInfo, open as tar_open
+from tempfile import TemporaryDirectory
+from unittest import TestCase, main, skipIf
+
+from hidsltools.normalize import normalize
+
+
+BSDTAR = which("bsdtar")
+GNU_TAR = which("tar")
+LONG_NAME = "long/" + "x" * 120 + "/file.txt"
+MIB = 1024 * 1024
+MTIME = 1_700_000_000
+SOURCE_DATE_EPOCH = 1_600_000_000
+
+
+def normalized(data: bytes, mtime: int | None = None) -> bytes:
+    """Returns the normalized tar stream."""
+
+    return b"".join(normalize(BytesIO(data), mtime))
+
+
+def pax_archive(owner: str, atime: float) -> bytes:
+    """Returns a pax archive with the given owner names and access time."""
+
+    buffer = BytesIO()
+
+    with tar_open(fileobj=buffer, mode="w", format=PAX_FORMAT) as tar:
+        for name, content in [("etc/hostname", b"hidsl\n"), (LONG_NAME, b"long")]:
+            member = TarInfo(name)
+            member.size = len(content)
+            member.mtime = MTIME
+            member.uname = member.gname = owner
+            member.pax_headers = {"atime": str(atime), "ctime": str(atime)}
+            tar.addfile(member, BytesIO(content))
+
+    return buffer.getvalue()
+
+
+def make_root(root: Path) -> None:
+    """Creates a root with a long name, a symlink and a sparse file."""
+
+    (long := root / LONG_NAME).parent.mkdir(parents=True)
+    long.write_text("long", encoding="utf-8")
+    (root / "link").symlink_to(LONG_NAME)
+
+    with (root / "sparse.img").open("wb") as file:
+        file.write(b"head")
+        file.seek(4 * MIB)
+        file.write(b"tail")
+
+    for path in [long, root / "sparse.img"]:
+        utime(path, (MTIME, MTIME))
+
+
+def contents(data: bytes) -> dict[str, tuple[int, bytes | str]]:
+    """Returns the mtimes and contents or link targets of all members."""
+
+    result = {}
+
+    with tar_open(fileobj=BytesIO(data), mode="r:") as tar:
+        for member in tar:
+            if member.isfile():
+                content = tar.extractfile(member).read()
+            else:
+                content = member.linkname
+
+            result[member.name.rstrip("/")] = (int(member.mtime), content)
+
+    return result
+
+
+def bsdtar_list(data: bytes) -> list[str]:
+    """Lists the members with bsdtar."""
+
+    output = run([BSDTAR, "-t", "-f", "-"], input=data, stdout=PIPE, check=True)
+    return sorted(output.stdout.decode().splitlines())
+
+
+class TestNormalize(TestCase):
+    """Tests the normalization of tar streams."""
+
+    def test_identical(self):
+        """Tests that owner names, atimes and ctimes do not matter."""
+        first = pax_archive("root", MTIME + 1.5)
+        second = pax_archive("homeinfo", MTIME + 3600.25)
+        self.assertNotEqual(first, second)
+        self.assertEqual(normalized(first), normalized(second))
+
+    def test_readable(self):
+        """Tests that the normalized pax archive is still readable."""
+        data = normalized(pax_archive("root", MTIME))
+
+        with tar_open(fileobj=BytesIO(data), mode="r:") as tar:
+            members = tar.getmembers()
+            self.assertEqual([m.name for m in members], ["etc/hostname", LONG_NAME])
+
+            for member in members:
+                self.assertEqual(member.uname, "")
+                self.assertNotIn("atime", member.pax_headers)
+                self.assertNotIn("ctime", member.pax_headers)
+
+            self.assertEqual(tar.extractfile(LONG_NAME).read(), b"long")
+
+    def test_clamp(self):
+        """Tests that modification times are clamped to SOURCE_DATE_EPOCH."""
+        data = normalized(pax_archive("root", MTIME), SOURCE_DATE_EPOCH)
+
+        for mtime, _ in contents(data).values():
+            self.assertEqual(mtime, SOURCE_DATE_EPOCH)
+
+    def test_no_clamp_of_older(self):
+        """Tests that older modification times are kept."""
+        data = normalized(pax_archive("root", MTIME), MTIME + 1)
+
+        for mtime, _ in contents(data).values():
+            self.assertEqual(mtime, MTIME)
+
+    @skipIf(GNU_TAR is None, "GNU tar not available")
+    def test_gnu_sparse(self):
+        """Tests GNU sparse members and long names of GNU tar."""
+        with TemporaryDirectory() as tmpd:
+            make_root(root := Path(tmpd))
+            command = [GNU_TAR, "-c", "-f", "-", "--format=gnu", "--sparse", "."]
+            data = run(command, cwd=root, stdout=PIPE, check=True).stdout
+
+        result = normalized(data, SOURCE_DATE_EPOCH)
+        self.assertEqual(len(result) % 512, 0)
+        members = contents(result)
+        self.assertEqual(members[f"./{LONG_NAME}"], (SOURCE_DATE_EPOCH, b"long"))
+        sparse = members["./sparse.img"][1]
+        self.assertEqual(len(sparse), 4 * MIB + 4)
+        self.assertEqual(sparse[:4] + sparse[-4:], b"headtail")
+
+        if BSDTAR is not None:
+            self.assertIn(f"./{LONG_NAME}", bsdtar_list(result))
+
+    @skipIf(BSDTAR is None, "bsdtar not available")
+    def test_bsdtar(self):
+        """Tests bsdtar archives of the same root at different times."""
+        with TemporaryDirectory() as tmpd:
+            make_root(root := Path(tmpd))
+            command = [BSDTAR, "-c", "-f", "-", "--format=pax", "--read-sparse"]
+            first = run([*command, "."], cwd=root, stdout=PIPE, check=True).stdout
+            utime(root / LONG_NAME, (MTIME + 60, MTIME))  # Access and change.
+            owner = ["--uname", "nobody", "--gname", "nogroup"]
+            second = run(
+                [*command, *owner, "."], cwd=root, stdout=PIPE, check=True
+            ).stdout
+
+        self.assertNotEqual(first, second)
+        result = normalized(first, SOURCE_DATE_EPOCH)
+        self.assertEqual(result, normalized(second, SOURCE_DATE_EPOCH))
+        self.assertIn(f"./{LONG_NAME}", bsdtar_list(result))
+
+        with TemporaryDirectory() as tmpd:
+            run(
+                [BSDTAR, "-x", "-f", "-", "-C", tmpd],
+                input=result,
+                stderr=DEVNULL,
+                check=True,
+            )
+            sparse = (Path(tmpd) / "sparse.img").read_bytes()
+            self.assertEqual(sparse[:4] + sparse[-4:], b"headtail")
+            self.assertEqual(len(sparse), 4 * MIB + 4)
+            target = (Path(tmpd) / "link").readlink()
+            self.assertEqual(str(target), LONG_NAME)
+
+
+if __name__ == "__main__":
+    main()
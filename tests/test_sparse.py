@@ -0,0 +1,87 @@
+"""Tests of the sparse file detection."""
+
+from os import SEEK_HOLE, lseek
+from pathlib import Path
+from tempfile import TemporaryDirectory, gettempdir
+from unittest import TestCase, main, skipUnless
+
+from hidsltools.sparse import holes, is_sparse
+
+
+MIB = 1024 * 1024
+SIZE = 8 * MIB
+
+
+def supports_holes(directory: Path | str) -> bool:
+    """Checks whether the file system reports holes via SEEK_HOLE."""
+
+    with TemporaryDirectory(dir=directory) as tmpd:
+        with (Path(tmpd) / "probe").open("wb") as handle:
+            handle.write(b"\1" * MIB)
+            handle.truncate(SIZE)
+            handle.flush()
+
+            try:
+                return lseek(handle.fileno(), 0, SEEK_HOLE) < SIZE
+            except OSError:
+                return False
+
+
+@skipUnless(supports_holes(gettempdir()), "file system lacks SEEK_HOLE")
+class TestSparse(TestCase):
+    """Tests hole detection on synthetic sparse files."""
+
+    def setUp(self):
+        self.tmpd = TemporaryDirectory()
+        self.file = Path(self.tmpd.name) / "file"
+
+    def tearDown(self):
+        self.tmpd.cleanup()
+
+    def test_dense(self):
+        """Tests that files without holes are not inspected."""
+        self.file.write_bytes(b"\1" * SIZE)
+        stat = self.file.stat()
+        self.assertFalse(is_sparse(stat))
+        self.assertEqual(holes(self.file, stat), 0)
+
+    def test_empty(self):
+        """Tests an empty file."""
+        self.file.touch()
+        stat = self.file.stat()
+        self.assertFalse(is_sparse(stat))
+        self.assertEqual(holes(self.file, stat), 0)
+
+    def test_truncated(self):
+        """Tests a file consisting of a single hole."""
+        with self.file.open("wb") as handle:
+            handle.truncate(SIZE)
+
+        stat = self.file.stat()
+        self.assertTrue(is_sparse(stat))
+        self.assertEqual(holes(self.file, stat), SIZE)
+
+    def test_hole_in_between(self):
+        """Tests a file with data at both ends and a hole in between."""
+        with self.file.open("wb") as handle:
+            handle.write(b"\1" * MIB)
+            handle.seek(SIZE - MIB)
+            handle.write(b"\1" * MIB)
+
+        stat = self.file.stat()
+        self.assertTrue(is_sparse(stat))
+        self.assertEqual(holes(self.file, stat), SIZE - 2 * MIB)
+
+    def test_trailing_hole(self):
+        """Tests a file with data followed by a hole."""
+        with self.file.open("wb") as handle:
+            handle.write(b"\1" * MIB)
+            handle.truncate(SIZE)
+
+        stat = self.file.stat()
+        self.assertTrue(is_sparse(stat))
+        self.assertEqual(holes(self.file, stat), SIZE - MIB)
+
+
+if __name__ == "__main__":
+    main()
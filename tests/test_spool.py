@@ -0,0 +1,109 @@
+"""Tests of the bounded spooling of decompressed images."""
+
+from gzip import compress
+from os import read, urandom
+from pathlib import Path
+from signal import SIGKILL
+from subprocess import Popen
+from tempfile import TemporaryDirectory
+from threading import Event, Thread
+from time import monotonic, sleep
+from unittest import TestCase, main
+from unittest.mock import patch
+
+from hidsltools.spool import CHUNK_SIZE, Spool
+from hidsltools.types import Compression
+
+
+DATA = urandom(8 * CHUNK_SIZE)
+SIZE = 2 * CHUNK_SIZE
+TIMEOUT = 30  # Seconds
+
+
+def read_all(fd: int) -> bytes:
+    """Reads the fd until EOF."""
+
+    data = bytearray()
+
+    while chunk := read(fd, CHUNK_SIZE):
+        data += chunk
+
+    return bytes(data)
+
+
+def wait_until_full(spool: Spool) -> None:
+    """Waits until the spool's buffer is full."""
+
+    deadline = monotonic() + TIMEOUT
+
+    while not spool.chunks.full():
+        if monotonic() > deadline:
+            raise TimeoutError("Spool did not fill up.")
+
+        sleep(0.01)
+
+
+class TestSpool(TestCase):
+    """Tests filling, draining and cancelling the spool."""
+
+    def setUp(self):
+        self.tmpd = TemporaryDirectory()
+        self.image = Path(self.tmpd.name) / "image.tar.gz"
+        self.image.write_bytes(compress(DATA, compresslevel=1))
+
+    def tearDown(self):
+        self.tmpd.cleanup()
+
+    def test_fill_and_drain(self):
+        """Tests that the buffer is bounded and then drained completely."""
+        with Spool(self.image, Compression.GZIP, SIZE) as spool:
+            wait_until_full(spool)
+            self.assertEqual(spool.spooled, SIZE)
+
+            with spool.stream() as fd:
+                self.assertEqual(read_all(fd), DATA)
+
+        self.assertEqual(spool.process.returncode, 0)
+        self.assertIsNone(spool.error)
+
+    def test_cancel_before_extraction(self):
+        """Tests cancelling before the decompressor has been started."""
+        started = Event()
+
+        def popen(*args, **kwargs):
+            started.wait(TIMEOUT)
+            return Popen(*args, **kwargs)
+
+        with patch("hidsltools.spool.Popen", popen):
+            spool = Spool(self.image, Compression.GZIP, SIZE)
+            spool.start()
+            canceller = Thread(target=spool.cancel, daemon=True)
+            canceller.start()
+
+            while not spool.cancelled:
+                sleep(0.01)
+
+            started.set()
+            canceller.join(TIMEOUT)
+
+        self.assertFalse(canceller.is_alive())
+        self.assertFalse(spool.is_alive())
+        self.assertEqual(spool.process.returncode, -SIGKILL)
+        self.assertIsNone(spool.error)
+
+    def test_early_stop(self):
+        """Tests an extraction that stops reading before the end."""
+        with Spool(self.image, Compression.GZIP, SIZE) as spool:
+            wait_until_full(spool)
+
+            with spool.stream() as fd:
+                self.assertEqual(read(fd, 512), DATA[:512])
+
+            self.assertFalse(spool.is_alive())
+
+        self.assertEqual(spool.process.returncode, -SIGKILL)
+        self.assertIsNone(spool.error)
+
+
+if __name__ == "__main__":
+    main()
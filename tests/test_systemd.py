@@ -0,0 +1,142 @@
+"""Tests of offline unit enabling against systemctl --root."""
+
+from os import readlink
+from pathlib import Path
+from shutil import which
+from subprocess import DEVNULL, run
+from tempfile import TemporaryDirectory
+from unittest import TestCase, main, skipIf
+
+from hidsltools.systemd import disable_units, enable_units
+
+
+SYSTEMCTL = which("systemctl")
+UNITS = {
+    "a.service": (
+        "[Unit]\n"
+        "Description=Fixture A\n"
+        "\n"
+        "[Service]\n"
+        "ExecStart=/bin/true\n"
+        "\n"
+        "[Install]\n"
+        "WantedBy=multi-user.target\n"
+        "RequiredBy=graphical.target\n"
+        "Alias=alpha.service\n"
+        "Also=b.service\n"
+    ),
+    "b.service": (
+        "[Service]\n"
+        "ExecStart=/bin/true\n"
+        "\n"
+        "[Install]\n"
+        "WantedBy=timers.target\n"
+    ),
+    "c@.service": (
+        "[Service]\n"
+        "ExecStart=/bin/true\n"
+        "\n"
+        "[Install]\n"
+        "WantedBy=multi-user.target\n"
+        "DefaultInstance=tty1\n"
+    ),
+    "static.service": "[Service]\nExecStart=/bin/true\n",
+}
+ENABLED = {
+    "alpha.service": "/usr/lib/systemd/system/a.service",
+    "graphical.target.requires/a.service": "/usr/lib/systemd/system/a.service",
+    "multi-user.target.wants/a.service": "/usr/lib/systemd/system/a.service",
+    "multi-user.target.wants/c@tty1.service": "/usr/lib/systemd/system/c@.service",
+    "timers.target.wants/b.service": "/usr/lib/systemd/system/b.service",
+}
+
+
+def make_root(root: Path) -> None:
+    """Creates a root with the fixture units."""
+
+    unit_dir = root / "usr/lib/systemd/system"
+    unit_dir.mkdir(parents=True)
+    (root / "etc/systemd/system").mkdir(parents=True)
+
+    for name, content in UNITS.items():
+        (unit_dir / name).write_text(content, encoding="utf-8")
+
+
+def links(root: Path) -> dict[str, str]:
+    """Returns the symlinks below /etc/systemd/system and their targets."""
+
+    config = root / "etc/systemd/system"
+    return {
+        str(path.relative_to(config)): readlink(path)
+        for path in config.rglob("*")
+        if path.is_symlink()
+    }
+
+
+def systemctl(root: Path, *args: str) -> None:
+    """Runs systemctl on the root."""
+
+    run([SYSTEMCTL, "--root", str(root), *args], check=True, stderr=DEVNULL)
+
+
+class TestEnableUnits(TestCase):
+    """Tests enabling and disabling of units."""
+
+    def setUp(self):
+        self.tmpd = TemporaryDirectory()
+        self.root = Path(self.tmpd.name)
+        make_root(self.root)
+
+    def tearDown(self):
+        self.tmpd.cleanup()
+
+    def test_enable(self):
+        """Tests WantedBy=, RequiredBy=, Alias=, Also= and DefaultInstance=."""
+        enable_units(["a.service", "c@.service", "static.service"], root=self.root)
+        self.assertEqual(links(self.root), ENABLED)
+
+    def test_enable_twice(self):
+        """Tests that enabling is idempotent."""
+        enable_units(["a.service", "c@.service"], root=self.root)
+        enable_units(["a.service", "c@.service"], root=self.root)
+        self.assertEqual(links(self.root), ENABLED)
+
+    def test_disable(self):
+        """Tests that disabling removes the links of the units and Also= units."""
+        enable_units(["a.service", "c@.service"], root=self.root)
+        disable_units(["a.service"], root=self.root)
+        link = "multi-user.target.wants/c@tty1.service"
+        self.assertEqual(links(self.root), {link: ENABLED[link]})
+
+    def test_masked(self):
+        """Tests that masked units stay masked."""
+        mask = self.root / "etc/systemd/system/b.service"
+        mask.symlink_to("/dev/null")
+        disable_units(["a.service"], root=self.root)
+        self.assertEqual(links(self.root), {"b.service": "/dev/null"})
+
+    @skipIf(SYSTEMCTL is None, "systemctl not available")
+    def test_enable_like_systemctl(self):
+        """Compares the symlinks with those of systemctl --root enable."""
+        with TemporaryDirectory() as tmpd:
+            reference = Path(tmpd)
+            make_root(reference)
+            systemctl(reference, "enable", "a.service", "c@.service")
+            enable_units(["a.service", "c@.service"], root=self.root)
+            self.assertEqual(links(self.root), links(reference))
+
+    @skipIf(SYSTEMCTL is None, "systemctl not available")
+    def test_disable_like_systemctl(self):
+        """Compares the symlinks with those of systemctl --root disable."""
+        with TemporaryDirectory() as tmpd:
+            reference = Path(tmpd)
+            make_root(reference)
+            systemctl(reference, "enable", "a.service", "c@.service")
+            systemctl(reference, "disable", "a.service")
+            enable_units(["a.service", "c@.service"], root=self.root)
+            disable_units(["a.service"], root=self.root)
+            self.assertEqual(links(self.root), links(reference))
+
+
+if __name__ == "__main__":
+    main()
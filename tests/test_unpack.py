@@ -0,0 +1,189 @@
+"""Tests of the in-process extraction against bsdtar."""
+
+from os import (
+    O_RDONLY,
+    SEEK_DATA,
+    SEEK_HOLE,
+    chmod,
+    chown,
+    close,
+    geteuid,
+    getxattr,
+    link,
+    listxattr,
+    lseek,
+    mkfifo,
+    open as os_open,
+    readlink,
+    setxattr,
+    utime,
+)
+from pathlib import Path
+from shutil import which
+from stat import S_IFMT, S_IMODE
+from tempfile import TemporaryDirectory
+from unittest import TestCase, main, skipIf
+from unittest.mock import patch
+
+from hidsltools.bsdtar import create, extract
+from hidsltools.types import Compression
+from hidsltools.unpack import unpack
+
+
+BSDTAR = which("bsdtar")
+MIB = 1024 * 1024
+MTIME = 1_600_000_000_123_456_789
+OWNER = (1000, 1000)
+
+
+def make_root(root: Path) -> None:
+    """Creates a root covering the metadata that extraction restores."""
+
+    (etc := root / "etc").mkdir(parents=True)
+    (etc / "shadow").write_text("root:*::0:::::\n", encoding="utf-8")
+    chmod(etc / "shadow", 0o600)
+    (tmp := root / "tmp").mkdir()
+    chmod(tmp, 0o1777)
+    (home := root / "home/user").mkdir(parents=True)
+    (home / "notes.txt").write_text("notes\n", encoding="utf-8")
+    (home / "bin").write_bytes(b"\x7fELF")
+    chmod(home / "bin", 0o4755)
+    (home / "notes.txt").chmod(0o640)
+    (home / "tagged").write_text("tagged\n", encoding="utf-8")
+    link(home / "notes.txt", home / "hardlink.txt")
+    (home / "link").symlink_to("notes.txt")
+    (home / "dangling").symlink_to("/nonexistent")
+    mkfifo(root / "fifo", 0o620)
+
+    with (root / "sparse.img").open("wb") as file:
+        file.write(b"\1" * MIB)
+        file.seek(3 * MIB)
+        file.write(b"\2" * MIB)
+        file.truncate(6 * MIB)
+
+    try:
+        setxattr(home / "tagged", "user.comment", b"hidsl")
+    except OSError:
+        pass  # File system without user xattrs.
+
+    if geteuid() == 0:
+        for path in [home, home / "notes.txt", home / "link"]:
+            chown(path, *OWNER, follow_symlinks=False)
+
+    for path in sorted(root.rglob("*"), key=lambda path: -len(path.parts)):
+        utime(path, ns=(MTIME, MTIME), follow_symlinks=False)
+
+
+def sparse_map(file: Path) -> list[tuple[int, int]]:
+    """Returns the data regions of the file."""
+
+    regions = []
+    fd = os_open(file, O_RDONLY)
+
+    try:
+        offset = 0
+
+        while True:
+            try:
+                start = lseek(fd, offset, SEEK_DATA)
+            except OSError:
+                break
+
+            offset = lseek(fd, start, SEEK_HOLE)
+            regions.append((start, offset))
+    finally:
+        close(fd)
+
+    return regions
+
+
+def xattrs(file: Path) -> list[tuple[str, bytes]]:
+    """Returns the extended attributes of the file."""
+
+    return sorted((key, getxattr(file, key)) for key in listxattr(file))
+
+
+def describe(root: Path) -> dict[str, tuple]:
+    """Returns the restored metadata of all inodes below root."""
+
+    inodes = {}
+    result = {}
+
+    for path in sorted(root.rglob("*")):
+        stat = path.lstat()
+        name = str(path.relative_to(root))
+        inodes.setdefault(stat.st_ino, []).append(name)
+        symlink = path.is_symlink()
+        result[name] = [
+            S_IFMT(stat.st_mode),
+            S_IMODE(stat.st_mode),
+            stat.st_uid,
+            stat.st_gid,
+            stat.st_size,
+            stat.st_mtime_ns,
+            readlink(path) if symlink else None,
+            None if symlink else xattrs(path),
+            sparse_map(path) if path.is_file() and not symlink else None,
+            path.read_bytes() if path.is_file() and not symlink else None,
+        ]
+
+    for names in inodes.values():
+        for name in names:
+            result[name].append(names)
+
+    return {name: tuple(values) for name, values in result.items()}
+
+
+@skipIf(BSDTAR is None, "bsdtar not available")
+class TestUnpack(TestCase):
+    """Compares the in-process extraction with bsdtar's."""
+
+    def setUp(self):
+        self.tmpd = TemporaryDirectory()
+        self.base = Path(self.tmpd.name)
+        make_root(root := self.base / "root")
+        self.image = self.base / "image.tar.gz"
+        self.patch = patch("hidsltools.bsdtar.BSDTAR", BSDTAR)
+        self.patch.start()
+        create(self.image, root, compression=Compression.GZIP, compression_level=1)
+
+    def tearDown(self):
+        self.patch.stop()
+        self.tmpd.cleanup()
+
+    def extract(self, **kwargs) -> tuple[dict[str, tuple], dict[str, tuple]]:
+        """Extracts the image with both engines and describes the results."""
+        (expected := self.base / "bsdtar").mkdir()
+        (actual := self.base / "native").mkdir()
+        extract(self.image, expected)
+        unpack(self.image, actual, **kwargs)
+        return describe(expected), describe(actual)
+
+    def test_fidelity(self):
+        """Tests modes, owners, xattrs, links, sparse maps and mtimes."""
+        expected, actual = self.extract(workers=4)
+        self.assertEqual(actual.keys(), expected.keys())
+
+        for name, metadata in expected.items():
+            with self.subTest(name=name):
+                self.assertEqual(actual[name], metadata)
+
+    def test_single_writer(self):
+        """Tests the extraction without a writer pool."""
+        expected, actual = self.extract(workers=1)
+        self.assertEqual(actual, expected)
+
+    def test_fd(self):
+        """Tests the extraction from an fd with a detected compression."""
+        (expected := self.base / "bsdtar").mkdir()
+        (actual := self.base / "native").mkdir()
+        extract(self.image, expected)
+
+        with self.image.open("rb") as file:
+            unpack(file.fileno(), actual)
+
+        self.assertEqual(describe(actual), describe(expected))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Tests of the compression variants of one tar stream."""
+
+from hashlib import sha256
+from os import urandom
+from pathlib import Path
+from shutil import which
+from subprocess import PIPE, run
+from tempfile import TemporaryDirectory
+from threading import Thread
+from unittest import TestCase, main, skipIf
+from unittest.mock import patch
+
+from hidsltools.types import Compression
+from hidsltools.variants import create
+
+
+BSDTAR = which("bsdtar")
+MIB = 1024 * 1024
+SIZE = 20 * MIB  # Exceeds the pipe and queue buffers.
+TIMEOUT = 60  # Seconds
+
+
+def failing_normalize(source, _):
+    """Yields one block of the source and fails."""
+
+    yield source.read(512)
+    raise RuntimeError("Normalization failed.")
+
+
+@skipIf(BSDTAR is None, "bsdtar not available")
+class TestVariants(TestCase):
+    """Tests the concurrent creation of several tarballs."""
+
+    def setUp(self):
+        self.tmpd = TemporaryDirectory()
+        self.base = Path(self.tmpd.name)
+        self.root = self.base / "root"
+        self.root.mkdir()
+        (self.root / "data").write_bytes(urandom(SIZE))
+        self.tarballs = {
+            Compression.GZIP: self.base / "image.tar.gz",
+            Compression.ZSTD: self.base / "image.tar.zst",
+        }
+        self.patch = patch("hidsltools.bsdtar.BSDTAR", BSDTAR)
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+        self.tmpd.cleanup()
+
+    @skipIf(which("zstd") is None, "zstd not available")
+    def test_variants(self):
+        """Tests that all variants contain the same tar stream."""
+        digests = create(self.tarballs, self.root, compression_level=1)
+        streams = set()
+
+        for compression, tarball in self.tarballs.items():
+            digest = sha256(tarball.read_bytes()).hexdigest()
+            self.assertEqual(digests[compression], digest)
+            command = [compression.full_name, "-d", "-c", str(tarball)]
+            streams.add(run(command, stdout=PIPE, check=True).stdout)
+
+        self.assertEqual(len(streams), 1)
+        listing = run([BSDTAR, "-t", "-f", "-"], input=streams.pop(), stdout=PIPE)
+        self.assertEqual(listing.stdout.split(), [b"data"])
+
+    def test_failing_chunks(self):
+        """Tests that an error while reading the stream does not hang."""
+        errors = []
+
+        def target():
+            try:
+                create(
+                    {Compression.GZIP: self.tarballs[Compression.GZIP]},
+                    self.root,
+                    compression_level=1,
+                    reproducible=True,
+                )
+            except Exception as error:
+                errors.append(error)
+
+        with patch("hidsltools.variants.normalize", failing_normalize):
+            thread = Thread(target=target, daemon=True)
+            thread.start()
+            thread.join(TIMEOUT)
+
+        self.assertFalse(thread.is_alive(), "create() hangs")
+        self.assertEqual(len(errors), 1)
+        self.assertIsInstance(errors[0], RuntimeError)
+
+
+if __name__ == "__main__":
+    main()